@@ -1,5 +1,25 @@
 from .helpers import *
 from .configuration import *
+from .metrics import *
+from .index import *
 from .storage import *
+from .scheduler import *
+from .transfer import *
+from .manifest import *
+from .hashing import *
+from .client import *
+from .progress import *
 from .downloader import *
+from .queue import *
+from .thumbnails import *
+from .parameters import *
+from .metadata import *
+from .stats import *
+from .watcher import *
+from .events import *
+from .prewarm import *
+from .trash import *
+from .render import *
+from .leader import *
+from .serving import *
 from .server import *
\ No newline at end of file
@@ -0,0 +1,133 @@
+import requests
+from time import sleep
+from random import uniform
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from .configuration import DownloaderConfiguration
+from .metrics import DOWNLOAD_TIME_TO_FIRST_BYTE
+
+
+# Class: TransferError
+class TransferError(IOError):
+    pass
+
+
+# Class: SlowTransferError
+class SlowTransferError(TransferError):
+    pass
+
+
+# Class: TransferCancelledError
+class TransferCancelledError(IOError):
+    pass
+
+
+# Exceptions raised by an interrupted or failed transfer that are worth retrying
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    ProtocolError,
+    ReadTimeoutError,
+    ConnectionResetError,
+    TimeoutError,
+    TransferError,
+)
+
+
+# Response statuses the pooled session retries with backoff before handing the response back
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+# Returns the host of a URL as used in the per-host limits and metrics
+def get_host(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+# Class: HttpClient
+class HttpClient:
+    # Downloader configuration
+    _configuration: DownloaderConfiguration
+    # Pooled session shared by every request of the downloader
+    _session: requests.Session
+    # Session without retries, used to probe hosts that are expected to be down at times
+    _probe_session: requests.Session
+
+    # Constructor, the session only retries error statuses, failed connections, resets and short bodies are retried
+    # by the transfer loops of the downloader so that an attempt is never multiplied by the retries of the adapter
+    def __init__(self, configuration: DownloaderConfiguration):
+        self._configuration = configuration
+        self._session = requests.Session()
+
+        adapter = HTTPAdapter(
+            pool_connections=configuration.get_pool_connections(),
+            pool_maxsize=configuration.get_pool_maxsize(),
+            max_retries=Retry(
+                total=None,
+                connect=0,
+                read=0,
+                other=0,
+                status=configuration.get_retries(),
+                backoff_factor=configuration.get_backoff_factor(),
+                backoff_max=configuration.get_backoff_max(),
+                backoff_jitter=configuration.get_backoff_factor(),
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=["HEAD", "GET"],
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            ),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._probe_session = requests.Session()
+        probe_adapter = HTTPAdapter(
+            pool_connections=configuration.get_pool_connections(),
+            pool_maxsize=configuration.get_pool_maxsize(),
+            max_retries=0,
+        )
+        self._probe_session.mount("http://", probe_adapter)
+        self._probe_session.mount("https://", probe_adapter)
+
+    # Returns the downloader configuration
+    def get_configuration(self) -> DownloaderConfiguration:
+        return self._configuration
+
+    # Returns the pooled session
+    def get_session(self) -> requests.Session:
+        return self._session
+
+    # Returns the connect and read timeouts
+    def get_timeout(self) -> tuple:
+        return self._configuration.get_connect_timeout(), self._configuration.get_read_timeout()
+
+    # Sends a streaming GET request, recording the time to its response headers for the host that answered
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        response = self._session.get(url, headers=headers, stream=True, timeout=self.get_timeout())
+        DOWNLOAD_TIME_TO_FIRST_BYTE.observe(response.elapsed.total_seconds(), get_host(response.url))
+        return response
+
+    # Sends a HEAD request, following redirects
+    def head(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self._session.head(url, headers=headers, allow_redirects=True, timeout=self.get_timeout())
+
+    # Sends a single HEAD request without retries, following redirects
+    def probe(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self._probe_session.head(url, headers=headers, allow_redirects=True, timeout=self.get_timeout())
+
+    # Returns TRUE if another attempt is allowed after the given number of failed attempts
+    def can_retry(self, attempt: int) -> bool:
+        return attempt < self._configuration.get_retries()
+
+    # Sleeps for an exponentially growing, fully jittered delay before the next attempt
+    def wait_before_retry(self, attempt: int) -> None:
+        delay = min(self._configuration.get_backoff_max(), self._configuration.get_backoff_factor() * (2 ** attempt))
+        sleep(uniform(0, delay))
+
+    # Closes every pooled connection
+    def close(self) -> None:
+        self._session.close()
+        self._probe_session.close()
@@ -3,6 +3,9 @@ from yaml import safe_load
 from json import dumps, loads
 from typing import Dict, List, Any
 
+# Serving modes of the gallery server
+SERVER_MODES = ["development", "threaded", "prefork"]
+
 
 # Class: DownloadableEntity
 class DownloadableEntity:
@@ -10,11 +13,17 @@ class DownloadableEntity:
     _name: str
     # URL to download from
     _url: str
+    # Expected SHA-256 or short AUTOV2 hash of the file (empty if not enforced)
+    _sha256: str
+    # Mirror URLs serving the same file
+    _mirrors: List[str]
 
     # Constructor
-    def __init__(self, name: str, url: str):
+    def __init__(self, name: str, url: str, sha256: str = "", mirrors: List[str] = None):
         self._name = name
         self._url = url
+        self._sha256 = sha256
+        self._mirrors = [mirror for mirror in (mirrors or []) if mirror != "" and mirror != url]
 
     # Returns the name of the entity
     def get_name(self) -> str:
@@ -24,15 +33,25 @@ class DownloadableEntity:
     def get_url(self) -> str:
         return self._url
 
+    # Returns the expected hash of the entity
+    def get_sha256(self) -> str:
+        return self._sha256
+
+    # Returns the mirror URLs of the entity
+    def get_mirrors(self) -> List[str]:
+        return self._mirrors
+
     # Returns TRUE if the entity is valid
     def is_valid(self) -> bool:
         return self.get_name() != "" and self.get_url() != ""
 
     # Returns the entity as a dictionary
-    def to_dict(self) -> Dict[str, str]:
+    def to_dict(self) -> Dict[str, Any]:
         return {
             "name": self.get_name(),
             "url": self.get_url(),
+            "sha256": self.get_sha256(),
+            "mirrors": self.get_mirrors(),
         }
 
     # Returns the entity as a JSON string
@@ -48,7 +67,9 @@ class DownloadableEntity:
     def from_dict(entity: Dict[str, str]) -> "DownloadableEntity":
         return DownloadableEntity(
             name=entity.get("name", ""),
-            url=entity.get("url", "")
+            url=entity.get("url", ""),
+            sha256=entity.get("sha256", ""),
+            mirrors=entity.get("mirrors", [])
         )
 
     # Creates an entity from a JSON string
@@ -224,11 +245,99 @@ class GalleryConfiguration:
     _listen_address: str
     # Listen port
     _listen_port: int
+    # Maximum width and height of thumbnails in pixels
+    _thumbnail_size: int
+    # Thumbnail image format, either "webp" or "jpeg"
+    _thumbnail_format: str
+    # Thumbnail encoder quality from 1 to 100
+    _thumbnail_quality: int
+    # Maximum size of the thumbnail cache in bytes
+    _thumbnail_cache_size: int
+    # Number of processes generating thumbnails
+    _thumbnail_workers: int
+    # TRUE if new images are detected in the background to prepare their thumbnails and metadata
+    _watch: bool
+    # Number of seconds between two scans when inotify is not available
+    _watch_interval: float
+    # Maximum number of new images prepared per second
+    _prewarm_rate: float
+    # Number of images per page of a folder listing
+    _page_size: int
+    # Maximum number of images a client may request per page
+    _max_page_size: int
+    # Serving mode, either "development", "threaded" (waitress) or "prefork" (gunicorn)
+    _server_mode: str
+    # Number of worker processes in prefork mode
+    _workers: int
+    # Number of request threads per worker process
+    _threads: int
+    # Number of seconds after which a request or an idle connection is dropped
+    _timeout: int
+    # Maximum number of pending connections
+    _backlog: int
+    # Number of seconds running requests are given to complete on shutdown in prefork mode
+    _graceful_timeout: int
+    # TRUE if image files are handed to the front proxy through the X-Sendfile header instead of being sent by the server
+    _x_sendfile: bool
+    # Number of seconds deleted images can be restored before the trash is purged
+    _undo_window: float
+    # Maximum size of the rendered pages cache in bytes, 0 disables it
+    _render_cache_size: int
+    # Whether request and internal metrics are recorded and exposed on /metrics
+    _metrics: bool
+    # Maximum number of folder listings kept in memory, the least recently used are dropped first
+    _folder_index_size: int
 
     # Constructor
-    def __init__(self, listen_address: str, listen_port: int):
+    def __init__(
+        self,
+        listen_address: str,
+        listen_port: int,
+        thumbnail_size: int = 384,
+        thumbnail_format: str = "webp",
+        thumbnail_quality: int = 80,
+        thumbnail_cache_size: int = 512 * 1024 * 1024,
+        thumbnail_workers: int = 2,
+        watch: bool = True,
+        watch_interval: float = 2.0,
+        prewarm_rate: float = 4.0,
+        page_size: int = 60,
+        max_page_size: int = 500,
+        server_mode: str = "development",
+        workers: int = 2,
+        threads: int = 8,
+        timeout: int = 60,
+        backlog: int = 1024,
+        graceful_timeout: int = 30,
+        x_sendfile: bool = False,
+        undo_window: float = 300.0,
+        render_cache_size: int = 32 * 1024 * 1024,
+        metrics: bool = True,
+        folder_index_size: int = 256,
+    ):
         self._listen_address = listen_address
         self._listen_port = listen_port
+        self._thumbnail_size = max(16, thumbnail_size)
+        self._thumbnail_format = thumbnail_format if thumbnail_format in ["webp", "jpeg"] else "webp"
+        self._thumbnail_quality = min(100, max(1, thumbnail_quality))
+        self._thumbnail_cache_size = max(0, thumbnail_cache_size)
+        self._thumbnail_workers = max(1, thumbnail_workers)
+        self._watch = watch
+        self._watch_interval = max(0.1, watch_interval)
+        self._prewarm_rate = max(0.1, prewarm_rate)
+        self._page_size = max(1, page_size)
+        self._max_page_size = max(1, max_page_size)
+        self._server_mode = server_mode if server_mode in SERVER_MODES else "development"
+        self._workers = max(1, workers)
+        self._threads = max(1, threads)
+        self._timeout = max(1, timeout)
+        self._backlog = max(1, backlog)
+        self._graceful_timeout = max(0, graceful_timeout)
+        self._x_sendfile = x_sendfile
+        self._undo_window = max(0.0, undo_window)
+        self._render_cache_size = max(0, render_cache_size)
+        self._metrics = metrics
+        self._folder_index_size = max(1, folder_index_size)
 
     # Returns the listen address
     def get_listen_address(self) -> str:
@@ -238,11 +347,116 @@ class GalleryConfiguration:
     def get_listen_port(self) -> int:
         return self._listen_port
 
+    # Returns the maximum width and height of thumbnails in pixels
+    def get_thumbnail_size(self) -> int:
+        return self._thumbnail_size
+
+    # Returns the thumbnail image format, either "webp" or "jpeg"
+    def get_thumbnail_format(self) -> str:
+        return self._thumbnail_format
+
+    # Returns the thumbnail encoder quality from 1 to 100
+    def get_thumbnail_quality(self) -> int:
+        return self._thumbnail_quality
+
+    # Returns the maximum size of the thumbnail cache in bytes
+    def get_thumbnail_cache_size(self) -> int:
+        return self._thumbnail_cache_size
+
+    # Returns the number of processes generating thumbnails
+    def get_thumbnail_workers(self) -> int:
+        return self._thumbnail_workers
+
+    # Returns TRUE if new images are detected in the background to prepare their thumbnails and metadata
+    def is_watch_enabled(self) -> bool:
+        return self._watch
+
+    # Returns the number of seconds between two scans when inotify is not available
+    def get_watch_interval(self) -> float:
+        return self._watch_interval
+
+    # Returns the maximum number of new images prepared per second
+    def get_prewarm_rate(self) -> float:
+        return self._prewarm_rate
+
+    # Returns the number of images per page of a folder listing
+    def get_page_size(self) -> int:
+        return self._page_size
+
+    # Returns the maximum number of images a client may request per page
+    def get_max_page_size(self) -> int:
+        return self._max_page_size
+
+    # Returns the serving mode, either "development", "threaded" (waitress) or "prefork" (gunicorn)
+    def get_server_mode(self) -> str:
+        return self._server_mode
+
+    # Returns the number of worker processes in prefork mode
+    def get_workers(self) -> int:
+        return self._workers
+
+    # Returns the number of request threads per worker process
+    def get_threads(self) -> int:
+        return self._threads
+
+    # Returns the number of seconds after which a request or an idle connection is dropped
+    def get_timeout(self) -> int:
+        return self._timeout
+
+    # Returns the maximum number of pending connections
+    def get_backlog(self) -> int:
+        return self._backlog
+
+    # Returns the number of seconds running requests are given to complete on shutdown in prefork mode
+    def get_graceful_timeout(self) -> int:
+        return self._graceful_timeout
+
+    # Returns TRUE if image files are handed to the front proxy through the X-Sendfile header instead of being sent by the server
+    def is_x_sendfile_enabled(self) -> bool:
+        return self._x_sendfile
+
+    # Returns the number of seconds deleted images can be restored before the trash is purged
+    def get_undo_window(self) -> float:
+        return self._undo_window
+
+    # Returns the maximum size of the rendered pages cache in bytes, 0 disables it
+    def get_render_cache_size(self) -> int:
+        return self._render_cache_size
+
+    # Returns TRUE if request and internal metrics are recorded and exposed on /metrics
+    def is_metrics_enabled(self) -> bool:
+        return self._metrics
+
+    # Returns the maximum number of folder listings kept in memory, the least recently used are dropped first
+    def get_folder_index_size(self) -> int:
+        return self._folder_index_size
+
     # Returns the configuration as a dictionary
     def to_dict(self) -> Dict[str, Any]:
         return {
             "listen_address": self.get_listen_address(),
             "listen_port": self.get_listen_port(),
+            "thumbnail_size": self.get_thumbnail_size(),
+            "thumbnail_format": self.get_thumbnail_format(),
+            "thumbnail_quality": self.get_thumbnail_quality(),
+            "thumbnail_cache_size": self.get_thumbnail_cache_size(),
+            "thumbnail_workers": self.get_thumbnail_workers(),
+            "watch": self.is_watch_enabled(),
+            "watch_interval": self.get_watch_interval(),
+            "prewarm_rate": self.get_prewarm_rate(),
+            "page_size": self.get_page_size(),
+            "max_page_size": self.get_max_page_size(),
+            "server_mode": self.get_server_mode(),
+            "workers": self.get_workers(),
+            "threads": self.get_threads(),
+            "timeout": self.get_timeout(),
+            "backlog": self.get_backlog(),
+            "graceful_timeout": self.get_graceful_timeout(),
+            "x_sendfile": self.is_x_sendfile_enabled(),
+            "undo_window": self.get_undo_window(),
+            "render_cache_size": self.get_render_cache_size(),
+            "metrics": self.is_metrics_enabled(),
+            "folder_index_size": self.get_folder_index_size(),
         }
 
     # Returns the configuration as a JSON string
@@ -259,6 +473,27 @@ class GalleryConfiguration:
         return GalleryConfiguration(
             listen_address=configuration.get("listen_address", "0.0.0.0"),
             listen_port=configuration.get("listen_port", 5000),
+            thumbnail_size=configuration.get("thumbnail_size", 384),
+            thumbnail_format=configuration.get("thumbnail_format", "webp"),
+            thumbnail_quality=configuration.get("thumbnail_quality", 80),
+            thumbnail_cache_size=configuration.get("thumbnail_cache_size", 512 * 1024 * 1024),
+            thumbnail_workers=configuration.get("thumbnail_workers", 2),
+            watch=configuration.get("watch", True),
+            watch_interval=configuration.get("watch_interval", 2.0),
+            prewarm_rate=configuration.get("prewarm_rate", 4.0),
+            page_size=configuration.get("page_size", 60),
+            max_page_size=configuration.get("max_page_size", 500),
+            server_mode=configuration.get("server_mode", "development"),
+            workers=configuration.get("workers", 2),
+            threads=configuration.get("threads", 8),
+            timeout=configuration.get("timeout", 60),
+            backlog=configuration.get("backlog", 1024),
+            graceful_timeout=configuration.get("graceful_timeout", 30),
+            x_sendfile=configuration.get("x_sendfile", False),
+            undo_window=configuration.get("undo_window", 300.0),
+            render_cache_size=configuration.get("render_cache_size", 32 * 1024 * 1024),
+            metrics=configuration.get("metrics", True),
+            folder_index_size=configuration.get("folder_index_size", 256),
         )
 
     # Creates a configuration from a JSON string
@@ -267,6 +502,269 @@ class GalleryConfiguration:
         return GalleryConfiguration.from_dict(loads(configuration))
 
 
+# Class: DownloaderConfiguration
+class DownloaderConfiguration:
+    # Maximum number of concurrent downloads
+    _max_concurrency: int
+    # Maximum number of concurrent connections per host
+    _per_host_connections: int
+    # Number of parallel byte ranges used for a single large file
+    _segments: int
+    # Minimum size of a single byte range in bytes
+    _min_segment_size: int
+    # Number of seconds a verified file is trusted without asking the server again
+    _freshness: int
+    # Number of host connection pools kept by the HTTP session
+    _pool_connections: int
+    # Maximum number of kept-alive connections per host
+    _pool_maxsize: int
+    # Connection timeout in seconds
+    _connect_timeout: float
+    # Read timeout in seconds
+    _read_timeout: float
+    # Number of retries for failed requests and transfers
+    _retries: int
+    # Base delay in seconds of the exponential backoff
+    _backoff_factor: float
+    # Maximum delay in seconds between retries
+    _backoff_max: float
+    # Progress output mode, either "text" or "json"
+    _progress: str
+    # Number of seconds between two progress reports
+    _progress_interval: float
+    # Initial size of the read buffer in bytes
+    _min_buffer_size: int
+    # Maximum size the read buffer grows to in bytes
+    _max_buffer_size: int
+    # Number of bytes fetched from each mirror to measure its throughput
+    _probe_sample_size: int
+    # Throughput in bytes per second below which a transfer fails over to another mirror (0 disables it)
+    _min_throughput: int
+    # Number of seconds the throughput is averaged over before failing over
+    _throughput_window: float
+    # Base URLs of sibling sdm servers tried before the origin
+    _peers: List[str]
+    # Number of worker threads draining the server download queue
+    _queue_workers: int
+    # Whether the download API accepts models that are not in the configuration, from the allowed hosts only
+    _custom_urls: bool
+    # Hosts the download API may fetch models that are not in the configuration from
+    _allowed_hosts: List[str]
+
+    # Constructor
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        per_host_connections: int = 2,
+        segments: int = 4,
+        min_segment_size: int = 32 * 1024 * 1024,
+        freshness: int = 0,
+        pool_connections: int = 10,
+        pool_maxsize: int = 16,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        retries: int = 5,
+        backoff_factor: float = 1,
+        backoff_max: float = 60,
+        progress: str = "text",
+        progress_interval: float = 1.0,
+        min_buffer_size: int = 64 * 1024,
+        max_buffer_size: int = 8 * 1024 * 1024,
+        probe_sample_size: int = 256 * 1024,
+        min_throughput: int = 0,
+        throughput_window: float = 10,
+        peers: List[str] = None,
+        queue_workers: int = 2,
+        custom_urls: bool = False,
+        allowed_hosts: List[str] = None,
+    ):
+        self._max_concurrency = max(1, max_concurrency)
+        self._per_host_connections = max(1, per_host_connections)
+        self._segments = max(1, segments)
+        self._min_segment_size = max(1, min_segment_size)
+        self._freshness = max(0, freshness)
+        self._pool_connections = max(1, pool_connections)
+        self._pool_maxsize = max(1, pool_maxsize)
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._retries = max(0, retries)
+        self._backoff_factor = max(0, backoff_factor)
+        self._backoff_max = max(0, backoff_max)
+        self._progress = progress
+        self._progress_interval = max(0.1, progress_interval)
+        self._min_buffer_size = max(1024, min_buffer_size)
+        self._max_buffer_size = max(min_buffer_size, max_buffer_size)
+        self._probe_sample_size = max(0, probe_sample_size)
+        self._min_throughput = max(0, min_throughput)
+        self._throughput_window = max(1, throughput_window)
+        self._peers = [peer.rstrip("/") for peer in (peers or []) if peer != ""]
+        self._queue_workers = max(1, queue_workers)
+        self._custom_urls = custom_urls
+        self._allowed_hosts = [host.strip().lower() for host in (allowed_hosts or []) if host.strip() != ""]
+
+    # Returns the maximum number of concurrent downloads
+    def get_max_concurrency(self) -> int:
+        return self._max_concurrency
+
+    # Returns the maximum number of concurrent connections per host
+    def get_per_host_connections(self) -> int:
+        return self._per_host_connections
+
+    # Returns the number of parallel byte ranges used for a single large file
+    def get_segments(self) -> int:
+        return self._segments
+
+    # Returns the minimum size of a single byte range in bytes
+    def get_min_segment_size(self) -> int:
+        return self._min_segment_size
+
+    # Returns the number of seconds a verified file is trusted without asking the server again
+    def get_freshness(self) -> int:
+        return self._freshness
+
+    # Returns the number of host connection pools kept by the HTTP session
+    def get_pool_connections(self) -> int:
+        return self._pool_connections
+
+    # Returns the maximum number of kept-alive connections per host
+    def get_pool_maxsize(self) -> int:
+        return self._pool_maxsize
+
+    # Returns the connection timeout in seconds
+    def get_connect_timeout(self) -> float:
+        return self._connect_timeout
+
+    # Returns the read timeout in seconds
+    def get_read_timeout(self) -> float:
+        return self._read_timeout
+
+    # Returns the number of retries for failed requests and transfers
+    def get_retries(self) -> int:
+        return self._retries
+
+    # Returns the base delay in seconds of the exponential backoff
+    def get_backoff_factor(self) -> float:
+        return self._backoff_factor
+
+    # Returns the maximum delay in seconds between retries
+    def get_backoff_max(self) -> float:
+        return self._backoff_max
+
+    # Returns the progress output mode, either "text" or "json"
+    def get_progress(self) -> str:
+        return self._progress
+
+    # Returns the number of seconds between two progress reports
+    def get_progress_interval(self) -> float:
+        return self._progress_interval
+
+    # Returns the initial size of the read buffer in bytes
+    def get_min_buffer_size(self) -> int:
+        return self._min_buffer_size
+
+    # Returns the maximum size the read buffer grows to in bytes
+    def get_max_buffer_size(self) -> int:
+        return self._max_buffer_size
+
+    # Returns the number of bytes fetched from each mirror to measure its throughput
+    def get_probe_sample_size(self) -> int:
+        return self._probe_sample_size
+
+    # Returns the throughput in bytes per second below which a transfer fails over to another mirror (0 disables it)
+    def get_min_throughput(self) -> int:
+        return self._min_throughput
+
+    # Returns the number of seconds the throughput is averaged over before failing over
+    def get_throughput_window(self) -> float:
+        return self._throughput_window
+
+    # Returns the base URLs of sibling sdm servers tried before the origin
+    def get_peers(self) -> List[str]:
+        return self._peers
+
+    # Returns the number of worker threads draining the server download queue
+    def get_queue_workers(self) -> int:
+        return self._queue_workers
+
+    # Returns TRUE if the download API accepts models that are not in the configuration, from the allowed hosts only
+    def is_custom_urls_enabled(self) -> bool:
+        return self._custom_urls
+
+    # Returns the hosts the download API may fetch models that are not in the configuration from
+    def get_allowed_hosts(self) -> List[str]:
+        return self._allowed_hosts
+
+    # Returns the configuration as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.get_max_concurrency(),
+            "per_host_connections": self.get_per_host_connections(),
+            "segments": self.get_segments(),
+            "min_segment_size": self.get_min_segment_size(),
+            "freshness": self.get_freshness(),
+            "pool_connections": self.get_pool_connections(),
+            "pool_maxsize": self.get_pool_maxsize(),
+            "connect_timeout": self.get_connect_timeout(),
+            "read_timeout": self.get_read_timeout(),
+            "retries": self.get_retries(),
+            "backoff_factor": self.get_backoff_factor(),
+            "backoff_max": self.get_backoff_max(),
+            "progress": self.get_progress(),
+            "progress_interval": self.get_progress_interval(),
+            "min_buffer_size": self.get_min_buffer_size(),
+            "max_buffer_size": self.get_max_buffer_size(),
+            "probe_sample_size": self.get_probe_sample_size(),
+            "min_throughput": self.get_min_throughput(),
+            "throughput_window": self.get_throughput_window(),
+            "peers": self.get_peers(),
+            "queue_workers": self.get_queue_workers(),
+            "custom_urls": self.is_custom_urls_enabled(),
+            "allowed_hosts": self.get_allowed_hosts(),
+        }
+
+    # Returns the configuration as a JSON string
+    def to_json(self) -> str:
+        return dumps(self.to_dict(), indent=4)
+
+    # Returns the configuration as a string
+    def __str__(self) -> str:
+        return self.to_json()
+
+    # Creates a configuration from a dictionary
+    @staticmethod
+    def from_dict(configuration: Dict[str, Any]) -> "DownloaderConfiguration":
+        return DownloaderConfiguration(
+            max_concurrency=configuration.get("max_concurrency", 4),
+            per_host_connections=configuration.get("per_host_connections", 2),
+            segments=configuration.get("segments", 4),
+            min_segment_size=configuration.get("min_segment_size", 32 * 1024 * 1024),
+            freshness=configuration.get("freshness", 0),
+            pool_connections=configuration.get("pool_connections", 10),
+            pool_maxsize=configuration.get("pool_maxsize", 16),
+            connect_timeout=configuration.get("connect_timeout", 10),
+            read_timeout=configuration.get("read_timeout", 60),
+            retries=configuration.get("retries", 5),
+            backoff_factor=configuration.get("backoff_factor", 1),
+            backoff_max=configuration.get("backoff_max", 60),
+            progress=configuration.get("progress", "text"),
+            progress_interval=configuration.get("progress_interval", 1.0),
+            min_buffer_size=configuration.get("min_buffer_size", 64 * 1024),
+            max_buffer_size=configuration.get("max_buffer_size", 8 * 1024 * 1024),
+            probe_sample_size=configuration.get("probe_sample_size", 256 * 1024),
+            min_throughput=configuration.get("min_throughput", 0),
+            throughput_window=configuration.get("throughput_window", 10),
+            peers=configuration.get("peers", []),
+            queue_workers=configuration.get("queue_workers", 2),
+            custom_urls=configuration.get("custom_urls", False),
+            allowed_hosts=configuration.get("allowed_hosts", None),
+        )
+
+    # Creates a configuration from a JSON string
+    @staticmethod
+    def from_json(configuration: str) -> "DownloaderConfiguration":
+        return DownloaderConfiguration.from_dict(loads(configuration))
+
+
 # Class: StableDiffusionConfiguration
 class StableDiffusionConfiguration:
     # Stable Diffusion directory
@@ -352,15 +850,19 @@ class Configuration:
     _gallery_configuration: GalleryConfiguration
     # Stable Diffusion configuration
     _stable_diffusion_configuration: StableDiffusionConfiguration
+    # Downloader configuration
+    _downloader_configuration: DownloaderConfiguration
 
     # Constructor
     def __init__(
         self,
         gallery: GalleryConfiguration,
         stable_diffusion: StableDiffusionConfiguration,
+        downloader: DownloaderConfiguration = None,
     ):
         self._gallery_configuration = gallery
         self._stable_diffusion_configuration = stable_diffusion
+        self._downloader_configuration = downloader if downloader is not None else DownloaderConfiguration()
 
     # Returns the gallery configuration
     def gallery(self) -> GalleryConfiguration:
@@ -370,11 +872,16 @@ class Configuration:
     def stable_diffusion(self) -> StableDiffusionConfiguration:
         return self._stable_diffusion_configuration
 
+    # Returns the downloader configuration
+    def downloader(self) -> DownloaderConfiguration:
+        return self._downloader_configuration
+
     # Returns the configuration as a dictionary
     def to_dict(self) -> Dict[str, Any]:
         return {
             "gallery": self.gallery().to_dict(),
             "stable_diffusion": self.stable_diffusion().to_dict(),
+            "downloader": self.downloader().to_dict(),
         }
 
     # Returns the configuration as a JSON string
@@ -393,6 +900,7 @@ class Configuration:
             stable_diffusion=StableDiffusionConfiguration.from_dict(
                 configuration.get("stable_diffusion", {})
             ),
+            downloader=DownloaderConfiguration.from_dict(configuration.get("downloader", {})),
         )
 
     # Creates a configuration from a JSON string
@@ -1,9 +1,19 @@
-import requests
-from time import time
-from os import path
-from sys import stdout
+from time import time, monotonic
+from os import path, stat
+from urllib.parse import quote
+from threading import Lock
+from typing import Dict, List, Optional, Tuple, Callable, BinaryIO
+from requests import Response
+from concurrent.futures import ThreadPoolExecutor
 from .storage import Storage
-from .helpers import bytes_to_readable, seconds_to_readable
+from .scheduler import DownloadJob, DownloadScheduler
+from .transfer import RemoteFile, PartialDownload
+from .manifest import DownloadManifest, ManifestEntry
+from .hashing import HashCache, StreamingHasher, hash_matches
+from .client import HttpClient, TransferError, SlowTransferError, TRANSIENT_ERRORS, RETRY_STATUSES, get_host
+from .metrics import DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, DOWNLOAD_RETRIES
+from .helpers import bytes_to_readable
+from .progress import ProgressReporter, TransferProgress
 from .configuration import CheckpointConfiguration, LoraConfiguration, UpscalerConfiguration
 
 
@@ -11,44 +21,225 @@ from .configuration import CheckpointConfiguration, LoraConfiguration, UpscalerC
 class Downloader:
     # Storage instance
     _storage: Storage
+    # Progress reporter shared by all transfers
+    _reporter: ProgressReporter
+    # Manifest of previously downloaded files
+    _manifest: DownloadManifest
+    # Cache of file hashes
+    _hash_cache: HashCache
+    # Pooled HTTP client
+    _client: HttpClient
 
     # Constructor
     def __init__(self, storage: Storage):
         self._storage = storage
+        self._reporter = ProgressReporter(
+            mode=storage.get_configuration().downloader().get_progress(),
+            interval=storage.get_configuration().downloader().get_progress_interval(),
+        )
+        self._manifest = DownloadManifest(storage.get_download_manifest_file_path())
+        self._hash_cache = HashCache(storage.get_hash_cache_file_path())
+        self._client = HttpClient(storage.get_configuration().downloader())
 
     # Returns the storage instance
     def get_storage(self) -> Storage:
         return self._storage
 
+    # Returns the manifest of previously downloaded files
+    def get_manifest(self) -> DownloadManifest:
+        return self._manifest
+
+    # Returns the cache of file hashes
+    def get_hash_cache(self) -> HashCache:
+        return self._hash_cache
+
+    # Returns the progress reporter
+    def get_reporter(self) -> ProgressReporter:
+        return self._reporter
+
+    # Returns the pooled HTTP client
+    def get_client(self) -> HttpClient:
+        return self._client
+
+    # Returns the download scheduler configured for this downloader
+    def get_scheduler(self) -> DownloadScheduler:
+        configuration = self.get_storage().get_configuration().downloader()
+        return DownloadScheduler(
+            max_concurrency=configuration.get_max_concurrency(),
+            per_host_connections=configuration.get_per_host_connections(),
+            segments=configuration.get_segments(),
+        )
+
+    # Creates a download job for the checkpoint
+    def create_checkpoint_job(self, checkpoint: CheckpointConfiguration) -> DownloadJob:
+        file_path = self.get_storage().get_checkpoint_file_path(checkpoint.get_name())
+        return DownloadJob(checkpoint.get_url(), file_path, sha256=checkpoint.get_sha256(), mirrors=checkpoint.get_mirrors())
+
+    # Creates a download job for the lora
+    def create_lora_job(self, lora: LoraConfiguration) -> DownloadJob:
+        file_path = self.get_storage().get_lora_file_path(lora.get_name())
+        return DownloadJob(lora.get_url(), file_path, sha256=lora.get_sha256(), mirrors=lora.get_mirrors())
+
+    # Creates a download job for the upscaler
+    def create_upscaler_job(self, upscaler: UpscalerConfiguration) -> DownloadJob:
+        file_path = self.get_storage().get_upscaler_file_path(upscaler.get_name())
+        return DownloadJob(upscaler.get_url(), file_path, sha256=upscaler.get_sha256(), mirrors=upscaler.get_mirrors())
+
+    # Downloads all outdated jobs concurrently, smallest files first, reports a summary and returns the failed jobs with their errors
+    def download(self, jobs: List[DownloadJob]) -> List[Tuple[DownloadJob, str]]:
+        scheduler = self.get_scheduler()
+        failures: List[Tuple[DownloadJob, str]] = []
+        failures_lock = Lock()
+
+        def on_error(job: DownloadJob, exception: Exception) -> None:
+            with failures_lock:
+                failures.append((job, str(exception)))
+
+        with ThreadPoolExecutor(max_workers=scheduler.get_max_concurrency()) as executor:
+            probed_jobs = list(executor.map(lambda job: self._probe_job(job, on_error), jobs))
+
+        outdated_jobs = [job for job in probed_jobs if job is not None]
+        up_to_date = len(jobs) - len(outdated_jobs) - len(failures)
+        scheduler.run(
+            outdated_jobs,
+            lambda job, connections: self._download_file(job.get_url(), job.get_file_path(), job.get_sha256(), job.get_mirrors(), connections),
+            on_error,
+        )
+
+        for job, error in failures:
+            self.get_reporter().message(f"Failed: {job.get_url()} ({error})", url=job.get_url(), error=error)
+        downloaded = len(jobs) - up_to_date - len(failures)
+        self.get_reporter().message(
+            f"Summary: {downloaded} downloaded, {up_to_date} up to date, {len(failures)} failed",
+            downloaded=downloaded,
+            up_to_date=up_to_date,
+            failed=len(failures),
+        )
+        return failures
+
+    # Returns the job with its remote size filled in, or None if the local file is up to date or the job cannot be checked,
+    # a failing job is reported, handed to the error callback and skipped so it does not abort the others
+    def _probe_job(self, job: DownloadJob, on_error: Callable[[DownloadJob, Exception], None]) -> Optional[DownloadJob]:
+        try:
+            remote_file = self._get_outdated_remote_file(job.get_url(), job.get_file_path(), job.get_sha256(), job.get_mirrors())
+        except Exception as exception:
+            self.get_reporter().message(f"Unable to check: {job.get_url()} ({exception})", url=job.get_url(), error=str(exception))
+            on_error(job, exception)
+            return None
+        if remote_file is None:
+            return None
+        return DownloadJob(job.get_url(), job.get_file_path(), remote_file.get_size(), job.get_sha256(), job.get_mirrors())
+
     # Downloads checkpoint file
     def download_checkpoint(self, checkpoint: CheckpointConfiguration) -> None:
         file_path = self.get_storage().get_checkpoint_file_path(checkpoint.get_name())
-        self.download_file(checkpoint.get_url(), file_path)
+        self.download_file(checkpoint.get_url(), file_path, checkpoint.get_sha256(), checkpoint.get_mirrors())
 
     # Downloads lora file
     def download_lora(self, lora: LoraConfiguration) -> None:
         file_path = self.get_storage().get_lora_file_path(lora.get_name())
-        self.download_file(lora.get_url(), file_path)
+        self.download_file(lora.get_url(), file_path, lora.get_sha256(), lora.get_mirrors())
 
     # Downloads upscaler file
     def download_upscaler(self, upscaler: UpscalerConfiguration) -> None:
         file_path = self.get_storage().get_upscaler_file_path(upscaler.get_name())
-        self.download_file(upscaler.get_url(), file_path)
+        self.download_file(upscaler.get_url(), file_path, upscaler.get_sha256(), upscaler.get_mirrors())
 
     # Downloads a file if it doesn't exist or if it's outdated
-    def download_file(self, url: str, file_path: str) -> None:
-        local_file_size = self._get_local_file_size(file_path)
-        remote_file_size = self._get_remote_file_size(url)
+    def download_file(self, url: str, file_path: str, sha256: str = "", mirrors: List[str] = None) -> None:
+        if self._get_outdated_remote_file(url, file_path, sha256, mirrors) is not None:
+            self._download_file(url, file_path, sha256, mirrors)
+
+    # Returns the remote file if the local copy is missing, outdated or corrupt, None if it is up to date
+    def _get_outdated_remote_file(self, url: str, file_path: str, sha256: str = "", mirrors: List[str] = None) -> Optional[RemoteFile]:
+        if sha256 != "" and path.isfile(file_path):
+            if not hash_matches(sha256, self.get_hash_cache().get_file_hash(file_path)):
+                self.get_reporter().message(f"Hash mismatch: {file_path}, downloading again...", file_path=file_path)
+                return self._get_first_remote_file_headers([url] + (mirrors or []), {})[1]
 
-        if local_file_size != remote_file_size:
-            self._download_file(url, file_path)
+        entry = self.get_manifest().get_entry(url)
+        headers = {}
 
-    # Returns the file size of the remote file
-    def _get_remote_file_size(self, url: str) -> int:
-        response = requests.get(url, stream=True)
-        file_size = int(response.headers.get('content-length', 0))
-        response.close()
-        return file_size
+        if entry is not None and entry.matches_local_file(file_path):
+            freshness = self.get_storage().get_configuration().downloader().get_freshness()
+            if time() - entry.get_checked_at() < freshness:
+                return None
+            if entry.get_etag() != "":
+                headers["If-None-Match"] = entry.get_etag()
+            if entry.get_last_modified() != "":
+                headers["If-Modified-Since"] = entry.get_last_modified()
+        else:
+            entry = None
+
+        status_code, remote_file = self._get_first_remote_file_headers([url] + (mirrors or []), headers)
+        if status_code == 304 and entry is not None:
+            remote_file = RemoteFile(url, entry.get_size(), False, entry.get_etag(), entry.get_last_modified())
+            self._record_manifest_entry(url, file_path, remote_file)
+            return None
+
+        if entry is not None and self._is_same_version(entry, remote_file):
+            self._record_manifest_entry(url, file_path, remote_file)
+            return None
+
+        if entry is None and path.isfile(file_path) and self._get_local_file_size(file_path) == remote_file.get_size():
+            self._record_manifest_entry(url, file_path, remote_file)
+            return None
+
+        return remote_file
+
+    # Returns TRUE if the remote file is the version recorded in the manifest entry
+    def _is_same_version(self, entry: ManifestEntry, remote_file: RemoteFile) -> bool:
+        if entry.get_size() != remote_file.get_size():
+            return False
+        if entry.get_url() != remote_file.get_url():
+            return True
+        if entry.get_etag() != "" and remote_file.get_etag() != "":
+            return entry.get_etag() == remote_file.get_etag()
+        if entry.get_last_modified() != "" and remote_file.get_last_modified() != "":
+            return entry.get_last_modified() == remote_file.get_last_modified()
+        return True
+
+    # Records the local file in the manifest under the entity URL, keeping validators only if they came from that URL
+    def _record_manifest_entry(self, url: str, file_path: str, remote_file: RemoteFile) -> None:
+        file_stat = stat(file_path)
+        same_url = remote_file.get_url() == url
+        self.get_manifest().set_entry(ManifestEntry(
+            url=url,
+            size=file_stat.st_size,
+            etag=remote_file.get_etag() if same_url else "",
+            last_modified=remote_file.get_last_modified() if same_url else "",
+            mtime=file_stat.st_mtime_ns,
+            checked_at=time(),
+        ))
+
+    # Returns the HEAD response of the first reachable URL, conditional headers are only sent to the first URL
+    def _get_first_remote_file_headers(self, urls: List[str], headers: Dict[str, str]) -> Tuple[int, RemoteFile]:
+        for index, url in enumerate(urls):
+            try:
+                status_code, remote_file = self._get_remote_file_headers(url, headers if index == 0 else {})
+                if status_code < 400:
+                    return status_code, remote_file
+                self.get_reporter().message(f"Mirror unavailable: {url} (status {status_code})", url=url)
+            except TRANSIENT_ERRORS as exception:
+                if index == len(urls) - 1:
+                    raise
+                self.get_reporter().message(f"Mirror unavailable: {url} ({exception})", url=url)
+        raise IOError(f"No mirror serves {urls[0]}")
+
+    # Returns the response status and remote file description from a HEAD request
+    def _get_remote_file_headers(self, url: str, headers: Dict[str, str]) -> Tuple[int, RemoteFile]:
+        response = self.get_client().head(url, headers)
+        if response.status_code in [405, 501]:
+            response = self.get_client().get(url, headers)
+            response.close()
+
+        return response.status_code, RemoteFile(
+            url=url,
+            size=int(response.headers.get('content-length', 0)),
+            accepts_ranges=response.headers.get('accept-ranges', '').lower() == 'bytes',
+            etag=response.headers.get('etag', ''),
+            last_modified=response.headers.get('last-modified', ''),
+        )
 
     # Returns the file size of the local file
     def _get_local_file_size(self, file_path: str) -> int:
@@ -56,32 +247,380 @@ class Downloader:
             return path.getsize(file_path)
         return 0
 
-    # Downloads a file
-    def _download_file(self, url: str, file_path: str) -> None:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
+    # Returns the remote file description, probing for byte range support
+    def _get_remote_file(self, url: str) -> RemoteFile:
+        response = self.get_client().get(url, {"Range": "bytes=0-0"})
+        try:
+            if response.status_code >= 400:
+                raise IOError(f"Unexpected status {response.status_code}")
+            etag = response.headers.get('etag', '')
+            last_modified = response.headers.get('last-modified', '')
+            content_range = response.headers.get('content-range', '')
+            if response.status_code == 206 and "/" in content_range:
+                total = content_range.rsplit("/", 1)[1]
+                if total.isdigit():
+                    return RemoteFile(url, int(total), True, etag, last_modified)
+            return RemoteFile(url, int(response.headers.get('content-length', 0)), False, etag, last_modified)
+        finally:
+            response.close()
+
+    # Splits a file of the given size into inclusive byte ranges, at most one per connection (0 for one per configured segment)
+    def _split_ranges(self, file_size: int, connections: int = 0) -> List[Tuple[int, int]]:
+        configuration = self.get_storage().get_configuration().downloader()
+        segments = min(connections or configuration.get_segments(), configuration.get_segments(), file_size // configuration.get_min_segment_size())
+        if segments < 2:
+            return [(0, file_size - 1)]
+
+        segment_size = -(-file_size // segments)
+        return [
+            (start, min(start + segment_size, file_size) - 1)
+            for start in range(0, file_size, segment_size)
+        ]
+
+    # Returns the reachable sources of a file, fastest first, leaving out mirrors that disagree on the size
+    def _get_sources(self, urls: List[str]) -> List[RemoteFile]:
+        if len(urls) == 1:
+            return [self._get_remote_file(urls[0])]
+
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            probes = list(executor.map(self._probe_source, urls))
+
+        reachable = [probe for probe in probes if probe is not None]
+        if not reachable:
+            raise IOError(f"No mirror serves {urls[0]}")
+
+        reference_size = reachable[0][1].get_size()
+        ranked = sorted(
+            [probe for probe in reachable if probe[1].get_size() == reference_size],
+            key=lambda probe: probe[0],
+        )
+        return [remote_file for _, remote_file in ranked]
+
+    # Returns the time it took a mirror to answer and serve a short sample, or None if it is unreachable
+    def _probe_source(self, url: str) -> Optional[Tuple[float, RemoteFile]]:
+        try:
+            started_at = monotonic()
+            remote_file = self._get_remote_file(url)
+            score = monotonic() - started_at
+
+            sample_size = min(self.get_storage().get_configuration().downloader().get_probe_sample_size(), remote_file.get_size())
+            if remote_file.accepts_ranges() and sample_size > 0:
+                started_at = monotonic()
+                response = self.get_client().get(url, {"Range": f"bytes=0-{sample_size - 1}", "Accept-Encoding": "identity"})
+                try:
+                    response.raw.read(sample_size)
+                finally:
+                    response.close()
+                score += monotonic() - started_at
+
+            self.get_reporter().message(f"Mirror: {url} - {score * 1000:.0f} ms", url=url, score=score)
+            return score, remote_file
+        except Exception as exception:
+            self.get_reporter().message(f"Mirror unavailable: {url} ({exception})", url=url)
+            return None
+
+    # Returns the URLs under which the configured peers share the model file
+    def _get_peer_urls(self, file_path: str) -> List[str]:
+        peers = self.get_storage().get_configuration().downloader().get_peers()
+        for kind, directory in self.get_storage().get_model_directories().items():
+            if path.dirname(file_path) == directory:
+                name = quote(path.basename(file_path))
+                return [f"{peer}/api/models/{kind}/{name}" for peer in peers]
+        return []
+
+    # Returns the peers sharing a complete copy of the model file, in the configured order
+    def _get_peer_sources(self, file_path: str, size: int, sha256: str) -> List[RemoteFile]:
+        peer_urls = self._get_peer_urls(file_path)
+        if not peer_urls or size <= 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(peer_urls)) as executor:
+            probes = list(executor.map(lambda peer_url: self._probe_peer(peer_url, size, sha256), peer_urls))
+        return [remote_file for remote_file in probes if remote_file is not None]
+
+    # Returns the peer copy of the model file, or None if the peer is down or its copy differs from the origin
+    def _probe_peer(self, url: str, size: int, sha256: str) -> Optional[RemoteFile]:
+        try:
+            response = self.get_client().probe(url)
+        except TRANSIENT_ERRORS:
+            return None
+        if response.status_code != 200:
+            return None
+
+        peer_sha256 = response.headers.get('x-sha256', '')
+        if sha256 != "" and peer_sha256 != "" and not hash_matches(sha256, peer_sha256):
+            return None
+
+        remote_file = RemoteFile(
+            url=url,
+            size=int(response.headers.get('content-length', 0)),
+            accepts_ranges=response.headers.get('accept-ranges', '').lower() == 'bytes',
+        )
+        if remote_file.get_size() != size:
+            return None
+
+        self.get_reporter().message(f"Peer: {url}", url=url)
+        return remote_file
+
+    # Downloads a file into a partial file over at most the given number of connections (0 for one per configured segment),
+    # verifies its hash and moves it into place
+    # SHA-256 cannot be combined from per-range digests, so a file with an expected hash is downloaded as one range
+    # and hashed in order while streaming, only the bytes of a resumed partial file are read back
+    def _download_file(self, url: str, file_path: str, sha256: str = "", mirrors: List[str] = None, connections: int = 0) -> None:
+        transfer = None
+        try:
+            sources = self._get_sources([url] + (mirrors or []))
+            peer_sources = self._get_peer_sources(file_path, sources[0].get_size(), sha256)
+            sources = peer_sources + sources
+            range_sources = [source for source in sources if source.accepts_ranges()]
+            remote_file = range_sources[0] if range_sources else sources[0]
+            hasher = StreamingHasher()
+
+            if range_sources and remote_file.get_size() > 0:
+                split_connections = 1 if sha256 != "" else connections
+                ranges = [[start, end, 0] for start, end in self._split_ranges(remote_file.get_size(), split_connections)]
+                partial = PartialDownload.open(file_path, remote_file.with_sha256(sha256), ranges)
+                if sha256 != "" and len(partial.get_ranges()) > 1:
+                    partial.discard()
+                    partial = PartialDownload(file_path, remote_file.with_sha256(sha256), ranges)
+            else:
+                partial = PartialDownload(file_path, remote_file, [])
+
+            transfer = self.get_reporter().begin(url, file_path, remote_file.get_size(), partial.get_downloaded_size())
+            if partial.get_ranges():
+                self._download_file_ranges(partial, hasher, transfer, range_sources, connections)
+            else:
+                self._download_file_stream(partial, hasher, transfer, sources)
+
+            digest = hasher.finalize(path.getsize(partial.get_part_path()))
+            if sha256 != "" and (digest is None or not hash_matches(sha256, digest)):
+                partial.discard()
+                raise IOError(f"Hash mismatch, expected {sha256}, got {digest or 'an incomplete hash'}")
+
+            partial.complete()
+            if digest is not None:
+                self.get_hash_cache().set_file_hash(file_path, digest)
+            self._record_manifest_entry(url, file_path, remote_file)
+        except Exception as exception:
+            if transfer is not None:
+                self.get_reporter().end(transfer, str(exception))
+            else:
+                self.get_reporter().message(f"Unable to download: {url} ({exception})", url=url, error=str(exception))
+            raise
+
+        self.get_reporter().end(transfer)
+
+    # Returns a data callback that fails the transfer when its throughput stays below the configured minimum
+    def _create_throughput_guard(self, sources: List[RemoteFile]) -> Callable[[int], None]:
+        configuration = self.get_storage().get_configuration().downloader()
+        min_throughput = configuration.get_min_throughput()
+        window = configuration.get_throughput_window()
+        window_started_at = monotonic()
+        window_size = 0
+
+        def guard(size: int) -> None:
+            nonlocal window_started_at, window_size
+            window_size += size
+            elapsed_time = monotonic() - window_started_at
+            if elapsed_time >= window:
+                throughput = window_size / elapsed_time
+                window_started_at = monotonic()
+                window_size = 0
+                if throughput < min_throughput:
+                    raise SlowTransferError(f"Throughput {bytes_to_readable(throughput)}/s below {bytes_to_readable(min_throughput)}/s")
+
+        if min_throughput <= 0 or len(sources) < 2:
+            return lambda size: None
+        return guard
+
+    # Downloads the missing byte ranges of a partial download, each on its own connection,
+    # with at most the given number of connections open at once (0 for one per range)
+    # Only the bytes following the hashed prefix are hashed, the others leave the hasher incomplete
+    def _download_file_ranges(
+        self,
+        partial: PartialDownload,
+        hasher: StreamingHasher,
+        transfer: TransferProgress,
+        sources: List[RemoteFile],
+        connections: int = 0,
+    ) -> None:
+        url = partial.get_remote_file().get_url()
+        resumed_size = partial.get_downloaded_size()
+        if resumed_size > 0:
+            self.get_reporter().message(f"Resuming: {url} from {bytes_to_readable(resumed_size)}", url=url, offset=resumed_size)
+
+        partial.prepare()
+        if len(partial.get_ranges()) == 1:
+            _, _, first_downloaded = partial.get_ranges()[0]
+            hasher.catch_up(partial.get_part_path(), first_downloaded)
+        state_lock = Lock()
+        last_saved = [time()]
+
+        def download_range(index: int) -> None:
+            source_index = 0
+            attempt = 0
+            while True:
+                downloaded_before = partial.get_ranges()[index][2]
+                try:
+                    transfer_range(index, sources[source_index].get_url())
+                    return
+                except TRANSIENT_ERRORS as exception:
+                    DOWNLOAD_RETRIES.inc(get_host(sources[source_index].get_url()))
+                    if partial.get_ranges()[index][2] > downloaded_before:
+                        attempt = 0
+                    if len(sources) > 1:
+                        previous_url = sources[source_index].get_url()
+                        source_index = (source_index + 1) % len(sources)
+                        source_url = sources[source_index].get_url()
+                        self.get_reporter().message(f"Switching: {previous_url} to {source_url} ({exception})", url=url, mirror=source_url)
+                        if isinstance(exception, SlowTransferError):
+                            continue
+                    if not self.get_client().can_retry(attempt):
+                        raise
+                    offset = partial.get_ranges()[index][0] + partial.get_ranges()[index][2]
+                    self.get_reporter().message(f"Retrying: {url} from {bytes_to_readable(offset)} ({exception})", url=url, offset=offset)
+                    self.get_client().wait_before_retry(attempt)
+                    attempt += 1
+
+        def transfer_range(index: int, source_url: str) -> None:
+            start, end, downloaded = partial.get_ranges()[index]
+            offset = start + downloaded
+            if offset > end:
+                return
+
+            response = self.get_client().get(source_url, {"Range": f"bytes={offset}-{end}", "Accept-Encoding": "identity"})
+            try:
+                # The session already retried these statuses, so they fail the transfer instead of starting another round
+                if response.status_code in RETRY_STATUSES:
+                    raise IOError(f"Unexpected status {response.status_code} for range {offset}-{end}")
+                if response.status_code != 206:
+                    raise TransferError(f"Unexpected status {response.status_code} for range {offset}-{end}")
+
+                guard = self._create_throughput_guard(sources)
+
+                def on_data(data: memoryview) -> None:
+                    nonlocal offset
+                    hasher.update_at(offset, data)
+                    offset += len(data)
+                    partial.advance(index, len(data))
+                    transfer.add(len(data))
+                    if time() - last_saved[0] >= 1:
+                        with state_lock:
+                            if time() - last_saved[0] >= 1:
+                                partial.save()
+                                last_saved[0] = time()
+                    guard(len(data))
+
+                with open(partial.get_part_path(), 'r+b', buffering=0) as file:
+                    file.seek(offset)
+                    self._copy_response(response, file, on_data, end - offset + 1)
+
+                if offset <= end:
+                    raise TransferError(f"Connection closed at {offset} before the end of range {start}-{end}")
+            finally:
+                response.close()
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(partial.get_ranges()), connections or len(partial.get_ranges()))) as executor:
+                for future in [executor.submit(download_range, index) for index in range(len(partial.get_ranges()))]:
+                    future.result()
+        finally:
+            partial.save()
+
+        if not partial.is_complete():
+            raise IOError(f"Incomplete download: {url}")
+
+    # Downloads a file over a single connection into a partial file, restarting it on another source on transient errors
+    def _download_file_stream(
+        self,
+        partial: PartialDownload,
+        hasher: StreamingHasher,
+        transfer: TransferProgress,
+        sources: List[RemoteFile],
+    ) -> None:
+        source_index = 0
+        attempt = 0
+        while True:
+            try:
+                self._transfer_stream(partial, hasher, transfer, sources[source_index].get_url())
+                return
+            except TRANSIENT_ERRORS as exception:
+                DOWNLOAD_RETRIES.inc(get_host(sources[source_index].get_url()))
+                url = partial.get_remote_file().get_url()
+                if len(sources) > 1:
+                    previous_url = sources[source_index].get_url()
+                    source_index = (source_index + 1) % len(sources)
+                    source_url = sources[source_index].get_url()
+                    self.get_reporter().message(f"Switching: {previous_url} to {source_url} ({exception})", url=url, mirror=source_url)
+                if not self.get_client().can_retry(attempt):
+                    raise
+                self.get_reporter().message(f"Retrying: {url} ({exception})", url=url, offset=0)
+                self.get_client().wait_before_retry(attempt)
+                attempt += 1
+
+    # Transfers a file over a single connection from the first byte
+    def _transfer_stream(self, partial: PartialDownload, hasher: StreamingHasher, transfer: TransferProgress, source_url: str) -> None:
+        partial.discard()
+        hasher.reset()
+        transfer.reset()
+        response = self.get_client().get(source_url, {"Accept-Encoding": "identity"})
+        try:
+            if response.status_code != 200:
+                raise IOError(f"Unexpected status {response.status_code}")
+
             file_size = int(response.headers.get('content-length', 0))
-            file_size_readable = bytes_to_readable(file_size)
-            chunk_size = 1024
             downloaded_size = 0
-            start_time = time()
 
-            with open(file_path, 'wb') as file:
-                for data in response.iter_content(chunk_size=chunk_size):
-                    file.write(data)
+            def on_data(data: memoryview) -> None:
+                nonlocal downloaded_size
+                hasher.update_at(downloaded_size, data)
+                downloaded_size += len(data)
+                transfer.add(len(data))
 
-                    downloaded_size += len(data)
-                    downloaded_size_readable = bytes_to_readable(downloaded_size)
+            with open(partial.get_part_path(), 'wb', buffering=0) as file:
+                self._copy_response(response, file, on_data)
 
-                    progress = (downloaded_size / file_size) * 100
-                    elapsed_time = time() - start_time
-                    download_speed = downloaded_size / elapsed_time if elapsed_time > 0 else 0
-                    remaining_size = file_size - downloaded_size
-                    eta = remaining_size / download_speed if download_speed > 0 else 0
+            if file_size > 0 and downloaded_size != file_size:
+                raise TransferError(f"Incomplete download: {source_url}")
+        finally:
+            response.close()
 
-                    stdout.write(
-                        f"\rDownloading: {url} - {downloaded_size_readable} / {file_size_readable} - {seconds_to_readable(eta)} - {progress:.2f}%")
-                    stdout.flush()
-            stdout.write('\n')
-        else:
-            print(f"Unable to download: {url}")
\ No newline at end of file
+    # Copies a response body into a file through one reusable buffer, sized so that a read takes 50-250 ms,
+    # the data callback only runs once the whole chunk was written as unbuffered files may accept short writes
+    def _copy_response(self, response: Response, file: BinaryIO, on_data: Callable[[memoryview], None], limit: int = 0) -> None:
+        configuration = self.get_storage().get_configuration().downloader()
+        min_buffer_size = configuration.get_min_buffer_size()
+        max_buffer_size = configuration.get_max_buffer_size()
+        buffer_size = min_buffer_size
+        buffer = memoryview(bytearray(max_buffer_size))
+        remaining = limit
+        host = get_host(response.url)
+        copied_size = 0
+        copy_started_at = monotonic()
+
+        try:
+            while limit == 0 or remaining > 0:
+                read_size = buffer_size if limit == 0 else min(buffer_size, remaining)
+                read_started_at = monotonic()
+                size = response.raw.readinto(buffer[:read_size])
+                read_time = monotonic() - read_started_at
+                if not size:
+                    break
+
+                data = buffer[:size]
+                written_size = 0
+                while written_size < size:
+                    written_size += file.write(data[written_size:])
+                DOWNLOAD_BYTES.inc(host, amount=size)
+                copied_size += size
+                on_data(data)
+                remaining -= size
+
+                if size == buffer_size and read_time < 0.05 and buffer_size < max_buffer_size:
+                    buffer_size = min(buffer_size * 2, max_buffer_size)
+                elif read_time > 0.25 and buffer_size > min_buffer_size:
+                    buffer_size = max(buffer_size // 2, min_buffer_size)
+        finally:
+            copy_time = monotonic() - copy_started_at
+            if copied_size > 0 and copy_time > 0:
+                DOWNLOAD_THROUGHPUT.observe(copied_size / copy_time, host)
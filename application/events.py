@@ -0,0 +1,119 @@
+from os import path
+from collections import deque
+from secrets import token_hex
+from threading import Condition
+from typing import Deque, List, Optional, Tuple
+from .storage import Storage
+from .watcher import CREATED
+
+# Event sent when an image is written to a folder
+IMAGE_ADDED = "added"
+# Event sent when an image disappears from a folder
+IMAGE_REMOVED = "removed"
+# Event sent when a folder appears in the images directory
+FOLDER_ADDED = "folder_added"
+# Event sent when a folder disappears from the images directory
+FOLDER_REMOVED = "folder_removed"
+
+
+# Class: FolderEvent
+class FolderEvent:
+    # Identifier of the event, unique within its stream
+    _id: int
+    # Type of the event
+    _type: str
+    # Folder the event happened in, or the folder itself for folder events
+    _folder: str
+    # Name of the image, None for folder events
+    _image: Optional[str]
+
+    # Constructor
+    def __init__(self, event_id: int, event_type: str, folder: str, image: Optional[str]):
+        self._id = event_id
+        self._type = event_type
+        self._folder = folder
+        self._image = image
+
+    # Returns the identifier of the event
+    def get_id(self) -> int:
+        return self._id
+
+    # Returns the type of the event
+    def get_type(self) -> str:
+        return self._type
+
+    # Returns the folder of the event
+    def get_folder(self) -> str:
+        return self._folder
+
+    # Returns the name of the image, None for folder events
+    def get_image(self) -> Optional[str]:
+        return self._image
+
+
+# Class: EventStream
+class EventStream:
+    # Storage instance
+    _storage: Storage
+    # Random tag telling events of this stream from the ones of another process or run
+    _epoch: str
+    # Most recent events, oldest first
+    _events: Deque[FolderEvent]
+    # Identifier of the last published event
+    _last_id: int
+    # Condition signalled when an event is published
+    _condition: Condition
+
+    # Constructor
+    def __init__(self, storage: Storage, capacity: int = 1024):
+        self._storage = storage
+        self._epoch = token_hex(4)
+        self._events = deque(maxlen=capacity)
+        self._last_id = 0
+        self._condition = Condition()
+
+    # Returns the random tag of the stream
+    def get_epoch(self) -> str:
+        return self._epoch
+
+    # Returns the identifier of the last published event
+    def get_last_id(self) -> int:
+        with self._condition:
+            return self._last_id
+
+    # Publishes an event to every waiting client
+    def publish(self, event_type: str, folder: str, image: Optional[str] = None) -> FolderEvent:
+        with self._condition:
+            self._last_id += 1
+            event = FolderEvent(self._last_id, event_type, folder, image)
+            self._events.append(event)
+            self._condition.notify_all()
+        return event
+
+    # Waits up to timeout seconds for events published after the given one,
+    # returns None if some of them were already dropped from the buffer
+    def wait(self, after: int, timeout: float) -> Optional[List[FolderEvent]]:
+        with self._condition:
+            self._condition.wait_for(lambda: self._last_id > after, timeout)
+            if self._events and self._events[0].get_id() > after + 1:
+                return None
+            return [event for event in self._events if event.get_id() > after]
+
+    # Returns the position a client resumes from given its last event identifier, and FALSE if events may have been missed
+    def resume(self, last_event_id: str) -> Tuple[int, bool]:
+        epoch, _, event_id = last_event_id.partition("-")
+        if epoch != self._epoch or not event_id.isdigit() or int(event_id) > self.get_last_id():
+            return self.get_last_id(), last_event_id == ""
+        return int(event_id), True
+
+    # Watcher callback, turns file system changes of the images directory into events
+    def on_change(self, event: str, file_path: str) -> None:
+        relative_path = path.relpath(file_path, self._storage.get_images_path())
+        parts = relative_path.split(path.sep)
+        if parts[0] in [".", ".."] or len(parts) > 2:
+            return
+
+        if len(parts) == 1:
+            self.publish(FOLDER_ADDED if event == CREATED else FOLDER_REMOVED, parts[0])
+        elif self._storage.is_supported_image(parts[1]):
+            self.publish(IMAGE_ADDED if event == CREATED else IMAGE_REMOVED, parts[0], parts[1])
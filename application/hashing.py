@@ -0,0 +1,160 @@
+from hashlib import sha256
+from os import path, stat, stat_result
+from json import dumps, loads
+from threading import Lock
+from typing import Dict, Any, Optional
+from .helpers import file_lock, write_file_atomically
+
+# Number of hex characters in the short AUTOV2 hash used by the webui
+SHORT_HASH_LENGTH = 10
+# Size of the blocks read when hashing from disk
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+# Returns the short AUTOV2 hash for a SHA-256 hex digest
+def short_hash(digest: str) -> str:
+    return digest[:SHORT_HASH_LENGTH]
+
+
+# Returns TRUE if the SHA-256 digest matches the expected full or short hash
+def hash_matches(expected: str, digest: str) -> bool:
+    expected = expected.strip().lower()
+    if len(expected) == SHORT_HASH_LENGTH:
+        return short_hash(digest) == expected
+    return digest == expected
+
+
+# Class: StreamingHasher
+class StreamingHasher:
+    # SHA-256 state of the bytes hashed so far
+    _hash: Any
+    # Offset of the next byte to hash
+    _offset: int
+    # Lock serializing updates from concurrent writers
+    _lock: Lock
+
+    # Constructor
+    def __init__(self):
+        self._hash = sha256()
+        self._offset = 0
+        self._lock = Lock()
+
+    # Returns the offset of the next byte to hash
+    def get_offset(self) -> int:
+        return self._offset
+
+    # Discards everything hashed so far
+    def reset(self) -> None:
+        with self._lock:
+            self._hash = sha256()
+            self._offset = 0
+
+    # Hashes data written at the offset if it continues the hashed prefix, ignores it otherwise
+    def update_at(self, offset: int, data: bytes) -> None:
+        with self._lock:
+            if offset == self._offset:
+                self._hash.update(data)
+                self._offset += len(data)
+
+    # Hashes the file from the current offset up to the given offset
+    def catch_up(self, file_path: str, end: int) -> None:
+        with self._lock:
+            if self._offset >= end:
+                return
+            with open(file_path, "rb") as file:
+                file.seek(self._offset)
+                while self._offset < end:
+                    data = file.read(min(HASH_BLOCK_SIZE, end - self._offset))
+                    if not data:
+                        break
+                    self._hash.update(data)
+                    self._offset += len(data)
+
+    # Returns the hex digest if every byte up to the given size was hashed, None otherwise
+    def finalize(self, size: int) -> Optional[str]:
+        with self._lock:
+            return self._hash.hexdigest() if self._offset == size else None
+
+
+# Class: HashCache
+class HashCache:
+    # Path of the cache file
+    _file_path: str
+    # SHA-256 digests keyed by device, inode, size and mtime
+    _entries: Dict[str, str]
+    # Lock guarding the entries and the cache file
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, file_path: str):
+        self._file_path = file_path
+        self._entries = {}
+        self._lock = Lock()
+        self.load()
+
+    # Returns the path of the cache file
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the cached SHA-256 digest of the file, or None if it is not cached
+    def get_cached_hash(self, file_path: str) -> Optional[str]:
+        try:
+            key = self._get_key(stat(file_path))
+        except OSError:
+            return None
+        with self._lock:
+            return self._entries.get(key)
+
+    # Returns the SHA-256 digest of the file, hashing it only if neither this process nor another one cached it
+    def get_file_hash(self, file_path: str) -> str:
+        cached_hash = self.get_cached_hash(file_path)
+        if cached_hash is None:
+            self.load()
+            cached_hash = self.get_cached_hash(file_path)
+        if cached_hash is not None:
+            return cached_hash
+
+        file_size = path.getsize(file_path)
+        hasher = StreamingHasher()
+        hasher.catch_up(file_path, file_size)
+        digest = hasher.finalize(file_size)
+        if digest is None:
+            raise IOError(f"Unable to hash {file_path}, it changed while being read")
+        self.set_file_hash(file_path, digest)
+        return digest
+
+    # Returns the short AUTOV2 hash of the file
+    def get_file_short_hash(self, file_path: str) -> str:
+        return short_hash(self.get_file_hash(file_path))
+
+    # Records the SHA-256 digest of the file and writes the cache, merged with the digests other processes wrote since it was loaded
+    def set_file_hash(self, file_path: str, digest: str) -> None:
+        key = self._get_key(stat(file_path))
+        with self._lock, file_lock(self._file_path):
+            self._entries = self._read()
+            self._entries[key] = digest
+            self._save()
+
+    # Loads the cache from disk, starting empty if it is missing or unreadable
+    def load(self) -> None:
+        with self._lock:
+            self._entries = self._read()
+
+    # Reads the digests of the cache file, empty if it is missing or unreadable
+    def _read(self) -> Dict[str, str]:
+        if not path.exists(self._file_path):
+            return {}
+        try:
+            with open(self._file_path, "r") as file:
+                return dict(loads(file.read()))
+        except (ValueError, TypeError):
+            print(f"Invalid hash cache: `{self._file_path}`, ignoring...")
+            return {}
+
+    # Returns the cache key for the file status
+    def _get_key(self, file_stat: stat_result) -> str:
+        return f"{file_stat.st_dev}:{file_stat.st_ino}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+
+    # Writes the cache atomically, callers hold the cache file lock
+    def _save(self) -> None:
+        write_file_atomically(self._file_path, dumps(self._entries, indent=4))
@@ -1,3 +1,10 @@
+import fcntl
+from os import path, open as open_file, close, fdopen, fchmod, remove, replace, O_RDWR, O_CREAT
+from tempfile import mkstemp
+from contextlib import contextmanager
+from typing import Iterator
+
+
 # Formats seconds to HH:MM:SS
 def seconds_to_readable(seconds: int) -> str:
     m, s = divmod(seconds, 60)
@@ -12,4 +19,29 @@ def bytes_to_readable(num: int) -> str:
         if num < step_unit:
             return "%3.1f %s" % (num, x)
         num /= step_unit
-    return "%3.1f %s" % (num, "PB")
\ No newline at end of file
+    return "%3.1f %s" % (num, "PB")
+
+
+# Holds an exclusive lock on the sidecar lock file of a file shared by several processes while the block runs
+@contextmanager
+def file_lock(file_path: str) -> Iterator[None]:
+    file_descriptor = open_file(f"{file_path}.lock", O_RDWR | O_CREAT, 0o644)
+    try:
+        fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+        yield
+    finally:
+        close(file_descriptor)
+
+
+# Writes a file atomically through a temporary file of its own in the same directory, so concurrent writers never share one
+def write_file_atomically(file_path: str, content: str) -> None:
+    file_descriptor, temporary_path = mkstemp(dir=path.dirname(file_path), prefix=f".{path.basename(file_path)}.", suffix=".tmp")
+    try:
+        fchmod(file_descriptor, 0o644)
+        with fdopen(file_descriptor, "w") as file:
+            file.write(content)
+        replace(temporary_path, file_path)
+    except BaseException:
+        if path.exists(temporary_path):
+            remove(temporary_path)
+        raise
@@ -0,0 +1,227 @@
+from os import path, scandir, stat
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import count
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from threading import Lock
+from typing import Dict, List, Optional, Callable, Tuple
+from .metrics import FOLDER_SCAN_DURATION, FOLDER_LISTING_LOOKUPS
+
+# Generation numbers handed to the listings as they are built, a new listing always gets a new version
+_listing_generations = count(1)
+
+
+# Returns an opaque pagination cursor pointing right after the entry with the given modification time and name
+def encode_cursor(mtime: int, name: str) -> str:
+    return urlsafe_b64encode(f"{mtime}:{name}".encode()).decode().rstrip("=")
+
+
+# Returns the sort key a pagination cursor points after, or None for an empty cursor
+def decode_cursor(cursor: str) -> Optional[Tuple[int, str]]:
+    if cursor == "":
+        return None
+    try:
+        mtime, name = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":", 1)
+        return -int(mtime), name
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# Returns the strong entity tag of a file version, files are never rewritten in place without changing one of these
+def format_etag(inode: int, size: int, mtime: int) -> str:
+    return f"{inode:x}-{size:x}-{mtime:x}"
+
+
+# Class: IndexedFile
+class IndexedFile:
+    # File name
+    _name: str
+    # Size of the file in bytes
+    _size: int
+    # Modification time of the file in nanoseconds
+    _mtime: int
+    # Inode number of the file
+    _inode: int
+
+    # Constructor
+    def __init__(self, name: str, size: int, mtime: int, inode: int):
+        self._name = name
+        self._size = size
+        self._mtime = mtime
+        self._inode = inode
+
+    # Returns the file name
+    def get_name(self) -> str:
+        return self._name
+
+    # Returns the size of the file
+    def get_size(self) -> int:
+        return self._size
+
+    # Returns the modification time of the file in nanoseconds
+    def get_mtime(self) -> int:
+        return self._mtime
+
+    # Returns the inode number of the file
+    def get_inode(self) -> int:
+        return self._inode
+
+    # Returns the entity tag of the file, also used as the version of its URLs
+    def get_etag(self) -> str:
+        return format_etag(self._inode, self._size, self._mtime)
+
+    # Returns the sort key of the file, newest first and by name for equal times
+    def get_sort_key(self) -> tuple:
+        return -self._mtime, self._name
+
+
+# Class: FolderListing
+class FolderListing:
+    # Directory the listing was built from
+    _directory: str
+    # Modification time of the directory when the listing was built, in nanoseconds
+    _mtime: int
+    # Files sorted newest first
+    _files: List[IndexedFile]
+    # Sort keys of the files, in the same order
+    _keys: List[tuple]
+    # Position of each file in the sorted list, keyed by name
+    _positions: Dict[str, int]
+    # Generation number of the listing, changes whenever the folder is listed again
+    _version: int
+
+    # Constructor
+    def __init__(self, directory: str, mtime: int, files: List[IndexedFile]):
+        self._directory = directory
+        self._mtime = mtime
+        self._files = sorted(files, key=lambda file: file.get_sort_key())
+        self._keys = [file.get_sort_key() for file in self._files]
+        self._positions = {file.get_name(): position for position, file in enumerate(self._files)}
+        self._version = next(_listing_generations)
+
+    # Returns the directory the listing was built from
+    def get_directory(self) -> str:
+        return self._directory
+
+    # Returns the modification time of the directory when the listing was built
+    def get_mtime(self) -> int:
+        return self._mtime
+
+    # Returns the generation number of the listing
+    def get_version(self) -> int:
+        return self._version
+
+    # Returns the files sorted newest first
+    def get_files(self) -> List[IndexedFile]:
+        return self._files
+
+    # Returns the file names sorted newest first
+    def get_names(self) -> List[str]:
+        return [file.get_name() for file in self._files]
+
+    # Returns the position of the file in the sorted list, or None if it is not listed
+    def get_position(self, name: str) -> Optional[int]:
+        return self._positions.get(name)
+
+    # Returns the file with the given name, or None if it is not listed
+    def get_file(self, name: str) -> Optional[IndexedFile]:
+        position = self._positions.get(name)
+        return self._files[position] if position is not None else None
+
+    # Returns the files listed right before and right after the named file
+    def get_neighbours(self, name: str) -> Tuple[Optional[IndexedFile], Optional[IndexedFile]]:
+        position = self._positions.get(name)
+        if position is None:
+            return None, None
+        previous_file = self._files[position - 1] if position > 0 else None
+        next_file = self._files[position + 1] if position < len(self._files) - 1 else None
+        return previous_file, next_file
+
+    # Returns the files listed up to radius positions before and after the named file, including it
+    def get_window(self, name: str, radius: int) -> List[IndexedFile]:
+        position = self._positions.get(name)
+        if position is None:
+            return []
+        return self._files[max(0, position - radius):position + radius + 1]
+
+    # Returns up to limit files following the sort key, stable while newer files are added
+    def get_files_after(self, key: Optional[tuple], limit: int) -> List[IndexedFile]:
+        start = bisect_right(self._keys, key) if key is not None else 0
+        return self._files[start:start + limit]
+
+    # Returns the number of files
+    def __len__(self) -> int:
+        return len(self._files)
+
+    # Builds the listing of the files accepted by the filter with a single directory scan
+    @staticmethod
+    def build(directory: str, accept: Callable[[str], bool]) -> "FolderListing":
+        mtime = stat(directory).st_mtime_ns
+        files: List[IndexedFile] = []
+        with scandir(directory) as entries:
+            for entry in entries:
+                if not accept(entry.name) or not entry.is_file():
+                    continue
+                entry_stat = entry.stat()
+                files.append(IndexedFile(entry.name, entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino))
+        return FolderListing(directory, mtime, files)
+
+
+# Class: FolderIndex
+class FolderIndex:
+    # Filter deciding which file names are listed
+    _accept: Callable[[str], bool]
+    # Maximum number of listings kept
+    _max_size: int
+    # Listings keyed by directory, from least to most recently used
+    _listings: "OrderedDict[str, FolderListing]"
+    # Lock guarding the listings
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, accept: Callable[[str], bool], max_size: int = 256):
+        self._accept = accept
+        self._max_size = max(1, max_size)
+        self._listings = OrderedDict()
+        self._lock = Lock()
+
+    # Returns the maximum number of listings kept
+    def get_max_size(self) -> int:
+        return self._max_size
+
+    # Returns the listing of the directory, scanning it again only if its modification time changed
+    def get_listing(self, directory: str) -> FolderListing:
+        directory = path.normpath(directory)
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None:
+                self._listings.move_to_end(directory)
+
+        if listing is not None and stat(directory).st_mtime_ns == listing.get_mtime():
+            FOLDER_LISTING_LOOKUPS.inc("hit")
+            return listing
+
+        FOLDER_LISTING_LOOKUPS.inc("scan")
+        with FOLDER_SCAN_DURATION.time():
+            listing = FolderListing.build(directory, self._accept)
+        with self._lock:
+            self._listings[directory] = listing
+            self._listings.move_to_end(directory)
+            while len(self._listings) > self._max_size:
+                self._listings.popitem(last=False)
+        return listing
+
+    # Forgets the listing of a directory
+    def invalidate(self, directory: str) -> None:
+        with self._lock:
+            self._listings.pop(path.normpath(directory), None)
+
+    # Forgets every listing
+    def clear(self) -> None:
+        with self._lock:
+            self._listings.clear()
+
+    # Watcher callback, forgets the listing of the folder holding the changed file and of the changed folder itself
+    def on_change(self, event: str, file_path: str) -> None:
+        self.invalidate(path.dirname(file_path))
+        self.invalidate(file_path)
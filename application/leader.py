@@ -0,0 +1,74 @@
+import fcntl
+from os import open as open_file, close, write, ftruncate, getpid, O_RDWR, O_CREAT
+from time import sleep
+from threading import Thread, Lock
+from typing import Callable, Optional
+
+
+# Class: LeaderLock
+class LeaderLock:
+    # Path of the lock file
+    _file_path: str
+    # Number of seconds between two attempts to take over the lock
+    _interval: float
+    # Descriptor of the lock file while the lock is held, None otherwise
+    _file_descriptor: Optional[int]
+    # Lock guarding the file descriptor
+    _lock: Lock
+    # Thread waiting for the lock, started on demand
+    _thread: Optional[Thread]
+
+    # Constructor
+    def __init__(self, file_path: str, interval: float = 5.0):
+        self._file_path = file_path
+        self._interval = interval
+        self._file_descriptor = None
+        self._lock = Lock()
+        self._thread = None
+
+    # Returns the path of the lock file
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns TRUE if this process holds the lock
+    def is_leader(self) -> bool:
+        with self._lock:
+            return self._file_descriptor is not None
+
+    # Takes the lock without waiting, returns TRUE if this process holds it afterwards
+    def acquire(self) -> bool:
+        with self._lock:
+            if self._file_descriptor is not None:
+                return True
+
+            file_descriptor = open_file(self._file_path, O_RDWR | O_CREAT, 0o644)
+            try:
+                fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                close(file_descriptor)
+                return False
+
+            ftruncate(file_descriptor, 0)
+            write(file_descriptor, f"{getpid()}\n".encode())
+            self._file_descriptor = file_descriptor
+            return True
+
+    # Gives the lock up, the kernel does the same when the process exits
+    def release(self) -> None:
+        with self._lock:
+            if self._file_descriptor is not None:
+                fcntl.flock(self._file_descriptor, fcntl.LOCK_UN)
+                close(self._file_descriptor)
+                self._file_descriptor = None
+
+    # Calls the callback once this process holds the lock, retrying in the background until the current leader exits
+    def start(self, callback: Callable[[], None]) -> None:
+        if self._thread is None:
+            self._thread = Thread(target=self._run, args=(callback,), daemon=True)
+            self._thread.start()
+
+    # Waiting thread
+    def _run(self, callback: Callable[[], None]) -> None:
+        while not self.acquire():
+            sleep(self._interval)
+        callback()
@@ -0,0 +1,138 @@
+from os import path, stat
+from json import dumps, loads
+from threading import Lock
+from typing import Dict, Any, Optional
+from .helpers import file_lock, write_file_atomically
+
+
+# Class: ManifestEntry
+class ManifestEntry:
+    # URL the file was downloaded from
+    _url: str
+    # Size of the file in bytes
+    _size: int
+    # ETag validator reported by the server
+    _etag: str
+    # Last-Modified validator reported by the server
+    _last_modified: str
+    # Modification time of the local file in nanoseconds
+    _mtime: int
+    # Time of the last successful check against the server
+    _checked_at: float
+
+    # Constructor
+    def __init__(self, url: str, size: int, etag: str, last_modified: str, mtime: int, checked_at: float):
+        self._url = url
+        self._size = size
+        self._etag = etag
+        self._last_modified = last_modified
+        self._mtime = mtime
+        self._checked_at = checked_at
+
+    # Returns the URL the file was downloaded from
+    def get_url(self) -> str:
+        return self._url
+
+    # Returns the size of the file
+    def get_size(self) -> int:
+        return self._size
+
+    # Returns the ETag validator
+    def get_etag(self) -> str:
+        return self._etag
+
+    # Returns the Last-Modified validator
+    def get_last_modified(self) -> str:
+        return self._last_modified
+
+    # Returns the modification time of the local file in nanoseconds
+    def get_mtime(self) -> int:
+        return self._mtime
+
+    # Returns the time of the last successful check against the server
+    def get_checked_at(self) -> float:
+        return self._checked_at
+
+    # Returns TRUE if the local file still matches the entry
+    def matches_local_file(self, file_path: str) -> bool:
+        try:
+            file_stat = stat(file_path)
+        except OSError:
+            return False
+        return (file_stat.st_size, file_stat.st_mtime_ns) == (self._size, self._mtime)
+
+    # Returns the entry as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "size": self.get_size(),
+            "etag": self.get_etag(),
+            "last_modified": self.get_last_modified(),
+            "mtime": self.get_mtime(),
+            "checked_at": self.get_checked_at(),
+        }
+
+    # Creates an entry from a dictionary
+    @staticmethod
+    def from_dict(url: str, entry: Dict[str, Any]) -> "ManifestEntry":
+        return ManifestEntry(
+            url=url,
+            size=entry.get("size", 0),
+            etag=entry.get("etag", ""),
+            last_modified=entry.get("last_modified", ""),
+            mtime=entry.get("mtime", 0),
+            checked_at=entry.get("checked_at", 0),
+        )
+
+
+# Class: DownloadManifest
+class DownloadManifest:
+    # Path of the manifest file
+    _file_path: str
+    # Entries keyed by URL
+    _entries: Dict[str, ManifestEntry]
+    # Lock guarding the entries and the manifest file
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, file_path: str):
+        self._file_path = file_path
+        self._entries = {}
+        self._lock = Lock()
+        self.load()
+
+    # Returns the path of the manifest file
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the entry for the URL
+    def get_entry(self, url: str) -> Optional[ManifestEntry]:
+        with self._lock:
+            return self._entries.get(url)
+
+    # Records an entry and writes the manifest, merged with the entries other processes wrote since it was loaded
+    def set_entry(self, entry: ManifestEntry) -> None:
+        with self._lock, file_lock(self._file_path):
+            self._entries = self._read()
+            self._entries[entry.get_url()] = entry
+            self._save()
+
+    # Loads the manifest from disk, starting empty if it is missing or unreadable
+    def load(self) -> None:
+        with self._lock:
+            self._entries = self._read()
+
+    # Reads the entries of the manifest file, empty if it is missing or unreadable
+    def _read(self) -> Dict[str, ManifestEntry]:
+        if not path.exists(self._file_path):
+            return {}
+        try:
+            with open(self._file_path, "r") as file:
+                entries = loads(file.read())
+            return {url: ManifestEntry.from_dict(url, entry) for url, entry in entries.items()}
+        except (ValueError, AttributeError):
+            print(f"Invalid download manifest: `{self._file_path}`, ignoring...")
+            return {}
+
+    # Writes the manifest atomically, callers hold the manifest file lock
+    def _save(self) -> None:
+        write_file_atomically(self._file_path, dumps({url: entry.to_dict() for url, entry in self._entries.items()}, indent=4))
@@ -0,0 +1,517 @@
+import zlib
+import sqlite3
+from os import path, scandir, stat
+from struct import unpack, unpack_from, error as StructError
+from contextlib import closing
+from typing import Dict, List, Any, BinaryIO, Optional, Tuple
+from PIL import Image
+from .storage import Storage
+from .parameters import GenerationParameters
+from .watcher import DELETED
+from .metrics import METADATA_READ_DURATION
+
+# Version of the metadata table layout, the index is rebuilt when it changes
+SCHEMA_VERSION = 5
+# Maximum length of the prompt snippet of an image
+PROMPT_SNIPPET_LENGTH = 120
+# Signature of PNG files
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# EXIF tag of the pointer to the EXIF sub-IFD
+EXIF_IFD_POINTER = 0x8769
+# EXIF tag of the user comment, where the webui stores the parameters of JPEG and WebP images
+EXIF_USER_COMMENT = 0x9286
+# Columns of the search results
+SEARCH_COLUMNS = "path, folder, name, inode, mtime_ns, size, width, height, prompt, negative_prompt, steps, sampler, cfg_scale, seed, image_size, model_hash, model, loras"
+# Columns the search results can be filtered on, keyed by filter name
+SEARCH_FILTERS = {"model_hash": "model_hash", "model": "model", "sampler": "sampler", "size": "image_size", "seed": "seed"}
+# Columns facet counts are computed for, keyed by facet name
+SEARCH_FACETS = {"model_hash": "model_hash", "sampler": "sampler", "size": "image_size"}
+# JPEG start of frame markers, which carry the image dimensions
+JPEG_FRAME_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+# Class: ImageMetadata
+class ImageMetadata:
+    # Generation parameters stored by the webui, None if the image has none
+    _parameters: Optional[str]
+    # Width of the image in pixels
+    _width: int
+    # Height of the image in pixels
+    _height: int
+
+    # Constructor
+    def __init__(self, parameters: Optional[str], width: int, height: int):
+        self._parameters = parameters
+        self._width = width
+        self._height = height
+
+    # Returns the generation parameters
+    def get_parameters(self) -> Optional[str]:
+        return self._parameters
+
+    # Returns the parsed generation parameters, or None if the image has none
+    def get_generation_parameters(self) -> Optional[GenerationParameters]:
+        return GenerationParameters.parse(self._parameters) if self._parameters else None
+
+    # Returns the width of the image
+    def get_width(self) -> int:
+        return self._width
+
+    # Returns the height of the image
+    def get_height(self) -> int:
+        return self._height
+
+    # Returns the beginning of the prompt, or an empty string if the image has no parameters
+    def get_prompt_snippet(self) -> str:
+        if not self._parameters:
+            return ""
+        prompt = self._parameters.split("\n", 1)[0].strip()
+        return prompt if len(prompt) <= PROMPT_SNIPPET_LENGTH else f"{prompt[:PROMPT_SNIPPET_LENGTH - 1]}…"
+
+    # Returns the metadata as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "parameters": self.get_parameters(),
+            "width": self.get_width(),
+            "height": self.get_height(),
+        }
+
+
+# Returns the metadata the webui stored in the image, reading only the headers in front of the image data
+def read_image_metadata(file_path: str) -> ImageMetadata:
+    with METADATA_READ_DURATION.time("native"):
+        metadata = _read_native_metadata(file_path)
+    if metadata is not None:
+        return metadata
+
+    with METADATA_READ_DURATION.time("pillow"), Image.open(file_path) as image:
+        return ImageMetadata(image.info.get("parameters"), image.width, image.height)
+
+
+# Walks the headers of the formats the webui writes, returns None for other or damaged files so Pillow can read them
+def _read_native_metadata(file_path: str) -> Optional[ImageMetadata]:
+    try:
+        with open(file_path, "rb") as file:
+            signature = file.read(12)
+            file.seek(0)
+            if signature.startswith(PNG_SIGNATURE):
+                return _read_png_metadata(file)
+            if signature.startswith(b"RIFF") and signature[8:12] == b"WEBP":
+                return _read_webp_metadata(file)
+            if signature.startswith(b"\xff\xd8"):
+                return _read_jpeg_metadata(file)
+    except (StructError, zlib.error, IndexError, UnicodeDecodeError):
+        pass
+    return None
+
+
+# Walks the PNG chunks up to the first image data chunk
+def _read_png_metadata(file: BinaryIO) -> ImageMetadata:
+    file.seek(len(PNG_SIGNATURE))
+    width, height = 0, 0
+    parameters = None
+
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = unpack(">I4s", header)
+        if chunk_type in [b"IDAT", b"IEND"]:
+            break
+
+        if chunk_type == b"IHDR":
+            width, height = unpack(">II", file.read(length)[:8])
+        elif chunk_type in [b"tEXt", b"zTXt", b"iTXt"]:
+            key, text = _read_png_text(chunk_type, file.read(length))
+            if key == "parameters":
+                parameters = text
+        else:
+            file.seek(length, 1)
+        file.seek(4, 1)
+
+    return ImageMetadata(parameters, width, height)
+
+
+# Returns the keyword and the text of a PNG text chunk
+def _read_png_text(chunk_type: bytes, data: bytes) -> Tuple[str, str]:
+    key, value = data.split(b"\0", 1)
+    if chunk_type == b"tEXt":
+        return key.decode("latin-1"), value.decode("latin-1")
+    if chunk_type == b"zTXt":
+        return key.decode("latin-1"), zlib.decompress(value[1:]).decode("latin-1")
+
+    compressed = value[0] == 1
+    _, value = value[2:].split(b"\0", 1)
+    _, text = value.split(b"\0", 1)
+    return key.decode("latin-1"), (zlib.decompress(text) if compressed else text).decode("utf-8")
+
+
+# Walks the WebP chunks, skipping the image data
+def _read_webp_metadata(file: BinaryIO) -> ImageMetadata:
+    file.seek(12)
+    width, height = 0, 0
+    parameters = None
+
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        chunk_type, length = unpack("<4sI", header)
+        padded_length = length + (length & 1)
+
+        if chunk_type == b"VP8X":
+            data = file.read(padded_length)
+            width = int.from_bytes(data[4:7], "little") + 1
+            height = int.from_bytes(data[7:10], "little") + 1
+        elif chunk_type == b"VP8 " and width == 0:
+            data = file.read(10)
+            width, height = unpack("<HH", data[6:10])
+            width, height = width & 0x3FFF, height & 0x3FFF
+            file.seek(padded_length - 10, 1)
+        elif chunk_type == b"VP8L" and width == 0:
+            data = file.read(5)
+            bits = int.from_bytes(data[1:5], "little")
+            width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            file.seek(padded_length - 5, 1)
+        elif chunk_type == b"EXIF":
+            data = file.read(padded_length)[:length]
+            parameters = _read_exif_user_comment(data[6:] if data.startswith(b"Exif\0\0") else data)
+        else:
+            file.seek(padded_length, 1)
+
+    return ImageMetadata(parameters, width, height)
+
+
+# Walks the JPEG segments up to the start of the scan
+def _read_jpeg_metadata(file: BinaryIO) -> ImageMetadata:
+    file.seek(2)
+    width, height = 0, 0
+    parameters = None
+
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        code = marker[1]
+        while code == 0xFF:
+            code = file.read(1)[0]
+        if code == 0xDA or code == 0xD9:
+            break
+        if 0xD0 <= code <= 0xD7 or code == 0x01:
+            continue
+
+        length = unpack(">H", file.read(2))[0] - 2
+        if code in JPEG_FRAME_MARKERS:
+            data = file.read(length)
+            height, width = unpack(">HH", data[1:5])
+        elif code == 0xE1:
+            data = file.read(length)
+            if data.startswith(b"Exif\0\0"):
+                parameters = _read_exif_user_comment(data[6:]) or parameters
+        elif code == 0xFE and parameters is None:
+            parameters = file.read(length).decode("utf-8", errors="ignore").rstrip("\0") or None
+        else:
+            file.seek(length, 1)
+
+    return ImageMetadata(parameters, width, height)
+
+
+# Returns the user comment of a TIFF-structured EXIF block, or None if it has none
+def _read_exif_user_comment(tiff: bytes) -> Optional[str]:
+    byte_order = "<" if tiff[:2] == b"II" else ">"
+    ifd_offset = unpack_from(f"{byte_order}I", tiff, 4)[0]
+
+    exif_entry = _find_exif_entry(tiff, byte_order, ifd_offset, EXIF_IFD_POINTER)
+    if exif_entry is None:
+        return None
+    exif_offset = unpack_from(f"{byte_order}I", tiff, exif_entry + 8)[0]
+
+    comment_entry = _find_exif_entry(tiff, byte_order, exif_offset, EXIF_USER_COMMENT)
+    if comment_entry is None:
+        return None
+    count = unpack_from(f"{byte_order}I", tiff, comment_entry + 4)[0]
+    data_offset = comment_entry + 8 if count <= 4 else unpack_from(f"{byte_order}I", tiff, comment_entry + 8)[0]
+    data = tiff[data_offset:data_offset + count]
+
+    prefix, body = data[:8], data[8:]
+    if prefix == b"UNICODE\0":
+        big_endian = len(body) > 1 and body[0] == 0 and body[1] != 0
+        text = body.decode("utf-16-be" if big_endian else "utf-16-le", errors="ignore")
+    else:
+        text = body.decode("utf-8", errors="ignore")
+    return text.rstrip("\0") or None
+
+
+# Returns the offset of the IFD entry with the given tag, or None if the IFD has no such entry
+def _find_exif_entry(tiff: bytes, byte_order: str, ifd_offset: int, tag: int) -> Optional[int]:
+    count = unpack_from(f"{byte_order}H", tiff, ifd_offset)[0]
+    for index in range(count):
+        entry_offset = ifd_offset + 2 + index * 12
+        if unpack_from(f"{byte_order}H", tiff, entry_offset)[0] == tag:
+            return entry_offset
+    return None
+
+
+# Class: MetadataIndex
+class MetadataIndex:
+    # Storage instance
+    _storage: Storage
+    # Path of the SQLite database holding the index
+    _file_path: str
+
+    # Constructor
+    def __init__(self, storage: Storage):
+        self._storage = storage
+        self._file_path = storage.get_metadata_index_file_path()
+        self._create_schema()
+
+    # Returns the storage instance
+    def get_storage(self) -> Storage:
+        return self._storage
+
+    # Returns the path of the SQLite database holding the index
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the metadata of the image, reading the file only if the indexed entry is outdated
+    def get_metadata(self, file_path: str) -> ImageMetadata:
+        file_stat = stat(file_path)
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT parameters, width, height FROM images WHERE path = ? AND mtime_ns = ? AND size = ?",
+                (file_path, file_stat.st_mtime_ns, file_stat.st_size),
+            ).fetchone()
+        if row is not None:
+            return ImageMetadata(row["parameters"], row["width"], row["height"])
+
+        metadata = read_image_metadata(file_path)
+        with closing(self._connect()) as connection, connection:
+            self._store(connection, file_path, file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size, metadata)
+        return metadata
+
+    # Returns the generation parameters of the image
+    def get_parameters(self, file_path: str) -> Optional[str]:
+        return self.get_metadata(file_path).get_parameters()
+
+    # Forgets the indexed metadata of an image, or of every image of a folder
+    def remove(self, file_path: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM images WHERE path = ? OR folder = ?", (file_path, file_path))
+            connection.execute("DELETE FROM folders WHERE path = ?", (file_path,))
+
+    # Forgets the indexed metadata of several images at once
+    def remove_images(self, file_paths: List[str]) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("DELETE FROM images WHERE path = ?", [(file_path,) for file_path in file_paths])
+
+    # Watcher callback, forgets deleted images and folders
+    def on_change(self, event: str, file_path: str) -> None:
+        if event == DELETED:
+            self.remove(file_path)
+
+    # Returns up to limit images matching the prompt text and the filters, newest first, following the sort key
+    def search(self, text: str, filters: Dict[str, Any], after: Optional[Tuple[int, str]], limit: int) -> List[Dict[str, Any]]:
+        conditions, arguments = self._get_search_conditions(text, filters)
+        if after is not None:
+            conditions.append("(mtime_ns < ? OR (mtime_ns = ? AND path > ?))")
+            arguments += [-after[0], -after[0], path.join(self._storage.get_images_path(), after[1])]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT {SEARCH_COLUMNS} FROM images {where} ORDER BY mtime_ns DESC, path LIMIT ?",
+                arguments + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # Returns the number of images matching the prompt text and the filters for each value of every facet
+    def get_facets(self, text: str, filters: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        facets: Dict[str, Dict[str, int]] = {}
+        with closing(self._connect()) as connection:
+            for name, column in SEARCH_FACETS.items():
+                conditions, arguments = self._get_search_conditions(text, {key: value for key, value in filters.items() if key != name})
+                conditions.append(f"{column} IS NOT NULL")
+                rows = connection.execute(
+                    f"SELECT {column} AS value, COUNT(*) AS count FROM images WHERE {' AND '.join(conditions)}"
+                    f" GROUP BY {column} ORDER BY count DESC",
+                    arguments,
+                ).fetchall()
+                facets[name] = {str(row["value"]): row["count"] for row in rows}
+        return facets
+
+    # Returns the SQL conditions and their arguments selecting the images matching the prompt text and the filters,
+    # every word of the text must appear in the prompt, or in either prompt with the negative filter, and the last one may be incomplete
+    def _get_search_conditions(self, text: str, filters: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        conditions: List[str] = []
+        arguments: List[Any] = []
+        terms = [term.replace('"', '""') for term in text.split()]
+        if terms:
+            columns = "{prompt negative_prompt}" if filters.get("negative") else "prompt"
+            conditions.append("id IN (SELECT rowid FROM images_search WHERE images_search MATCH ?)")
+            arguments.append(f"{columns} : (" + " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*)')
+        for name, column in SEARCH_FILTERS.items():
+            if filters.get(name) is not None:
+                conditions.append(f"{column} = ?")
+                arguments.append(filters[name])
+        if filters.get("date_from") is not None:
+            conditions.append("mtime_ns >= ?")
+            arguments.append(filters["date_from"])
+        if filters.get("date_to") is not None:
+            conditions.append("mtime_ns < ?")
+            arguments.append(filters["date_to"])
+        return conditions, arguments
+
+    # Brings the index up to date with the images directory, only listing folders whose modification time changed
+    def synchronize(self) -> None:
+        images_path = self._storage.get_images_path()
+        with closing(self._connect()) as connection:
+            known_folders = {row["path"]: row["mtime_ns"] for row in connection.execute("SELECT path, mtime_ns FROM folders")}
+
+        folders = set()
+        for entry in scandir(images_path):
+            if not entry.is_dir():
+                continue
+            folders.add(entry.path)
+            folder_mtime = entry.stat().st_mtime_ns
+            if known_folders.get(entry.path) != folder_mtime:
+                self._synchronize_folder(entry.path, folder_mtime)
+
+        for folder in set(known_folders) - folders:
+            self.remove(folder)
+
+    # Indexes the new and changed images of a folder and forgets the deleted ones
+    def _synchronize_folder(self, folder: str, folder_mtime: int) -> None:
+        with closing(self._connect()) as connection:
+            indexed = {
+                row["path"]: (row["inode"], row["mtime_ns"], row["size"])
+                for row in connection.execute("SELECT path, inode, mtime_ns, size FROM images WHERE folder = ?", (folder,))
+            }
+
+        present = set()
+        for entry in scandir(folder):
+            if not self._storage.is_supported_image(entry.name) or not entry.is_file():
+                continue
+            present.add(entry.path)
+            entry_stat = entry.stat()
+            if indexed.get(entry.path) == (entry_stat.st_ino, entry_stat.st_mtime_ns, entry_stat.st_size):
+                continue
+            try:
+                metadata = read_image_metadata(entry.path)
+            except (OSError, SyntaxError, ValueError):
+                continue
+            with closing(self._connect()) as connection, connection:
+                self._store(connection, entry.path, entry_stat.st_ino, entry_stat.st_mtime_ns, entry_stat.st_size, metadata)
+
+        with closing(self._connect()) as connection, connection:
+            for file_path in set(indexed) - present:
+                connection.execute("DELETE FROM images WHERE path = ?", (file_path,))
+            connection.execute("INSERT OR REPLACE INTO folders (path, mtime_ns) VALUES (?, ?)", (folder, folder_mtime))
+
+    # Writes the metadata of an image and its parsed generation parameters, updating rows in place to keep the search index in sync
+    # The inode, size and mtime are kept so search results can be versioned without listing their folders
+    def _store(self, connection: sqlite3.Connection, file_path: str, inode: int, mtime: int, size: int, metadata: ImageMetadata) -> None:
+        parameters = metadata.get_generation_parameters()
+        connection.execute(
+            "INSERT INTO images (path, folder, name, inode, mtime_ns, size, width, height, parameters,"
+            " prompt, negative_prompt, steps, sampler, cfg_scale, seed, image_size, model_hash, model, loras)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (path) DO UPDATE SET inode = excluded.inode, mtime_ns = excluded.mtime_ns, size = excluded.size,"
+            " width = excluded.width, height = excluded.height, parameters = excluded.parameters,"
+            " prompt = excluded.prompt, negative_prompt = excluded.negative_prompt, steps = excluded.steps,"
+            " sampler = excluded.sampler, cfg_scale = excluded.cfg_scale, seed = excluded.seed,"
+            " image_size = excluded.image_size, model_hash = excluded.model_hash, model = excluded.model,"
+            " loras = excluded.loras",
+            (
+                file_path,
+                path.dirname(file_path),
+                path.basename(file_path),
+                inode,
+                mtime,
+                size,
+                metadata.get_width(),
+                metadata.get_height(),
+                metadata.get_parameters(),
+                parameters.get_prompt() if parameters is not None else None,
+                parameters.get_negative_prompt() if parameters is not None else None,
+                parameters.get_steps() if parameters is not None else None,
+                parameters.get_sampler() or None if parameters is not None else None,
+                parameters.get_cfg_scale() if parameters is not None else None,
+                parameters.get_seed() if parameters is not None else None,
+                parameters.get_size() or None if parameters is not None else None,
+                parameters.get_model_hash() or None if parameters is not None else None,
+                parameters.get_model() or None if parameters is not None else None,
+                ",".join(parameters.get_loras()) or None if parameters is not None else None,
+            ),
+        )
+
+    # Opens a connection to the metadata database
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._file_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    # Creates the metadata tables, dropping an index written with an older layout
+    def _create_schema(self) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                connection.execute("DROP TABLE IF EXISTS images_search")
+                connection.execute("DROP TABLE IF EXISTS images")
+                connection.execute("DROP TABLE IF EXISTS folders")
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                " id INTEGER PRIMARY KEY,"
+                " path TEXT NOT NULL UNIQUE,"
+                " folder TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " inode INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " width INTEGER NOT NULL,"
+                " height INTEGER NOT NULL,"
+                " parameters TEXT,"
+                " prompt TEXT,"
+                " negative_prompt TEXT,"
+                " steps INTEGER,"
+                " sampler TEXT,"
+                " cfg_scale REAL,"
+                " seed INTEGER,"
+                " image_size TEXT,"
+                " model_hash TEXT,"
+                " model TEXT,"
+                " loras TEXT)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS images_folder ON images (folder)")
+            connection.execute("CREATE INDEX IF NOT EXISTS images_mtime ON images (mtime_ns DESC, path)")
+            connection.execute("CREATE INDEX IF NOT EXISTS images_model_hash ON images (model_hash, mtime_ns DESC)")
+            connection.execute("CREATE INDEX IF NOT EXISTS images_sampler ON images (sampler, mtime_ns DESC)")
+            connection.execute("CREATE INDEX IF NOT EXISTS images_image_size ON images (image_size, mtime_ns DESC)")
+            connection.execute("CREATE INDEX IF NOT EXISTS images_seed ON images (seed)")
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS images_search USING fts5("
+                " prompt, negative_prompt, content = 'images', content_rowid = 'id')"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS images_search_insert AFTER INSERT ON images BEGIN"
+                " INSERT INTO images_search (rowid, prompt, negative_prompt) VALUES (new.id, new.prompt, new.negative_prompt);"
+                " END"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS images_search_delete AFTER DELETE ON images BEGIN"
+                " INSERT INTO images_search (images_search, rowid, prompt, negative_prompt)"
+                " VALUES ('delete', old.id, old.prompt, old.negative_prompt);"
+                " END"
+            )
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS images_search_update AFTER UPDATE ON images BEGIN"
+                " INSERT INTO images_search (images_search, rowid, prompt, negative_prompt)"
+                " VALUES ('delete', old.id, old.prompt, old.negative_prompt);"
+                " INSERT INTO images_search (rowid, prompt, negative_prompt) VALUES (new.id, new.prompt, new.negative_prompt);"
+                " END"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS folders ("
+                " path TEXT PRIMARY KEY,"
+                " mtime_ns INTEGER NOT NULL)"
+            )
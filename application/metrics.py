@@ -0,0 +1,325 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from time import perf_counter
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+# Default histogram buckets in seconds, from a cached page to a slow folder scan
+DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# Histogram buckets of download throughputs in bytes per second, from 64 KiB/s to 1 GiB/s
+THROUGHPUT_BUCKETS = [float(64 * 1024 * 4 ** exponent) for exponent in range(8)]
+
+
+# Returns a sample value in the Prometheus text format
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in [float("inf"), float("-inf")]:
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+# Returns a label value escaped for the Prometheus text format
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Returns the label set of a sample in the Prometheus text format
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+
+# Class: Metric
+class Metric(ABC):
+    # Registry the metric belongs to
+    _registry: "MetricsRegistry"
+    # Name of the metric
+    _name: str
+    # Help text of the metric
+    _help: str
+    # Names of the labels of the metric
+    _label_names: Tuple[str, ...]
+    # Lock guarding the values
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, label_names: Tuple[str, ...]):
+        self._registry = registry
+        self._name = name
+        self._help = help_text
+        self._label_names = label_names
+        self._lock = Lock()
+
+    # Returns the name of the metric
+    def get_name(self) -> str:
+        return self._name
+
+    # Returns the help text of the metric
+    def get_help(self) -> str:
+        return self._help
+
+    # Returns the names of the labels of the metric
+    def get_label_names(self) -> Tuple[str, ...]:
+        return self._label_names
+
+    # Returns the Prometheus type of the metric
+    @abstractmethod
+    def get_type(self) -> str:
+        pass
+
+    # Returns the sample lines of the metric
+    @abstractmethod
+    def get_samples(self) -> List[str]:
+        pass
+
+    # Returns the metric in the Prometheus text format
+    def render(self) -> str:
+        lines = [f"# HELP {self._name} {self._help}", f"# TYPE {self._name} {self.get_type()}"] + self.get_samples()
+        return "\n".join(lines) + "\n"
+
+
+# Class: Counter
+class Counter(Metric):
+    # Values keyed by label values
+    _values: Dict[Tuple[str, ...], float]
+
+    # Constructor
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, label_names: Tuple[str, ...]):
+        super().__init__(registry, name, help_text, label_names)
+        self._values = {}
+
+    # Returns the Prometheus type of the metric
+    def get_type(self) -> str:
+        return "counter"
+
+    # Returns the value of the counter for the label values
+    def get_value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    # Increases the counter for the label values
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        if not self._registry.is_enabled():
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    # Returns the sample lines of the metric
+    def get_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self._name}{_format_labels(self._label_names, labels)} {_format_value(value)}" for labels, value in values]
+
+
+# Class: Gauge
+class Gauge(Counter):
+    # Returns the Prometheus type of the metric
+    def get_type(self) -> str:
+        return "gauge"
+
+    # Sets the gauge for the label values
+    def set(self, value: float, *labels: str) -> None:
+        if not self._registry.is_enabled():
+            return
+        with self._lock:
+            self._values[labels] = value
+
+    # Decreases the gauge for the label values
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+# Class: Histogram
+class Histogram(Metric):
+    # Upper bounds of the buckets, without the implicit +Inf one
+    _buckets: List[float]
+    # Per-bucket observation counts, sum and count keyed by label values
+    _values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]]
+
+    # Constructor
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, label_names: Tuple[str, ...], buckets: List[float]):
+        super().__init__(registry, name, help_text, label_names)
+        self._buckets = sorted(buckets)
+        self._values = {}
+
+    # Returns the Prometheus type of the metric
+    def get_type(self) -> str:
+        return "histogram"
+
+    # Returns the upper bounds of the buckets
+    def get_buckets(self) -> List[float]:
+        return self._buckets
+
+    # Returns the number of observations for the label values
+    def get_count(self, *labels: str) -> int:
+        with self._lock:
+            value = self._values.get(labels)
+            return sum(value[0]) if value is not None else 0
+
+    # Records an observation for the label values
+    def observe(self, value: float, *labels: str) -> None:
+        if not self._registry.is_enabled():
+            return
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self._buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    # Returns a context manager observing the time spent in its block, in seconds
+    def time(self, *labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    # Returns the sample lines of the metric, with cumulative buckets
+    def get_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self._values.items())
+
+        lines: List[str] = []
+        bucket_label_names = self._label_names + ("le",)
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets + [float("inf")], counts):
+                cumulative += count
+                lines.append(f"{self._name}_bucket{_format_labels(bucket_label_names, labels + (_format_value(bound),))} {cumulative}")
+            lines.append(f"{self._name}_sum{_format_labels(self._label_names, labels)} {_format_value(total)}")
+            lines.append(f"{self._name}_count{_format_labels(self._label_names, labels)} {cumulative}")
+        return lines
+
+
+# Class: Timer
+class Timer:
+    # Histogram receiving the measured time
+    _histogram: Histogram
+    # Label values of the observation
+    _labels: Tuple[str, ...]
+    # Time the block was entered at
+    _started_at: float
+
+    # Constructor
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self._histogram = histogram
+        self._labels = labels
+        self._started_at = 0.0
+
+    # Starts measuring
+    def __enter__(self) -> "Timer":
+        self._started_at = perf_counter()
+        return self
+
+    # Records the time spent in the block, also when it raised
+    def __exit__(self, *exception: object) -> None:
+        self._histogram.observe(perf_counter() - self._started_at, *self._labels)
+
+
+# Class: MetricsRegistry
+class MetricsRegistry:
+    # Registered metrics keyed by name, in registration order
+    _metrics: Dict[str, Metric]
+    # Whether observations are recorded, disabled metrics cost one attribute check
+    _enabled: bool
+
+    # Constructor
+    def __init__(self, enabled: bool = True):
+        self._metrics = {}
+        self._enabled = enabled
+
+    # Returns TRUE if observations are recorded
+    def is_enabled(self) -> bool:
+        return self._enabled
+
+    # Enables or disables recording observations
+    def set_enabled(self, enabled: bool) -> "MetricsRegistry":
+        self._enabled = enabled
+        return self
+
+    # Returns the registered metric with the given name
+    def get_metric(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    # Registers a counter
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, label_names))
+
+    # Registers a gauge
+    def gauge(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(self, name, help_text, label_names))
+
+    # Registers a histogram
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Optional[List[float]] = None) -> Histogram:
+        return self._register(Histogram(self, name, help_text, label_names, buckets or DURATION_BUCKETS))
+
+    # Returns every metric in the Prometheus text format
+    def render(self) -> str:
+        return "".join(metric.render() for metric in list(self._metrics.values()))
+
+    # Adds a metric to the registry, refusing duplicate names
+    def _register(self, metric: Metric) -> Metric:
+        if metric.get_name() in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.get_name()}")
+        self._metrics[metric.get_name()] = metric
+        return metric
+
+
+# Registry of the metrics of this process, exposed on /metrics
+METRICS = MetricsRegistry()
+
+# Requests answered by the server
+HTTP_REQUESTS = METRICS.counter("sdm_http_requests_total", "Requests answered, by method, route and status.", ("method", "route", "status"))
+# Time spent answering requests
+HTTP_REQUEST_DURATION = METRICS.histogram(
+    "sdm_http_request_duration_seconds",
+    "Time from routing a request to handing its response to the server, by method and route.",
+    ("method", "route"),
+)
+# Requests being answered
+HTTP_REQUESTS_IN_PROGRESS = METRICS.gauge("sdm_http_requests_in_progress", "Requests being answered.")
+# Time spent listing image folders
+FOLDER_SCAN_DURATION = METRICS.histogram("sdm_folder_scan_seconds", "Time spent listing and stating the images of a folder.")
+# Folder listing lookups
+FOLDER_LISTING_LOOKUPS = METRICS.counter("sdm_folder_listing_lookups_total", "Folder listing lookups, by result (hit or scan).", ("result",))
+# Time spent reading image metadata
+METADATA_READ_DURATION = METRICS.histogram(
+    "sdm_metadata_read_seconds",
+    "Time spent reading the metadata of an image, by reader (native chunk walk or pillow).",
+    ("reader",),
+)
+# Time spent rendering templates
+TEMPLATE_RENDER_DURATION = METRICS.histogram("sdm_template_render_seconds", "Time spent rendering a page template, by template.", ("template",))
+# Time spent moving images to the trash or back
+IMAGE_TRASH_DURATION = METRICS.histogram(
+    "sdm_image_trash_operation_seconds",
+    "Time spent moving a batch of images to the trash or back, by operation (delete or restore).",
+    ("operation",),
+)
+# Images moved to the trash or back
+IMAGE_TRASH_OPERATIONS = METRICS.counter(
+    "sdm_images_trashed_total",
+    "Images moved to the trash or back, by operation (delete or restore).",
+    ("operation",),
+)
+# Bytes received by the downloader
+DOWNLOAD_BYTES = METRICS.counter("sdm_download_bytes_total", "Bytes received by the downloader, by host.", ("host",))
+# Throughput of the downloader responses
+DOWNLOAD_THROUGHPUT = METRICS.histogram(
+    "sdm_download_throughput_bytes_per_second",
+    "Average throughput of each downloaded response body, by host.",
+    ("host",),
+    THROUGHPUT_BUCKETS,
+)
+# Interrupted downloader transfers
+DOWNLOAD_RETRIES = METRICS.counter(
+    "sdm_download_retries_total",
+    "Transient errors interrupting a transfer, retried on the same or another source until the attempts run out, by host.",
+    ("host",),
+)
+# Time to the response headers of the downloader requests
+DOWNLOAD_TIME_TO_FIRST_BYTE = METRICS.histogram(
+    "sdm_download_time_to_first_byte_seconds",
+    "Time from sending a download request to receiving its response headers, by host.",
+    ("host",),
+)
@@ -0,0 +1,130 @@
+import re
+from typing import Dict, List, Any, Optional
+
+# Matches one "Key: value" pair of the settings line, values may be quoted
+SETTING_PATTERN = re.compile(r'\s*([\w][\w \-/]+):\s*("(?:\\.|[^\\"])+"|[^,]*)(?:,|$)')
+# Matches a LoRA reference in a prompt, e.g. <lora:name:0.8>
+LORA_PATTERN = re.compile(r"<(?:lora|lyco):([^:>]+)(?::[^>]*)?>")
+
+
+# Class: GenerationParameters
+class GenerationParameters:
+    # Positive prompt
+    _prompt: str
+    # Negative prompt
+    _negative_prompt: str
+    # Settings of the last line, keyed by name
+    _settings: Dict[str, str]
+    # Names of the LoRAs used by the prompt
+    _loras: List[str]
+
+    # Constructor
+    def __init__(self, prompt: str, negative_prompt: str, settings: Dict[str, str], loras: List[str]):
+        self._prompt = prompt
+        self._negative_prompt = negative_prompt
+        self._settings = settings
+        self._loras = loras
+
+    # Returns the positive prompt
+    def get_prompt(self) -> str:
+        return self._prompt
+
+    # Returns the negative prompt
+    def get_negative_prompt(self) -> str:
+        return self._negative_prompt
+
+    # Returns the settings keyed by name
+    def get_settings(self) -> Dict[str, str]:
+        return self._settings
+
+    # Returns a setting, or the default if it is missing
+    def get_setting(self, name: str, default: str = "") -> str:
+        return self._settings.get(name, default)
+
+    # Returns the number of sampling steps, or None if it is missing
+    def get_steps(self) -> Optional[int]:
+        return self._to_int(self.get_setting("Steps"))
+
+    # Returns the sampler name
+    def get_sampler(self) -> str:
+        return self.get_setting("Sampler")
+
+    # Returns the CFG scale, or None if it is missing
+    def get_cfg_scale(self) -> Optional[float]:
+        try:
+            return float(self.get_setting("CFG scale"))
+        except ValueError:
+            return None
+
+    # Returns the seed, or None if it is missing
+    def get_seed(self) -> Optional[int]:
+        return self._to_int(self.get_setting("Seed"))
+
+    # Returns the generation size as "WIDTHxHEIGHT"
+    def get_size(self) -> str:
+        return self.get_setting("Size")
+
+    # Returns the short hash of the model
+    def get_model_hash(self) -> str:
+        return self.get_setting("Model hash")
+
+    # Returns the name of the model
+    def get_model(self) -> str:
+        return self.get_setting("Model")
+
+    # Returns the names of the LoRAs used by the prompt
+    def get_loras(self) -> List[str]:
+        return self._loras
+
+    # Returns the parameters as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt": self.get_prompt(),
+            "negative_prompt": self.get_negative_prompt(),
+            "steps": self.get_steps(),
+            "sampler": self.get_sampler(),
+            "cfg_scale": self.get_cfg_scale(),
+            "seed": self.get_seed(),
+            "size": self.get_size(),
+            "model_hash": self.get_model_hash(),
+            "model": self.get_model(),
+            "loras": self.get_loras(),
+            "settings": self.get_settings(),
+        }
+
+    # Returns the integer value of a setting, or None if it is not a number
+    def _to_int(self, value: str) -> Optional[int]:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    # Parses the parameters text written by the AUTOMATIC1111 webui
+    @staticmethod
+    def parse(text: str) -> "GenerationParameters":
+        lines = text.strip().split("\n")
+        settings: Dict[str, str] = {}
+        if lines and len(SETTING_PATTERN.findall(lines[-1])) >= 3:
+            for name, value in SETTING_PATTERN.findall(lines.pop()):
+                if value.startswith('"') and value.endswith('"'):
+                    value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+                settings[name.strip()] = value.strip()
+
+        prompt_lines: List[str] = []
+        negative_lines: List[str] = []
+        for line in lines:
+            if line.startswith("Negative prompt:"):
+                negative_lines.append(line[len("Negative prompt:"):].strip())
+            elif negative_lines:
+                negative_lines.append(line)
+            else:
+                prompt_lines.append(line)
+
+        prompt = "\n".join(prompt_lines).strip()
+        loras = []
+        for lora in LORA_PATTERN.findall(prompt) + [entry.split(":")[0] for entry in settings.get("Lora hashes", "").split(",")]:
+            lora = lora.strip()
+            if lora != "" and lora not in loras:
+                loras.append(lora)
+
+        return GenerationParameters(prompt, "\n".join(negative_lines).strip(), settings, loras)
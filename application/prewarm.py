@@ -0,0 +1,88 @@
+from os import path
+from time import monotonic, sleep
+from collections import OrderedDict
+from threading import Thread, Condition
+from typing import Optional
+from .storage import Storage
+from .thumbnails import ThumbnailCache
+from .metadata import MetadataIndex
+from .watcher import CREATED, DELETED
+
+
+# Class: Prewarmer
+class Prewarmer:
+    # Storage instance
+    _storage: Storage
+    # Cache of image thumbnails
+    _thumbnail_cache: ThumbnailCache
+    # Index of image metadata
+    _metadata_index: MetadataIndex
+    # Maximum number of images prepared per second
+    _rate: float
+    # Images waiting to be prepared, oldest first
+    _pending: "OrderedDict[str, None]"
+    # Condition guarding the pending images
+    _condition: Condition
+    # Preparing thread, started on demand
+    _thread: Optional[Thread]
+
+    # Constructor
+    def __init__(self, storage: Storage, thumbnail_cache: ThumbnailCache, metadata_index: MetadataIndex, rate: float):
+        self._storage = storage
+        self._thumbnail_cache = thumbnail_cache
+        self._metadata_index = metadata_index
+        self._rate = rate
+        self._pending = OrderedDict()
+        self._condition = Condition()
+        self._thread = None
+
+    # Returns the maximum number of images prepared per second
+    def get_rate(self) -> float:
+        return self._rate
+
+    # Returns the number of images waiting to be prepared
+    def get_pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    # Watcher callback, queues new images and drops deleted ones
+    def on_change(self, event: str, file_path: str) -> None:
+        if path.splitext(file_path)[1] not in self._storage.get_supported_image_extensions():
+            return
+
+        with self._condition:
+            if event == CREATED:
+                self._pending.pop(file_path, None)
+                self._pending[file_path] = None
+                self._condition.notify()
+            elif event == DELETED:
+                self._pending.pop(file_path, None)
+
+    # Starts preparing images in the background
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # Preparing thread, handles one image at a time and never more than the configured rate
+    def _run(self) -> None:
+        interval = 1 / self._rate
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                file_path, _ = self._pending.popitem(last=False)
+
+            started_at = monotonic()
+            self._prepare(file_path)
+            sleep(max(0.0, interval - (monotonic() - started_at)))
+
+    # Builds the thumbnail and the metadata index entry of an image
+    def _prepare(self, file_path: str) -> None:
+        if not path.isfile(file_path):
+            return
+        try:
+            self._thumbnail_cache.get_thumbnail(file_path)
+            self._metadata_index.get_metadata(file_path)
+        except Exception as exception:
+            print(f"Unable to prepare `{file_path}`: {exception}")
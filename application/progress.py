@@ -0,0 +1,240 @@
+from sys import stdout
+from time import time, sleep
+from json import dumps
+from threading import Thread, Lock
+from typing import Dict, List, Any, Optional
+from .helpers import bytes_to_readable, seconds_to_readable
+from .client import TransferCancelledError
+
+
+# Class: TransferProgress
+class TransferProgress:
+    # URL being downloaded
+    _url: str
+    # Local file path being written
+    _file_path: str
+    # Total size of the file in bytes (0 if unknown)
+    _total: int
+    # Bytes already present when the transfer started
+    _initial: int
+    # Bytes downloaded so far, including the initial bytes
+    _downloaded: int
+    # Time the transfer started
+    _started_at: float
+    # TRUE once the transfer has been asked to stop
+    _cancelled: bool
+    # Lock guarding the downloaded counter
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, url: str, file_path: str, total: int, initial: int = 0):
+        self._url = url
+        self._file_path = file_path
+        self._total = total
+        self._initial = initial
+        self._downloaded = initial
+        self._started_at = time()
+        self._cancelled = False
+        self._lock = Lock()
+
+    # Returns the URL being downloaded
+    def get_url(self) -> str:
+        return self._url
+
+    # Returns the local file path being written
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the total size of the file
+    def get_total(self) -> int:
+        return self._total
+
+    # Returns the bytes downloaded so far
+    def get_downloaded(self) -> int:
+        return self._downloaded
+
+    # Returns the time the transfer started
+    def get_started_at(self) -> float:
+        return self._started_at
+
+    # Returns TRUE once the transfer has been asked to stop
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    # Asks the transfer to stop at its next write
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    # Records downloaded bytes, stopping the transfer if it was cancelled
+    def add(self, size: int) -> None:
+        if self._cancelled:
+            raise TransferCancelledError(f"Cancelled: {self._url}")
+        with self._lock:
+            self._downloaded += size
+
+    # Forgets all downloaded bytes, used when a transfer restarts from the first byte
+    def reset(self) -> None:
+        with self._lock:
+            self._initial = 0
+            self._downloaded = 0
+            self._started_at = time()
+
+    # Returns the average speed of this transfer in bytes per second
+    def get_speed(self) -> float:
+        elapsed_time = time() - self._started_at
+        return (self._downloaded - self._initial) / elapsed_time if elapsed_time > 0 else 0
+
+    # Returns the estimated number of seconds left
+    def get_eta(self) -> float:
+        speed = self.get_speed()
+        remaining_size = max(0, self._total - self._downloaded)
+        return remaining_size / speed if speed > 0 else 0
+
+    # Returns the completion percentage
+    def get_percentage(self) -> float:
+        return (self._downloaded / self._total) * 100 if self._total > 0 else 0
+
+    # Returns the progress as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.get_url(),
+            "file_path": self.get_file_path(),
+            "downloaded": self.get_downloaded(),
+            "total": self.get_total(),
+            "speed": round(self.get_speed()),
+            "eta": round(self.get_eta()),
+            "percentage": round(self.get_percentage(), 2),
+        }
+
+
+# Class: ProgressReporter
+class ProgressReporter:
+    # Output mode, either "text" or "json"
+    _mode: str
+    # Number of seconds between two progress reports
+    _interval: float
+    # Transfers currently running
+    _transfers: List[TransferProgress]
+    # Lock guarding the transfers and the output
+    _lock: Lock
+    # Reporting thread, started with the first transfer
+    _thread: Optional[Thread]
+    # Total bytes of all active transfers at the previous report
+    _last_downloaded: int
+    # Time of the previous report
+    _last_reported_at: float
+    # TRUE if the last text output left an unterminated progress line
+    _line_open: bool
+
+    # Constructor
+    def __init__(self, mode: str = "text", interval: float = 1.0):
+        self._mode = mode if mode in ["text", "json"] else "text"
+        self._interval = max(0.1, interval)
+        self._transfers = []
+        self._lock = Lock()
+        self._thread = None
+        self._last_downloaded = 0
+        self._last_reported_at = time()
+        self._line_open = False
+
+    # Returns the output mode
+    def get_mode(self) -> str:
+        return self._mode
+
+    # Returns the number of seconds between two progress reports
+    def get_interval(self) -> float:
+        return self._interval
+
+    # Returns the transfers currently running
+    def get_transfers(self) -> List[TransferProgress]:
+        with self._lock:
+            return list(self._transfers)
+
+    # Registers a new transfer and returns its progress tracker
+    def begin(self, url: str, file_path: str, total: int, initial: int = 0) -> TransferProgress:
+        transfer = TransferProgress(url, file_path, total, initial)
+        with self._lock:
+            self._transfers.append(transfer)
+            self._last_downloaded += initial
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._emit("started", transfer.to_dict(), f"Downloading: {url} - {bytes_to_readable(total)}")
+        return transfer
+
+    # Unregisters a finished or failed transfer
+    def end(self, transfer: TransferProgress, error: str = "") -> None:
+        with self._lock:
+            if transfer in self._transfers:
+                self._transfers.remove(transfer)
+                self._last_downloaded -= transfer.get_downloaded()
+
+        fields = transfer.to_dict()
+        if error != "":
+            fields["error"] = error
+            self._emit("failed", fields, f"Unable to download: {transfer.get_url()} ({error})")
+        else:
+            elapsed_time = time() - transfer.get_started_at()
+            self._emit("finished", fields, f"Downloaded: {transfer.get_url()} - {bytes_to_readable(transfer.get_downloaded())} in {seconds_to_readable(elapsed_time)}")
+
+    # Writes a message that is not tied to the progress of a transfer
+    def message(self, text: str, **fields: Any) -> None:
+        self._emit("message", dict(fields, message=text), text)
+
+    # Reporting thread, emits aggregate progress at a fixed interval
+    def _run(self) -> None:
+        while True:
+            sleep(self._interval)
+            self._report()
+
+    # Emits the progress of all active transfers
+    def _report(self) -> None:
+        with self._lock:
+            transfers = list(self._transfers)
+            downloaded = sum(transfer.get_downloaded() for transfer in transfers)
+            total = sum(transfer.get_total() for transfer in transfers)
+            now = time()
+            elapsed_time = now - self._last_reported_at
+            speed = max(0, downloaded - self._last_downloaded) / elapsed_time if elapsed_time > 0 else 0
+            self._last_downloaded = downloaded
+            self._last_reported_at = now
+
+        if not transfers:
+            return
+
+        eta = max(0, total - downloaded) / speed if speed > 0 else 0
+        percentage = (downloaded / total) * 100 if total > 0 else 0
+
+        if self._mode == "json":
+            with self._lock:
+                for transfer in transfers:
+                    stdout.write(dumps(dict(transfer.to_dict(), event="progress", time=now)) + "\n")
+                stdout.write(dumps({
+                    "event": "aggregate",
+                    "time": now,
+                    "active": len(transfers),
+                    "downloaded": downloaded,
+                    "total": total,
+                    "speed": round(speed),
+                    "eta": round(eta),
+                    "percentage": round(percentage, 2),
+                }) + "\n")
+                stdout.flush()
+        else:
+            with self._lock:
+                stdout.write(
+                    f"\r[{len(transfers)} active] {bytes_to_readable(downloaded)} / {bytes_to_readable(total)} - {bytes_to_readable(speed)}/s - {seconds_to_readable(eta)} - {percentage:.2f}%")
+                stdout.flush()
+                self._line_open = True
+
+    # Writes an event as a JSON line or as a text line
+    def _emit(self, event: str, fields: Dict[str, Any], text: str) -> None:
+        with self._lock:
+            if self._mode == "json":
+                stdout.write(dumps(dict(fields, event=event, time=time())) + "\n")
+            else:
+                if self._line_open:
+                    stdout.write("\n")
+                    self._line_open = False
+                stdout.write(f"{text}\n")
+            stdout.flush()
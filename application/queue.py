@@ -0,0 +1,494 @@
+import sqlite3
+from os import path
+from time import time, sleep
+from json import dumps, loads
+from urllib.parse import urlparse
+from contextlib import closing
+from threading import Thread, Condition, Lock
+from typing import Dict, List, Any, Optional
+from .client import TransferCancelledError
+from .downloader import Downloader
+from .scheduler import DownloadJob
+from .configuration import DownloadableEntity, CheckpointConfiguration, LoraConfiguration, UpscalerConfiguration
+
+# Download states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+# Class: QueuedDownload
+class QueuedDownload:
+    # Identifier of the download
+    _id: int
+    # Model kind, either "checkpoints", "loras" or "upscalers"
+    _kind: str
+    # File name of the model
+    _name: str
+    # URL of the model
+    _url: str
+    # Expected SHA-256 hash of the model
+    _sha256: str
+    # Alternative URLs serving the same model
+    _mirrors: List[str]
+    # Local file path of the model
+    _file_path: str
+    # Priority, higher downloads start first
+    _priority: int
+    # State of the download
+    _status: str
+    # Error message of a failed download
+    _error: str
+    # Bytes downloaded so far
+    _downloaded: int
+    # Total size in bytes (0 if unknown)
+    _total: int
+    # Current speed in bytes per second
+    _speed: float
+    # Estimated number of seconds left
+    _eta: float
+    # TRUE if the download was asked to stop while running
+    _cancel_requested: bool
+    # Time the download was queued
+    _created_at: float
+    # Time the download was last updated
+    _updated_at: float
+
+    # Constructor
+    def __init__(
+        self,
+        id: int,
+        kind: str,
+        name: str,
+        url: str,
+        sha256: str,
+        mirrors: List[str],
+        file_path: str,
+        priority: int,
+        status: str,
+        error: str,
+        downloaded: int,
+        total: int,
+        speed: float,
+        eta: float,
+        cancel_requested: bool,
+        created_at: float,
+        updated_at: float,
+    ):
+        self._id = id
+        self._kind = kind
+        self._name = name
+        self._url = url
+        self._sha256 = sha256
+        self._mirrors = mirrors
+        self._file_path = file_path
+        self._priority = priority
+        self._status = status
+        self._error = error
+        self._downloaded = downloaded
+        self._total = total
+        self._speed = speed
+        self._eta = eta
+        self._cancel_requested = cancel_requested
+        self._created_at = created_at
+        self._updated_at = updated_at
+
+    # Returns the identifier of the download
+    def get_id(self) -> int:
+        return self._id
+
+    # Returns the model kind
+    def get_kind(self) -> str:
+        return self._kind
+
+    # Returns the file name of the model
+    def get_name(self) -> str:
+        return self._name
+
+    # Returns the URL of the model
+    def get_url(self) -> str:
+        return self._url
+
+    # Returns the expected SHA-256 hash of the model
+    def get_sha256(self) -> str:
+        return self._sha256
+
+    # Returns the alternative URLs serving the same model
+    def get_mirrors(self) -> List[str]:
+        return self._mirrors
+
+    # Returns the local file path of the model
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the priority
+    def get_priority(self) -> int:
+        return self._priority
+
+    # Returns the state of the download
+    def get_status(self) -> str:
+        return self._status
+
+    # Returns the error message of a failed download
+    def get_error(self) -> str:
+        return self._error
+
+    # Returns the bytes downloaded so far
+    def get_downloaded(self) -> int:
+        return self._downloaded
+
+    # Returns the total size in bytes
+    def get_total(self) -> int:
+        return self._total
+
+    # Returns the current speed in bytes per second
+    def get_speed(self) -> float:
+        return self._speed
+
+    # Returns the estimated number of seconds left
+    def get_eta(self) -> float:
+        return self._eta
+
+    # Returns TRUE if the download was asked to stop while running
+    def is_cancel_requested(self) -> bool:
+        return self._cancel_requested
+
+    # Returns the time the download was queued
+    def get_created_at(self) -> float:
+        return self._created_at
+
+    # Returns the time the download was last updated
+    def get_updated_at(self) -> float:
+        return self._updated_at
+
+    # Returns the download as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.get_id(),
+            "kind": self.get_kind(),
+            "name": self.get_name(),
+            "url": self.get_url(),
+            "sha256": self.get_sha256(),
+            "mirrors": self.get_mirrors(),
+            "priority": self.get_priority(),
+            "status": self.get_status(),
+            "error": self.get_error(),
+            "downloaded": self.get_downloaded(),
+            "total": self.get_total(),
+            "speed": round(self.get_speed()),
+            "eta": round(self.get_eta()),
+            "percentage": round((self.get_downloaded() / self.get_total()) * 100, 2) if self.get_total() > 0 else 0,
+            "cancel_requested": self.is_cancel_requested(),
+            "created_at": self.get_created_at(),
+            "updated_at": self.get_updated_at(),
+        }
+
+    # Creates a download from a database row
+    @staticmethod
+    def from_row(row: sqlite3.Row) -> "QueuedDownload":
+        return QueuedDownload(
+            id=row["id"],
+            kind=row["kind"],
+            name=row["name"],
+            url=row["url"],
+            sha256=row["sha256"],
+            mirrors=loads(row["mirrors"]),
+            file_path=row["file_path"],
+            priority=row["priority"],
+            status=row["status"],
+            error=row["error"],
+            downloaded=row["downloaded"],
+            total=row["total"],
+            speed=row["speed"],
+            eta=row["eta"],
+            cancel_requested=bool(row["cancel_requested"]),
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+        )
+
+
+# Class: DownloadQueue
+class DownloadQueue:
+    # Downloader running the queued downloads
+    _downloader: Downloader
+    # Path of the SQLite database holding the queue
+    _file_path: str
+    # Number of worker threads
+    _workers: int
+    # Condition used to wake up idle workers when a download is queued
+    _condition: Condition
+    # Downloads running in this process, keyed by identifier
+    _running: Dict[int, QueuedDownload]
+    # Lock guarding the running downloads
+    _lock: Lock
+    # Worker and monitor threads, started on demand
+    _threads: List[Thread]
+
+    # Constructor
+    def __init__(self, downloader: Downloader):
+        self._downloader = downloader
+        self._file_path = downloader.get_storage().get_download_queue_file_path()
+        self._workers = downloader.get_storage().get_configuration().downloader().get_queue_workers()
+        self._condition = Condition()
+        self._running = {}
+        self._lock = Lock()
+        self._threads = []
+        self._create_schema()
+
+    # Returns the downloader running the queued downloads
+    def get_downloader(self) -> Downloader:
+        return self._downloader
+
+    # Returns the path of the SQLite database holding the queue
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the number of worker threads
+    def get_workers(self) -> int:
+        return self._workers
+
+    # Returns the configured entity of the given kind and name, or None if it is not configured
+    def find_entity(self, kind: str, name: str) -> Optional[DownloadableEntity]:
+        stable_diffusion = self.get_downloader().get_storage().get_configuration().stable_diffusion()
+        collections = {
+            "checkpoints": stable_diffusion.get_checkpoints(),
+            "loras": stable_diffusion.get_loras(),
+            "upscalers": stable_diffusion.get_upscalers(),
+        }
+        if kind not in collections:
+            return None
+        for entity in collections[kind].get_entities():
+            if entity.get_name() == name:
+                return entity
+        return None
+
+    # Creates an entity of the given kind from a dictionary
+    # Ad-hoc URLs are refused unless enabled in the configuration, and then only from the allowed hosts
+    def create_entity(self, kind: str, entity: Dict[str, Any]) -> DownloadableEntity:
+        configuration = self.get_downloader().get_storage().get_configuration().downloader()
+        if not configuration.is_custom_urls_enabled():
+            raise PermissionError("Only models from the configuration can be downloaded")
+
+        urls = [entity.get("url", "")] + list(entity.get("mirrors", []))
+        for url in urls:
+            if not isinstance(url, str):
+                raise ValueError("Model URLs must be strings")
+            parsed_url = urlparse(url)
+            if parsed_url.scheme not in ["http", "https"]:
+                raise ValueError(f"Unsupported URL: {url}")
+            if (parsed_url.hostname or "").lower() not in configuration.get_allowed_hosts():
+                raise PermissionError(f"Host not allowed: {parsed_url.hostname or ''}")
+
+        entity_classes = {
+            "checkpoints": CheckpointConfiguration,
+            "loras": LoraConfiguration,
+            "upscalers": UpscalerConfiguration,
+        }
+        if kind not in entity_classes:
+            raise ValueError(f"Unknown model kind: {kind}")
+        return entity_classes[kind](
+            name=entity.get("name", ""),
+            url=entity.get("url", ""),
+            sha256=entity.get("sha256", ""),
+            mirrors=entity.get("mirrors", []),
+        )
+
+    # Queues an entity of the given kind and returns the queued download, or the pending download of the same file
+    def enqueue(self, kind: str, entity: DownloadableEntity, priority: int = 0) -> QueuedDownload:
+        if not entity.is_valid():
+            raise ValueError("A model needs a name and a URL")
+        if entity.get_name() != path.basename(entity.get_name()) or entity.get_name().startswith("."):
+            raise ValueError(f"Invalid model name: {entity.get_name()}")
+
+        job = self._create_job(kind, entity)
+        now = time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id FROM downloads WHERE file_path = ? AND status IN (?, ?)",
+                (job.get_file_path(), QUEUED, RUNNING),
+            ).fetchone()
+            if row is not None:
+                return self.get_download(row["id"])
+            cursor = connection.execute(
+                "INSERT INTO downloads (kind, name, url, sha256, mirrors, file_path, priority, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, entity.get_name(), job.get_url(), job.get_sha256(), dumps(job.get_mirrors()), job.get_file_path(), priority, QUEUED, now, now),
+            )
+            download_id = cursor.lastrowid
+
+        with self._condition:
+            self._condition.notify()
+        return self.get_download(download_id)
+
+    # Returns the download with the given identifier, or None if it does not exist
+    def get_download(self, download_id: int) -> Optional[QueuedDownload]:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM downloads WHERE id = ?", (download_id,)).fetchone()
+        return QueuedDownload.from_row(row) if row is not None else None
+
+    # Returns every download, running ones first, then queued ones in the order they will start
+    def get_downloads(self) -> List[QueuedDownload]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT * FROM downloads ORDER BY"
+                " CASE status WHEN 'running' THEN 0 WHEN 'queued' THEN 1 ELSE 2 END,"
+                " CASE WHEN status IN ('running', 'queued') THEN -priority ELSE 0 END, id DESC"
+            ).fetchall()
+        return [QueuedDownload.from_row(row) for row in rows]
+
+    # Cancels a queued download immediately, or asks a running one to stop, returns FALSE if it already ended
+    def cancel(self, download_id: int) -> bool:
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                "UPDATE downloads SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time(), download_id, QUEUED),
+            )
+            if cursor.rowcount == 0:
+                cursor = connection.execute(
+                    "UPDATE downloads SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = ?",
+                    (time(), download_id, RUNNING),
+                )
+            return cursor.rowcount > 0
+
+    # Changes the priority of a download, returns FALSE if it does not exist
+    def set_priority(self, download_id: int, priority: int) -> bool:
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                "UPDATE downloads SET priority = ?, updated_at = ? WHERE id = ?",
+                (priority, time(), download_id),
+            )
+            return cursor.rowcount > 0
+
+    # Requeues downloads interrupted by a restart and starts the worker and monitor threads
+    def start(self) -> None:
+        if self._threads:
+            return
+
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE downloads SET status = CASE cancel_requested WHEN 1 THEN ? ELSE ? END, speed = 0, eta = 0, updated_at = ? WHERE status = ?",
+                (CANCELLED, QUEUED, time(), RUNNING),
+            )
+
+        self._threads = [Thread(target=self._work, daemon=True) for _ in range(self._workers)]
+        self._threads.append(Thread(target=self._monitor, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    # Worker thread, runs queued downloads one at a time
+    def _work(self) -> None:
+        while True:
+            download = self._claim()
+            if download is None:
+                with self._condition:
+                    self._condition.wait(timeout=1)
+                continue
+
+            with self._lock:
+                self._running[download.get_id()] = download
+            try:
+                self.get_downloader().download_file(download.get_url(), download.get_file_path(), download.get_sha256(), download.get_mirrors())
+                self._finish(download, COMPLETED)
+            except TransferCancelledError:
+                self._finish(download, CANCELLED)
+            except Exception as exception:
+                self._finish(download, FAILED, str(exception))
+            finally:
+                with self._lock:
+                    self._running.pop(download.get_id(), None)
+
+    # Monitor thread, publishes live progress and forwards cancellations to running transfers
+    def _monitor(self) -> None:
+        interval = self.get_downloader().get_reporter().get_interval()
+        while True:
+            sleep(interval)
+            with self._lock:
+                running = dict(self._running)
+            if not running:
+                continue
+
+            transfers = {transfer.get_file_path(): transfer for transfer in self.get_downloader().get_reporter().get_transfers()}
+            with closing(self._connect()) as connection, connection:
+                for download_id, download in running.items():
+                    transfer = transfers.get(download.get_file_path())
+                    if transfer is not None:
+                        connection.execute(
+                            "UPDATE downloads SET downloaded = ?, total = ?, speed = ?, eta = ?, updated_at = ? WHERE id = ?",
+                            (transfer.get_downloaded(), transfer.get_total(), transfer.get_speed(), transfer.get_eta(), time(), download_id),
+                        )
+                    row = connection.execute("SELECT cancel_requested FROM downloads WHERE id = ?", (download_id,)).fetchone()
+                    if transfer is not None and row is not None and row["cancel_requested"]:
+                        transfer.cancel()
+
+    # Marks the next queued download as running and returns it, or None if the queue is empty
+    def _claim(self) -> Optional[QueuedDownload]:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT * FROM downloads WHERE status = ? ORDER BY priority DESC, id LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE downloads SET status = ?, error = '', downloaded = 0, total = 0, updated_at = ? WHERE id = ?",
+                (RUNNING, time(), row["id"]),
+            )
+        return self.get_download(row["id"])
+
+    # Records the final state of a download
+    def _finish(self, download: QueuedDownload, status: str, error: str = "") -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE downloads SET status = CASE WHEN cancel_requested = 1 AND ? = ? THEN ? ELSE ? END,"
+                " error = ?, speed = 0, eta = 0, updated_at = ? WHERE id = ?",
+                (status, FAILED, CANCELLED, status, error, time(), download.get_id()),
+            )
+            if status == COMPLETED and path.isfile(download.get_file_path()):
+                size = path.getsize(download.get_file_path())
+                connection.execute("UPDATE downloads SET downloaded = ?, total = ? WHERE id = ?", (size, size, download.get_id()))
+
+    # Returns the download job of an entity of the given kind
+    def _create_job(self, kind: str, entity: DownloadableEntity) -> DownloadJob:
+        if kind == "checkpoints":
+            return self.get_downloader().create_checkpoint_job(entity)
+        if kind == "loras":
+            return self.get_downloader().create_lora_job(entity)
+        if kind == "upscalers":
+            return self.get_downloader().create_upscaler_job(entity)
+        raise ValueError(f"Unknown model kind: {kind}")
+
+    # Opens a connection to the queue database
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._file_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    # Creates the queue table if it does not exist
+    def _create_schema(self) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " kind TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " url TEXT NOT NULL,"
+                " sha256 TEXT NOT NULL DEFAULT '',"
+                " mirrors TEXT NOT NULL DEFAULT '[]',"
+                " file_path TEXT NOT NULL,"
+                " priority INTEGER NOT NULL DEFAULT 0,"
+                " status TEXT NOT NULL,"
+                " error TEXT NOT NULL DEFAULT '',"
+                " downloaded INTEGER NOT NULL DEFAULT 0,"
+                " total INTEGER NOT NULL DEFAULT 0,"
+                " speed REAL NOT NULL DEFAULT 0,"
+                " eta REAL NOT NULL DEFAULT 0,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status, priority)")
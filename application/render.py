@@ -0,0 +1,142 @@
+import gzip
+from hashlib import sha1
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, List, Hashable
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content encodings the rendered pages are served in, preferred first
+RENDER_ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+# Returns a body compressed with the given content encoding
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=5)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+# Class: RenderedPage
+class RenderedPage:
+    # Entity tag of the page, derived from its content so every worker process agrees on it
+    _etag: str
+    # Bodies of the page keyed by content encoding, "identity" for the uncompressed one, compressed ones are added on first use
+    _bodies: Dict[str, bytes]
+    # Lock guarding the bodies, so concurrent requests compress a page only once
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, etag: str, body: bytes):
+        self._etag = etag
+        self._bodies = {"identity": body}
+        self._lock = Lock()
+
+    # Returns the entity tag of the page in the given encoding
+    def get_etag(self, encoding: str = "identity") -> str:
+        return self._etag if encoding == "identity" else f"{self._etag}-{encoding}"
+
+    # Returns the body of the page in the given encoding, compressing it on first use
+    def get_body(self, encoding: str = "identity") -> bytes:
+        self.encode(encoding)
+        with self._lock:
+            return self._bodies[encoding]
+
+    # Returns the encodings the page can be served in
+    def get_encodings(self) -> List[str]:
+        return ["identity"] + RENDER_ENCODINGS
+
+    # Returns the number of bytes held by the page
+    def get_size(self) -> int:
+        with self._lock:
+            return sum(len(body) for body in self._bodies.values())
+
+    # Compresses the page in the given encoding unless it already was, returns the number of bytes added
+    def encode(self, encoding: str) -> int:
+        with self._lock:
+            if encoding in self._bodies:
+                return 0
+            body = self._bodies[encoding] = _compress(self._bodies["identity"], encoding)
+            return len(body)
+
+    # Creates a page from rendered HTML, its compressed bodies are only built when requested
+    @staticmethod
+    def from_html(html: str) -> "RenderedPage":
+        body = html.encode("utf-8")
+        return RenderedPage(sha1(body).hexdigest()[:20], body)
+
+
+# Class: RenderCache
+class RenderCache:
+    # Maximum number of bytes held by the cached pages, 0 disables the cache
+    _max_size: int
+    # Cached pages keyed by template and version, least recently used first
+    _pages: "OrderedDict[Hashable, RenderedPage]"
+    # Number of bytes held by the cached pages
+    _total_size: int
+    # Lock guarding the pages
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._pages = OrderedDict()
+        self._total_size = 0
+        self._lock = Lock()
+
+    # Returns the maximum number of bytes held by the cached pages
+    def get_max_size(self) -> int:
+        return self._max_size
+
+    # Returns the number of bytes held by the cached pages
+    def get_total_size(self) -> int:
+        with self._lock:
+            return self._total_size
+
+    # Returns the page cached under the key, rendering and caching it if needed
+    def get_page(self, key: Hashable, render: Callable[[], str]) -> RenderedPage:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+
+        page = RenderedPage.from_html(render())
+        if page.get_size() > self._max_size:
+            return page
+
+        with self._lock:
+            previous = self._pages.pop(key, None)
+            if previous is not None:
+                self._total_size -= previous.get_size()
+            self._pages[key] = page
+            self._total_size += page.get_size()
+            self._evict()
+        return page
+
+    # Returns the body of a page in the given encoding, counting a newly compressed body against the cache size
+    def get_body(self, key: Hashable, page: RenderedPage, encoding: str) -> bytes:
+        added = page.encode(encoding)
+        if added > 0:
+            with self._lock:
+                if self._pages.get(key) is page:
+                    self._total_size += added
+                    self._evict()
+        return page.get_body(encoding)
+
+    # Forgets every cached page
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+            self._total_size = 0
+
+    # Removes the least recently used pages until the cache fits its size limit
+    def _evict(self) -> None:
+        while self._total_size > self._max_size and self._pages:
+            _, page = self._pages.popitem(last=False)
+            self._total_size -= page.get_size()
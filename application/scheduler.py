@@ -0,0 +1,148 @@
+from threading import Thread, Condition
+from urllib.parse import urlparse
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Class: DownloadJob
+class DownloadJob:
+    # URL to download from
+    _url: str
+    # Local file path to download to
+    _file_path: str
+    # Expected size of the file in bytes (0 if unknown)
+    _size: int
+    # Expected SHA-256 or short AUTOV2 hash of the file (empty if not enforced)
+    _sha256: str
+    # Mirror URLs serving the same file
+    _mirrors: List[str]
+
+    # Constructor
+    def __init__(self, url: str, file_path: str, size: int = 0, sha256: str = "", mirrors: List[str] = None):
+        self._url = url
+        self._file_path = file_path
+        self._size = size
+        self._sha256 = sha256
+        self._mirrors = mirrors or []
+
+    # Returns the URL of the job
+    def get_url(self) -> str:
+        return self._url
+
+    # Returns the local file path of the job
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the expected size of the file
+    def get_size(self) -> int:
+        return self._size
+
+    # Returns the expected hash of the file
+    def get_sha256(self) -> str:
+        return self._sha256
+
+    # Returns the mirror URLs serving the same file
+    def get_mirrors(self) -> List[str]:
+        return self._mirrors
+
+    # Returns the host the job downloads from
+    def get_host(self) -> str:
+        return urlparse(self._url).netloc.lower()
+
+    # Returns the sort key used to order jobs, smallest known files first
+    def get_sort_key(self) -> tuple:
+        return (self._size <= 0, self._size)
+
+
+# Class: DownloadScheduler
+class DownloadScheduler:
+    # Maximum number of jobs running at once
+    _max_concurrency: int
+    # Maximum number of connections open at once against a single host
+    _per_host_connections: int
+    # Maximum number of connections a single job opens, one per segment
+    _segments: int
+    # Jobs waiting to be started
+    _pending: List[DownloadJob]
+    # Number of connections held by the running jobs per host
+    _active_hosts: Dict[str, int]
+    # Condition guarding the pending list and host counters
+    _condition: Condition
+
+    # Constructor
+    def __init__(self, max_concurrency: int, per_host_connections: int, segments: int = 1):
+        self._max_concurrency = max(1, max_concurrency)
+        self._per_host_connections = max(1, per_host_connections)
+        self._segments = max(1, segments)
+        self._pending = []
+        self._active_hosts = {}
+        self._condition = Condition()
+
+    # Returns the maximum number of jobs running at once
+    def get_max_concurrency(self) -> int:
+        return self._max_concurrency
+
+    # Returns the maximum number of connections open at once against a single host
+    def get_per_host_connections(self) -> int:
+        return self._per_host_connections
+
+    # Returns the maximum number of connections a single job opens
+    def get_segments(self) -> int:
+        return self._segments
+
+    # Runs all jobs through the handler, which receives the number of connections the job may open, and blocks until every job is finished,
+    # the failures of the handler are passed to the error callback
+    def run(
+        self,
+        jobs: List[DownloadJob],
+        handler: Callable[[DownloadJob, int], None],
+        on_error: Callable[[DownloadJob, Exception], None],
+    ) -> None:
+        with self._condition:
+            self._pending = sorted(jobs, key=lambda job: job.get_sort_key())
+            self._active_hosts = {}
+
+        workers = [
+            Thread(target=self._worker, args=(handler, on_error), daemon=True)
+            for _ in range(min(self._max_concurrency, len(jobs)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    # Worker loop, picks the next job whose host still has free connections
+    def _worker(self, handler: Callable[[DownloadJob, int], None], on_error: Callable[[DownloadJob, Exception], None]) -> None:
+        while True:
+            job, connections = self._acquire()
+            if job is None:
+                return
+            try:
+                handler(job, connections)
+            except Exception as exception:
+                on_error(job, exception)
+            finally:
+                self._release(job, connections)
+
+    # Takes the next runnable job off the pending list with as many of the free connections of its host as it has segments,
+    # one for a job with an expected hash as it is downloaded as a single range, waiting for a connection if needed
+    def _acquire(self) -> Tuple[Optional[DownloadJob], int]:
+        with self._condition:
+            while self._pending:
+                for index, job in enumerate(self._pending):
+                    host = job.get_host()
+                    free_connections = self._per_host_connections - self._active_hosts.get(host, 0)
+                    if free_connections > 0:
+                        connections = min(self._segments if job.get_sha256() == "" else 1, free_connections)
+                        self._active_hosts[host] = self._active_hosts.get(host, 0) + connections
+                        return self._pending.pop(index), connections
+                self._condition.wait()
+            return None, 0
+
+    # Frees the host connections held by a finished job
+    def _release(self, job: DownloadJob, connections: int) -> None:
+        with self._condition:
+            host = job.get_host()
+            self._active_hosts[host] -= connections
+            if self._active_hosts[host] <= 0:
+                del self._active_hosts[host]
+            self._condition.notify_all()
@@ -1,7 +1,23 @@
-from os import path, remove
-from application import Configuration, Storage
-from flask import Flask, render_template, jsonify, request, redirect, url_for, Response
-from PIL import Image
+from os import path, stat
+from threading import Thread
+from datetime import datetime, timedelta
+from hashlib import sha1
+from json import dumps
+from time import monotonic, perf_counter, sleep
+from typing import Dict, List, Set, Any, Optional, Tuple, Callable, Hashable
+from application import Configuration, Storage, IndexedFile, format_etag, encode_cursor, decode_cursor, HashCache, Downloader, DownloadQueue, ThumbnailCache, MetadataIndex, FolderStatistics, bytes_to_readable, DirectoryWatcher, EventStream, FolderEvent, IMAGE_ADDED, Prewarmer, Trash, TrashBatch, RenderCache, RENDER_ENCODINGS, LeaderLock, serve_threaded, serve_prefork, METRICS, HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_PROGRESS, TEMPLATE_RENDER_DURATION
+from flask import Flask, render_template, jsonify, request, redirect, url_for, send_file, send_from_directory, stream_with_context, Response, g
+from werkzeug.utils import safe_join
+
+
+# Number of seconds between two comments keeping an idle event stream open
+EVENT_KEEPALIVE_INTERVAL = 15.0
+# Number of seconds an event stream stays open before the client reconnects, freeing its request thread
+EVENT_STREAM_DURATION = 300.0
+# Number of milliseconds clients wait before reconnecting to the event stream
+EVENT_RETRY_DELAY = 3000
+# Number of seconds between two checks for model files missing from the hash cache
+MODEL_HASH_INTERVAL = 60.0
 
 
 # Class: Server
@@ -14,17 +30,54 @@ class Server:
     _storage: Storage
     # Debug mode
     _debug: bool
+    # Downloader shared by the model endpoints and the download queue
+    _downloader: Downloader
+    # Queue of downloads run in the background
+    _download_queue: DownloadQueue
+    # Cache of image thumbnails
+    _thumbnail_cache: ThumbnailCache
+    # Index of image metadata
+    _metadata_index: MetadataIndex
+    # Persisted summaries of the image folders
+    _folder_statistics: FolderStatistics
+    # Watcher of the images directory, one per serving process
+    _watcher: DirectoryWatcher
+    # Stream of folder events pushed to the connected clients
+    _event_stream: EventStream
+    # Background worker preparing thumbnails and metadata of new images
+    _prewarmer: Prewarmer
+    # Cache of the rendered gallery pages
+    _render_cache: RenderCache
+    # Trash holding deleted images until their undo window is over
+    _trash: Trash
+    # Lock electing the single process running the background tasks
+    _leader_lock: LeaderLock
 
     # Constructor
     def __init__(self, configuration: Configuration, storage: Storage, debug: bool = False):
         self._app = Flask(
             __name__,
             template_folder=storage.get_templates_path(),
-            static_folder=storage.get_images_path(),
+            static_folder=None,
         )
+        self._app.config["USE_X_SENDFILE"] = configuration.gallery().is_x_sendfile_enabled()
+        METRICS.set_enabled(configuration.gallery().is_metrics_enabled())
         self._configuration = configuration
         self._storage = storage
         self._debug = debug
+        self._downloader = Downloader(storage)
+        self._download_queue = DownloadQueue(self._downloader)
+        self._thumbnail_cache = ThumbnailCache(storage)
+        self._metadata_index = MetadataIndex(storage)
+        self._folder_statistics = FolderStatistics(storage)
+        self._watcher = DirectoryWatcher(storage.get_images_path(), configuration.gallery().get_watch_interval())
+        self._event_stream = EventStream(storage)
+        self._prewarmer = Prewarmer(storage, self._thumbnail_cache, self._metadata_index, configuration.gallery().get_prewarm_rate())
+        self._render_cache = RenderCache(configuration.gallery().get_render_cache_size())
+        self._trash = Trash(storage, configuration.gallery().get_undo_window())
+        self._leader_lock = LeaderLock(storage.get_leader_lock_file_path())
+        self._watcher.add_listener(storage.get_folder_index().on_change)
+        self._watcher.add_listener(self._event_stream.on_change)
         self._register_routes()
 
     # Returns the Flask application instance
@@ -43,17 +96,134 @@ class Server:
     def get_debug(self) -> bool:
         return self._debug
 
-    # Starts the server
+    # Returns the downloader
+    def get_downloader(self) -> Downloader:
+        return self._downloader
+
+    # Returns the cache of model file hashes
+    def get_hash_cache(self) -> HashCache:
+        return self._downloader.get_hash_cache()
+
+    # Returns the queue of downloads run in the background
+    def get_download_queue(self) -> DownloadQueue:
+        return self._download_queue
+
+    # Returns the cache of image thumbnails
+    def get_thumbnail_cache(self) -> ThumbnailCache:
+        return self._thumbnail_cache
+
+    # Returns the index of image metadata
+    def get_metadata_index(self) -> MetadataIndex:
+        return self._metadata_index
+
+    # Returns the persisted summaries of the image folders
+    def get_folder_statistics(self) -> FolderStatistics:
+        return self._folder_statistics
+
+    # Returns the watcher of the images directory
+    def get_watcher(self) -> DirectoryWatcher:
+        return self._watcher
+
+    # Returns the stream of folder events pushed to the connected clients
+    def get_event_stream(self) -> EventStream:
+        return self._event_stream
+
+    # Returns the background worker preparing new images
+    def get_prewarmer(self) -> Prewarmer:
+        return self._prewarmer
+
+    # Returns the cache of the rendered gallery pages
+    def get_render_cache(self) -> RenderCache:
+        return self._render_cache
+
+    # Returns the trash holding deleted images
+    def get_trash(self) -> Trash:
+        return self._trash
+
+    # Returns the lock electing the single process running the background tasks
+    def get_leader_lock(self) -> LeaderLock:
+        return self._leader_lock
+
+    # Starts the server in the configured mode, the background tasks run in whichever process is elected leader
     def start(self) -> None:
-        self._app.run(
-            host=self.get_configuration().gallery().get_listen_address(),
-            port=self.get_configuration().gallery().get_listen_port(),
-            debug=self.get_debug(),
-        )
+        gallery = self.get_configuration().gallery()
+        try:
+            if gallery.get_server_mode() == "prefork":
+                serve_prefork(self._app, gallery, self._start_process_tasks)
+            else:
+                self._start_process_tasks()
+                if gallery.get_server_mode() == "threaded":
+                    serve_threaded(self._app, gallery)
+                else:
+                    self._app.run(
+                        host=gallery.get_listen_address(),
+                        port=gallery.get_listen_port(),
+                        debug=self.get_debug(),
+                        threaded=True,
+                    )
+        finally:
+            self.get_thumbnail_cache().close()
+
+    # Starts the images watcher feeding the folder listings and the event stream of this process, and the leader election
+    def _start_process_tasks(self) -> None:
+        if self.get_configuration().gallery().is_watch_enabled():
+            self.get_watcher().start()
+        self.get_leader_lock().start(self._start_background_tasks)
+
+    # Starts the download queue, the metadata index synchronization, the model hashing, the trash purge, the prewarmer and the leader-only watcher listeners
+    def _start_background_tasks(self) -> None:
+        self.get_download_queue().start()
+        self.get_trash().start()
+        Thread(target=self._synchronize_metadata_index, daemon=True).start()
+        Thread(target=self._hash_model_files, daemon=True).start()
+        if self.get_configuration().gallery().is_watch_enabled():
+            self.get_watcher().add_listener(self.get_metadata_index().on_change)
+            self.get_watcher().add_listener(self.get_folder_statistics().on_change)
+            self.get_watcher().add_listener(self.get_prewarmer().on_change)
+            self.get_prewarmer().start()
+
+    # Hashes the model files missing from the hash cache at a fixed interval, the model endpoints only share cached hashes with peers
+    def _hash_model_files(self) -> None:
+        while True:
+            for directory in self.get_storage().get_model_directories().values():
+                try:
+                    for name in self.get_storage().get_model_files(directory):
+                        self.get_hash_cache().get_file_hash(path.join(directory, name))
+                except OSError as exception:
+                    print(f"Unable to hash the model files of `{directory}`: {exception}")
+            sleep(MODEL_HASH_INTERVAL)
+
+    # Brings the metadata index up to date with the images directory
+    def _synchronize_metadata_index(self) -> None:
+        try:
+            self.get_metadata_index().synchronize()
+        except Exception as exception:
+            print(f"Unable to synchronize the metadata index: {exception}")
 
     # Register application routes
     def _register_routes(self) -> None:
         self._app.add_url_rule("/", view_func=self._index_route)
+        self._app.add_url_rule(
+            f"/{path.basename(path.normpath(self.get_storage().get_images_path()))}/<path:filename>",
+            endpoint="static",
+            view_func=self._image_file_route,
+            methods=["GET"],
+        )
+        self._app.add_url_rule("/api/models/<kind>", view_func=self._models_route, methods=["GET"])
+        self._app.add_url_rule("/api/models/<kind>/<name>", view_func=self._model_route, methods=["GET", "HEAD"])
+        self._app.add_url_rule("/api/downloads", view_func=self._downloads_route, methods=["GET"])
+        self._app.add_url_rule("/api/downloads", view_func=self._enqueue_download_route, methods=["POST"])
+        self._app.add_url_rule("/api/downloads/<int:download_id>/cancel", view_func=self._cancel_download_route, methods=["POST"])
+        self._app.add_url_rule("/api/downloads/<int:download_id>/priority", view_func=self._download_priority_route, methods=["POST"])
+        self._app.add_url_rule("/api/folders", view_func=self._folders_route, methods=["GET"])
+        self._app.add_url_rule("/api/folders/<folder>/images", view_func=self._folder_images_route, methods=["GET"])
+        self._app.add_url_rule("/api/folders/<folder>/images/<image>/window", view_func=self._image_window_route, methods=["GET"])
+        self._app.add_url_rule("/api/images/delete", view_func=self._delete_images_route, methods=["POST"])
+        self._app.add_url_rule("/api/images/restore", view_func=self._restore_images_route, methods=["POST"])
+        self._app.add_url_rule("/api/events", view_func=self._events_route, methods=["GET"])
+        self._app.add_url_rule("/api/search", view_func=self._search_route, methods=["GET"])
+        self._app.add_url_rule("/api/search/facets", view_func=self._search_facets_route, methods=["GET"])
+        self._app.add_url_rule("/thumbnails/<folder>/<image>", view_func=self._thumbnail_route, methods=["GET"])
         self._app.add_url_rule("/<folder>", view_func=self._images_route)
         self._app.add_url_rule(
             "/<folder>/<image>", view_func=self._image_route, methods=["GET"]
@@ -61,24 +231,388 @@ class Server:
         self._app.add_url_rule(
             "/delete", view_func=self._delete_image_route, methods=["POST"]
         )
+        self._app.register_error_handler(FileNotFoundError, self._file_not_found_handler)
+        if self.get_configuration().gallery().is_metrics_enabled():
+            self._app.add_url_rule("/metrics", view_func=self._metrics_route, methods=["GET"])
+            self._app.before_request(self._start_request_metrics)
+            self._app.after_request(self._record_request_metrics)
+            self._app.teardown_request(self._finish_request_metrics)
+
+    # Starts timing a request
+    def _start_request_metrics(self) -> None:
+        g.request_started_at = perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+
+    # Records the duration and status of a request, by route template so the label values stay bounded
+    def _record_request_metrics(self, response: Response) -> Response:
+        started_at = g.get("request_started_at")
+        if started_at is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_REQUEST_DURATION.observe(perf_counter() - started_at, request.method, route)
+            HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+        return response
+
+    # Stops counting a request as in progress, also when it failed before a response was made
+    def _finish_request_metrics(self, error: Optional[BaseException]) -> None:
+        if g.pop("request_started_at", None) is not None:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+
+    # Metrics Route: /metrics
+    def _metrics_route(self) -> Response:
+        return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    # Renders a page template, recording the time spent
+    def _render_template(self, template: str, **context: Any) -> str:
+        with TEMPLATE_RENDER_DURATION.time(template):
+            return render_template(template, **context)
+
+    # Error handler for files missing while answering a request, recreates the directories of the storage layout removed underneath
+    # the server and retries the request once, a request failing again finds nothing to recreate and gets a 404
+    def _file_not_found_handler(self, error: FileNotFoundError) -> Response:
+        created = self.get_storage().revalidate_layout()
+        if not created:
+            return Response(status=404)
+        print(f"Recreated missing storage directories: {', '.join(created)}")
+        return redirect(request.full_path if request.query_string else request.path, code=307)
 
     # Index Route: /
-    def _index_route(self) -> str:
-        folders = self.get_storage().get_folders(
-            self.get_storage().get_images_path(),
-        )
-        sorted_folders = sorted(folders, reverse=True)
-        return render_template("index.html", folders=sorted_folders)
+    def _index_route(self) -> Response:
+        summaries = self.get_folder_statistics().get_summaries()
+        version = sha1(repr([
+            (summary.get_name(), summary.get_mtime(), summary.get_image_count(), summary.get_total_size(), summary.get_cover_etag())
+            for summary in summaries
+        ]).encode()).hexdigest()
+
+        def render() -> str:
+            folders = []
+            for summary in summaries:
+                newest_mtime = summary.get_newest_mtime()
+                folders.append({
+                    "name": summary.get_name(),
+                    "image_count": summary.get_image_count(),
+                    "total_size": bytes_to_readable(summary.get_total_size()),
+                    "newest": datetime.fromtimestamp(newest_mtime / 1e9).strftime("%Y-%m-%d %H:%M") if newest_mtime is not None else "",
+                    "cover": url_for("_thumbnail_route", folder=summary.get_name(), image=summary.get_cover(), v=summary.get_cover_etag())
+                    if summary.get_cover() is not None else None,
+                })
+            return self._render_template("index.html", folders=folders)
+
+        return self._send_page(("index.html", version), render)
+
+    # Folders Route: /api/folders
+    def _folders_route(self) -> Tuple[Response, int]:
+        return jsonify({'folders': [summary.to_dict() for summary in self.get_folder_statistics().get_summaries()]}), 200
+
+    # Models Route: /api/models/<kind>, only cached hashes are returned, null until the leader hashed the file
+    def _models_route(self, kind: str) -> Tuple[Response, int]:
+        directory = self.get_storage().get_model_directories().get(kind)
+        if directory is None:
+            return jsonify({'status': 'error'}), 404
+
+        file_paths = [path.join(directory, name) for name in self.get_storage().get_model_files(directory)]
+        if any(self.get_hash_cache().get_cached_hash(file_path) is None for file_path in file_paths):
+            self.get_hash_cache().load()
+
+        models = []
+        for file_path in file_paths:
+            models.append({
+                "name": path.basename(file_path),
+                "size": path.getsize(file_path),
+                "sha256": self.get_hash_cache().get_cached_hash(file_path),
+            })
+        return jsonify({'status': 'success', 'models': models}), 200
+
+    # Model Route: /api/models/<kind>/<name>
+    def _model_route(self, kind: str, name: str) -> Response:
+        directory = self.get_storage().get_model_directories().get(kind)
+        if directory is None or name not in self.get_storage().get_model_files(directory):
+            return Response(status=404)
+
+        response = send_from_directory(directory, name, conditional=True, etag=True, max_age=0)
+        response.headers["Accept-Ranges"] = "bytes"
+        sha256 = self.get_hash_cache().get_cached_hash(path.join(directory, name))
+        if sha256 is not None:
+            response.headers["X-Sha256"] = sha256
+        return response
+
+    # Downloads Route: /api/downloads
+    def _downloads_route(self) -> Response:
+        downloads = self.get_download_queue().get_downloads()
+        return jsonify({'status': 'success', 'downloads': [download.to_dict() for download in downloads]})
+
+    # Enqueue Download Route: /api/downloads
+    # Only models named in the configuration are queued, a request with a URL is refused with 403 unless
+    # downloader.custom_urls is enabled and every URL of the request points to one of downloader.allowed_hosts
+    def _enqueue_download_route(self) -> Tuple[Response, int]:
+        data = request.get_json(silent=True) or {}
+        kind = data.get("kind", "")
+        queue = self.get_download_queue()
+
+        try:
+            if "url" in data:
+                entity = queue.create_entity(kind, data)
+            else:
+                entity = queue.find_entity(kind, data.get("name", ""))
+                if entity is None:
+                    return jsonify({'status': 'error', 'error': f"Unknown model: {data.get('name', '')}"}), 404
+            download = queue.enqueue(kind, entity, int(data.get("priority", 0)))
+        except PermissionError as exception:
+            return jsonify({'status': 'error', 'error': str(exception)}), 403
+        except (TypeError, ValueError) as exception:
+            return jsonify({'status': 'error', 'error': str(exception)}), 400
+
+        return jsonify({'status': 'success', 'download': download.to_dict()}), 201
+
+    # Cancel Download Route: /api/downloads/<download_id>/cancel
+    def _cancel_download_route(self, download_id: int) -> Tuple[Response, int]:
+        if not self.get_download_queue().cancel(download_id):
+            return jsonify({'status': 'error'}), 404
+        return jsonify({'status': 'success', 'download': self.get_download_queue().get_download(download_id).to_dict()}), 200
+
+    # Download Priority Route: /api/downloads/<download_id>/priority
+    def _download_priority_route(self, download_id: int) -> Tuple[Response, int]:
+        data = request.get_json(silent=True) or {}
+        try:
+            priority = int(data.get("priority", 0))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'error': 'Invalid priority'}), 400
+
+        if not self.get_download_queue().set_priority(download_id, priority):
+            return jsonify({'status': 'error'}), 404
+        return jsonify({'status': 'success', 'download': self.get_download_queue().get_download(download_id).to_dict()}), 200
 
     # Images Route: /<folder>
-    def _images_route(self, folder: str) -> str:
+    def _images_route(self, folder: str) -> Response:
         images_directory = self.get_storage().get_images_path()
         folder_directory = path.join(images_directory, folder)
-        images = self.get_storage().get_files(folder_directory)
-        return render_template("folder.html", folder=folder, images=images)
+        listing = self.get_storage().get_folder_listing(folder_directory)
+        page_size = self.get_configuration().gallery().get_page_size()
+
+        def render() -> str:
+            files = listing.get_files_after(None, page_size)
+            images = [file.get_name() for file in files]
+            versions = {file.get_name(): file.get_etag() for file in files}
+            next_cursor = encode_cursor(files[-1].get_mtime(), files[-1].get_name()) if len(files) < len(listing) else ""
+            return self._render_template("folder.html", folder=folder, images=images, versions=versions, next_cursor=next_cursor)
+
+        return self._send_page(("folder.html", folder, listing.get_version(), page_size), render)
+
+    # Folder Images Route: /api/folders/<folder>/images
+    def _folder_images_route(self, folder: str) -> Tuple[Response, int]:
+        folder_directory = safe_join(self.get_storage().get_images_path(), folder)
+        if folder_directory is None or not path.isdir(folder_directory):
+            return jsonify({'status': 'error'}), 404
+
+        gallery = self.get_configuration().gallery()
+        try:
+            limit = int(request.args.get("limit", gallery.get_page_size()))
+            cursor = decode_cursor(request.args.get("cursor", ""))
+        except ValueError as exception:
+            return jsonify({'status': 'error', 'error': str(exception)}), 400
+        limit = min(max(1, limit), gallery.get_max_page_size())
+        fields = set(field for field in request.args.get("fields", "").split(",") if field != "")
+
+        listing = self.get_storage().get_folder_listing(folder_directory)
+        files = listing.get_files_after(cursor, limit)
+        last_position = listing.get_position(files[-1].get_name()) if files else len(listing)
+        return jsonify({
+            'status': 'success',
+            'images': [self._describe_image(folder, folder_directory, file, fields) for file in files],
+            'next_cursor': encode_cursor(files[-1].get_mtime(), files[-1].get_name()) if last_position < len(listing) - 1 else None,
+            'total': len(listing),
+        }), 200
+
+    # Events Route: /api/events, streams the image and folder events of the images directory, or of one folder
+    def _events_route(self) -> Response:
+        folder = request.args.get("folder", "")
+        stream = self.get_event_stream()
+        position, complete = stream.resume(request.headers.get("Last-Event-ID", ""))
+
+        def generate():
+            nonlocal position
+            yield f"retry: {EVENT_RETRY_DELAY}\n\n"
+            if not complete:
+                yield "event: reset\ndata: {}\n\n"
+
+            deadline = monotonic() + EVENT_STREAM_DURATION
+            while monotonic() < deadline:
+                events = stream.wait(position, EVENT_KEEPALIVE_INTERVAL)
+                if events is None:
+                    position = stream.get_last_id()
+                    yield "event: reset\ndata: {}\n\n"
+                    continue
+
+                sent = False
+                for event in events:
+                    position = event.get_id()
+                    if folder != "" and event.get_folder() != folder:
+                        continue
+                    yield f"id: {stream.get_epoch()}-{event.get_id()}\nevent: {event.get_type()}\ndata: {dumps(self._describe_event(event))}\n\n"
+                    sent = True
+                if not sent:
+                    yield ": keepalive\n\n"
+
+        response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    # Returns the payload of a folder event, added images are described like listing entries
+    def _describe_event(self, event: FolderEvent) -> Dict[str, Any]:
+        if event.get_type() == IMAGE_ADDED:
+            folder_directory = path.join(self.get_storage().get_images_path(), event.get_folder())
+            try:
+                file = self.get_storage().get_folder_listing(folder_directory).get_file(event.get_image())
+            except OSError:
+                file = None
+            if file is not None:
+                return {"folder": event.get_folder(), **self._describe_image(event.get_folder(), folder_directory, file, set())}
+        return {"folder": event.get_folder(), "name": event.get_image()}
+
+    # Search Route: /api/search
+    def _search_route(self) -> Tuple[Response, int]:
+        gallery = self.get_configuration().gallery()
+        try:
+            filters = self._get_search_filters()
+            limit = int(request.args.get("limit", gallery.get_page_size()))
+            cursor = decode_cursor(request.args.get("cursor", ""))
+        except ValueError as exception:
+            return jsonify({'status': 'error', 'error': str(exception)}), 400
+        limit = min(max(1, limit), gallery.get_max_page_size())
+
+        rows = self.get_metadata_index().search(request.args.get("q", ""), filters, cursor, limit + 1)
+        images = [self._describe_search_result(row) for row in rows[:limit]]
+        return jsonify({
+            'images': images,
+            'next_cursor': encode_cursor(rows[limit - 1]["mtime_ns"], f"{images[-1]['folder']}/{images[-1]['name']}") if len(rows) > limit else None,
+        }), 200
+
+    # Search Facets Route: /api/search/facets
+    def _search_facets_route(self) -> Tuple[Response, int]:
+        try:
+            filters = self._get_search_filters()
+        except ValueError as exception:
+            return jsonify({'status': 'error', 'error': str(exception)}), 400
+        return jsonify({'facets': self.get_metadata_index().get_facets(request.args.get("q", ""), filters)}), 200
+
+    # Returns the search filters of the request, dates are YYYY-MM-DD and both ends are inclusive
+    def _get_search_filters(self) -> Dict[str, Any]:
+        filters: Dict[str, Any] = {}
+        for name in ["model_hash", "model", "sampler", "size"]:
+            if request.args.get(name, "") != "":
+                filters[name] = request.args[name]
+        if request.args.get("seed", "") != "":
+            filters["seed"] = int(request.args["seed"])
+        if request.args.get("from", "") != "":
+            filters["date_from"] = int(datetime.strptime(request.args["from"], "%Y-%m-%d").timestamp() * 1e9)
+        if request.args.get("to", "") != "":
+            filters["date_to"] = int((datetime.strptime(request.args["to"], "%Y-%m-%d") + timedelta(days=1)).timestamp() * 1e9)
+        if request.args.get("negative", "") in ["1", "true"]:
+            filters["negative"] = True
+        return filters
+
+    # Returns the result entry of an indexed image
+    def _describe_search_result(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        folder = path.relpath(row["folder"], self.get_storage().get_images_path())
+        version = format_etag(row["inode"], row["size"], row["mtime_ns"])
+        return {
+            "folder": folder,
+            "name": row["name"],
+            "mtime": row["mtime_ns"] / 1e9,
+            "url": url_for("static", filename=f"{folder}/{row['name']}", v=version),
+            "thumbnail": url_for("_thumbnail_route", folder=folder, image=row["name"], v=version),
+            "view": url_for("_image_route", folder=folder, image=row["name"]),
+            "size": row["size"],
+            "width": row["width"],
+            "height": row["height"],
+            "prompt": row["prompt"],
+            "negative_prompt": row["negative_prompt"],
+            "steps": row["steps"],
+            "sampler": row["sampler"],
+            "cfg_scale": row["cfg_scale"],
+            "seed": row["seed"],
+            "image_size": row["image_size"],
+            "model_hash": row["model_hash"],
+            "model": row["model"],
+            "loras": row["loras"].split(",") if row["loras"] else [],
+        }
+
+    # Returns the listing entry of an image with the requested optional fields (size, dimensions, prompt, parameters)
+    def _describe_image(self, folder: str, folder_directory: str, file: IndexedFile, fields: Set[str]) -> Dict[str, Any]:
+        image = {
+            "name": file.get_name(),
+            "mtime": file.get_mtime() / 1e9,
+            "url": url_for("static", filename=f"{folder}/{file.get_name()}", v=file.get_etag()),
+            "thumbnail": url_for("_thumbnail_route", folder=folder, image=file.get_name(), v=file.get_etag()),
+            "view": url_for("_image_route", folder=folder, image=file.get_name()),
+        }
+        if "size" in fields:
+            image["size"] = file.get_size()
+        if fields & {"dimensions", "prompt", "parameters"}:
+            try:
+                metadata = self.get_metadata_index().get_metadata(path.join(folder_directory, file.get_name()))
+            except (OSError, SyntaxError, ValueError):
+                metadata = None
+            if "dimensions" in fields:
+                image["width"] = metadata.get_width() if metadata is not None else None
+                image["height"] = metadata.get_height() if metadata is not None else None
+            if "prompt" in fields:
+                image["prompt"] = metadata.get_prompt_snippet() if metadata is not None else ""
+            if "parameters" in fields:
+                image["parameters"] = metadata.get_parameters() if metadata is not None else None
+                generation_parameters = metadata.get_generation_parameters() if metadata is not None else None
+                image["generation"] = generation_parameters.to_dict() if generation_parameters is not None else None
+        return image
+
+    # Image File Route: /<images directory>/<folder>/<image>, cached forever when the URL carries the current version
+    def _image_file_route(self, filename: str) -> Response:
+        file_path = safe_join(self.get_storage().get_images_path(), filename)
+        if file_path is None:
+            return Response(status=404)
+        try:
+            file_stat = stat(file_path)
+        except OSError:
+            return Response(status=404)
+        etag = format_etag(file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+        else:
+            response = send_file(file_path, conditional=True, etag=etag, last_modified=file_stat.st_mtime)
+        self._set_version_cache_control(response, etag)
+        return response
+
+    # Lets browsers keep a response forever when the requested version is current, and revalidate it otherwise
+    def _set_version_cache_control(self, response: Response, etag: str) -> None:
+        if request.args.get("v") == etag:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 3600
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+
+    # Thumbnail Route: /thumbnails/<folder>/<image>
+    def _thumbnail_route(self, folder: str, image: str) -> Response:
+        file_path = safe_join(self.get_storage().get_images_path(), folder, image)
+        if file_path is None or not path.isfile(file_path):
+            return Response(status=404)
+        if path.splitext(file_path)[1] not in self.get_storage().get_supported_image_extensions():
+            return Response(status=404)
+
+        try:
+            thumbnail_path = self.get_thumbnail_cache().get_thumbnail(file_path)
+        except (OSError, SyntaxError, ValueError):
+            return Response(status=404)
+
+        response = send_file(thumbnail_path, mimetype=self.get_thumbnail_cache().get_mimetype(), conditional=True, etag=True)
+        file_stat = stat(file_path)
+        self._set_version_cache_control(response, format_etag(file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns))
+        return response
 
     # Image Route: /<folder>/<image>
-    def _image_route(self, folder: str, image: str) -> str:
+    def _image_route(self, folder: str, image: str) -> Response:
         file_path = path.join(
             self.get_storage().get_images_path(),
             folder,
@@ -87,58 +621,106 @@ class Server:
 
         if not path.exists(file_path):
             return redirect(url_for("_index_route"))
-        
-        image_handle = Image.open(file_path)
-        
-        metadata = image_handle.info
-
-        if 'parameters' in metadata:
-            parameters = metadata['parameters']
-        else:
-            parameters = None
-
-        image_handle.close()
 
+        folder_directory = path.join(self.get_storage().get_images_path(), folder)
+        listing = self.get_storage().get_folder_listing(folder_directory)
 
-        try:
-            folder_directory = path.join(self.get_storage().get_images_path(), folder)
-            images_list = self.get_storage().get_files(folder_directory)
-
-            current_index = images_list.index(image)
-            previous_image = images_list[current_index - 1] if current_index > 0 else None
-            next_image = images_list[current_index + 1] if current_index < len(images_list) - 1 else None
+        def render() -> str:
+            parameters = self.get_metadata_index().get_parameters(file_path)
+            previous_file, next_file = listing.get_neighbours(image)
+            versions = {file.get_name(): file.get_etag() for file in [listing.get_file(image), previous_file, next_file] if file is not None}
 
-            return render_template(
+            return self._render_template(
                 "image.html",
                 folder=folder,
                 image=image,
+                versions=versions,
                 parameters=parameters,
-                previous_image=previous_image,
-                next_image=next_image
+                previous_image=previous_file.get_name() if previous_file is not None else None,
+                next_image=next_file.get_name() if next_file is not None else None
             )
+
+        return self._send_page(("image.html", folder, image, listing.get_version()), render)
+
+    # Answers with a rendered page in the best encoding the client accepts, or with 304 if the client already has it
+    # Only the negotiated encoding is compressed, and only when the page is actually sent
+    def _send_page(self, key: Hashable, render: Callable[[], str]) -> Response:
+        page = self.get_render_cache().get_page(key, render)
+        encoding = next((encoding for encoding in RENDER_ENCODINGS if request.accept_encodings[encoding]), "identity")
+        if any(request.if_none_match.contains(page.get_etag(page_encoding)) for page_encoding in page.get_encodings()):
+            response = Response(status=304)
+        else:
+            response = Response(self.get_render_cache().get_body(key, page, encoding), mimetype="text/html")
+            if encoding != "identity":
+                response.content_encoding = encoding
+        response.set_etag(page.get_etag(encoding))
+        response.vary.add("Accept-Encoding")
+        response.cache_control.no_cache = True
+        return response
+
+    # Image Window Route: /api/folders/<folder>/images/<image>/window
+    def _image_window_route(self, folder: str, image: str) -> Tuple[Response, int]:
+        folder_directory = safe_join(self.get_storage().get_images_path(), folder)
+        if folder_directory is None or not path.isdir(folder_directory):
+            return jsonify({'status': 'error'}), 404
+
+        try:
+            radius = int(request.args.get("radius", 5))
         except ValueError:
-            return render_template(
-                "image.html",
-                folder=folder,
-                image=image,
-                parameters=parameters,
-                previous_image=None,
-                next_image=None
-            )
+            return jsonify({'status': 'error', 'error': 'Invalid radius'}), 400
+        radius = min(max(0, radius), self.get_configuration().gallery().get_max_page_size() // 2)
+
+        listing = self.get_storage().get_folder_listing(folder_directory)
+        position = listing.get_position(image)
+        if position is None:
+            return jsonify({'status': 'error'}), 404
+
+        fields = {"size", "dimensions", "prompt", "parameters"}
+        images = []
+        for file in listing.get_window(image, radius):
+            described_image = self._describe_image(folder, folder_directory, file, fields)
+            described_image["position"] = listing.get_position(file.get_name())
+            images.append(described_image)
+        return jsonify({'status': 'success', 'position': position, 'total': len(listing), 'images': images}), 200
 
     # Delete Image Route: /delete
     def _delete_image_route(self) -> Response:
         data = request.get_json()
-        folder = data.get("folder")
-        image = data.get("image")
-        image_path = path.join(
-            self.get_storage().get_images_path(),
-            folder,
-            image
-        )
+        batch = self._delete_images([(data.get("folder"), data.get("image"))])
 
-        if path.exists(image_path):
-            remove(image_path)
-            return jsonify({'status': 'success'})
+        if batch.get_images():
+            return jsonify({'status': 'success', 'batch': batch.to_dict()})
         else:
             return jsonify({'status': 'error'})
+
+    # Delete Images Route: /api/images/delete
+    def _delete_images_route(self) -> Tuple[Response, int]:
+        data = request.get_json(silent=True) or {}
+        images = data.get("images")
+        if not isinstance(images, list) or not all(isinstance(image, dict) for image in images):
+            return jsonify({'status': 'error', 'error': 'Expected a list of images'}), 400
+
+        batch = self._delete_images([(image.get("folder"), image.get("image")) for image in images])
+        return jsonify({'status': 'success', 'batch': batch.to_dict()}), 200
+
+    # Restore Images Route: /api/images/restore
+    def _restore_images_route(self) -> Tuple[Response, int]:
+        data = request.get_json(silent=True) or {}
+        batch = self.get_trash().restore(str(data.get("batch", "")))
+        if batch is None:
+            return jsonify({'status': 'error', 'error': 'Unknown or expired batch'}), 404
+
+        for folder, image in batch.get_images():
+            try:
+                self.get_metadata_index().get_metadata(path.join(self.get_storage().get_images_path(), folder, image))
+            except (OSError, SyntaxError, ValueError):
+                pass
+        return jsonify({'status': 'success', 'batch': batch.to_dict()}), 200
+
+    # Moves the images to the trash and forgets their metadata
+    def _delete_images(self, images: List[Tuple[Any, Any]]) -> TrashBatch:
+        batch = self.get_trash().delete([(folder, image) for folder, image in images if isinstance(folder, str) and isinstance(image, str)])
+        self.get_metadata_index().remove_images([
+            path.join(self.get_storage().get_images_path(), folder, image) for folder, image in batch.get_images()
+        ])
+        return batch
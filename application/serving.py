@@ -0,0 +1,66 @@
+from signal import signal, SIGTERM
+from typing import Callable, NoReturn
+from flask import Flask
+from .configuration import GalleryConfiguration
+
+
+# Turns a termination signal into a regular exit so the server can shut down cleanly
+def _exit_on_signal(signal_number: int, frame: object) -> NoReturn:
+    raise SystemExit(0)
+
+
+# Serves the application with waitress, a single process answering requests from a pool of threads
+def serve_threaded(app: Flask, gallery: GalleryConfiguration) -> None:
+    try:
+        from waitress import create_server
+    except ImportError:
+        raise RuntimeError("The threaded server mode needs waitress, install the requirements with `pip install -r requirements.txt`")
+
+    server = create_server(
+        app,
+        host=gallery.get_listen_address(),
+        port=gallery.get_listen_port(),
+        threads=gallery.get_threads(),
+        backlog=gallery.get_backlog(),
+        channel_timeout=gallery.get_timeout(),
+    )
+    signal(SIGTERM, _exit_on_signal)
+    try:
+        server.run()
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    finally:
+        server.close()
+
+
+# Serves the application with gunicorn, pre-forked worker processes each answering requests from a pool of threads
+def serve_prefork(app: Flask, gallery: GalleryConfiguration, post_worker_init: Callable[[], None]) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError("The prefork server mode needs gunicorn, install the requirements with `pip install -r requirements.txt`")
+
+    options = {
+        "bind": f"{gallery.get_listen_address()}:{gallery.get_listen_port()}",
+        "workers": gallery.get_workers(),
+        "worker_class": "gthread",
+        "threads": gallery.get_threads(),
+        "timeout": gallery.get_timeout(),
+        "graceful_timeout": gallery.get_graceful_timeout(),
+        "backlog": gallery.get_backlog(),
+        "keepalive": 5,
+        "post_worker_init": lambda worker: post_worker_init(),
+    }
+
+    # Class: PreforkApplication
+    class PreforkApplication(BaseApplication):
+        # Applies the gallery settings to gunicorn
+        def load_config(self) -> None:
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        # Returns the application served by the workers
+        def load(self) -> Flask:
+            return app
+
+    PreforkApplication().run()
@@ -0,0 +1,218 @@
+import sqlite3
+from os import path, scandir
+from contextlib import closing
+from typing import Dict, List, Any, Optional
+from .storage import Storage
+from .index import FolderListing
+
+
+# Class: FolderSummary
+class FolderSummary:
+    # Name of the folder
+    _name: str
+    # Modification time of the folder the summary was computed at, in nanoseconds
+    _mtime: int
+    # Number of images in the folder
+    _image_count: int
+    # Total size of the images in bytes
+    _total_size: int
+    # Modification time of the newest image in nanoseconds, None for an empty folder
+    _newest_mtime: Optional[int]
+    # Modification time of the oldest image in nanoseconds, None for an empty folder
+    _oldest_mtime: Optional[int]
+    # Name of the newest image, None for an empty folder
+    _cover: Optional[str]
+    # Entity tag of the cover image, None for an empty folder
+    _cover_etag: Optional[str]
+
+    # Constructor
+    def __init__(
+        self,
+        name: str,
+        mtime: int,
+        image_count: int,
+        total_size: int,
+        newest_mtime: Optional[int],
+        oldest_mtime: Optional[int],
+        cover: Optional[str],
+        cover_etag: Optional[str],
+    ):
+        self._name = name
+        self._mtime = mtime
+        self._image_count = image_count
+        self._total_size = total_size
+        self._newest_mtime = newest_mtime
+        self._oldest_mtime = oldest_mtime
+        self._cover = cover
+        self._cover_etag = cover_etag
+
+    # Returns the name of the folder
+    def get_name(self) -> str:
+        return self._name
+
+    # Returns the modification time of the folder the summary was computed at
+    def get_mtime(self) -> int:
+        return self._mtime
+
+    # Returns the number of images in the folder
+    def get_image_count(self) -> int:
+        return self._image_count
+
+    # Returns the total size of the images in bytes
+    def get_total_size(self) -> int:
+        return self._total_size
+
+    # Returns the modification time of the newest image
+    def get_newest_mtime(self) -> Optional[int]:
+        return self._newest_mtime
+
+    # Returns the modification time of the oldest image
+    def get_oldest_mtime(self) -> Optional[int]:
+        return self._oldest_mtime
+
+    # Returns the name of the newest image
+    def get_cover(self) -> Optional[str]:
+        return self._cover
+
+    # Returns the entity tag of the cover image
+    def get_cover_etag(self) -> Optional[str]:
+        return self._cover_etag
+
+    # Returns the summary as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.get_name(),
+            "image_count": self.get_image_count(),
+            "total_size": self.get_total_size(),
+            "newest_mtime": self.get_newest_mtime() / 1e9 if self.get_newest_mtime() is not None else None,
+            "oldest_mtime": self.get_oldest_mtime() / 1e9 if self.get_oldest_mtime() is not None else None,
+            "cover": self.get_cover(),
+        }
+
+    # Computes the summary of a folder listing
+    @staticmethod
+    def from_listing(name: str, listing: FolderListing) -> "FolderSummary":
+        files = listing.get_files()
+        return FolderSummary(
+            name,
+            listing.get_mtime(),
+            len(files),
+            sum(file.get_size() for file in files),
+            files[0].get_mtime() if files else None,
+            files[-1].get_mtime() if files else None,
+            files[0].get_name() if files else None,
+            files[0].get_etag() if files else None,
+        )
+
+    # Creates a summary from a database row
+    @staticmethod
+    def from_row(row: sqlite3.Row) -> "FolderSummary":
+        return FolderSummary(
+            row["name"],
+            row["mtime_ns"],
+            row["image_count"],
+            row["total_size"],
+            row["newest_mtime_ns"],
+            row["oldest_mtime_ns"],
+            row["cover"],
+            row["cover_etag"],
+        )
+
+
+# Class: FolderStatistics
+class FolderStatistics:
+    # Storage instance
+    _storage: Storage
+    # Path of the SQLite database holding the summaries
+    _file_path: str
+
+    # Constructor
+    def __init__(self, storage: Storage):
+        self._storage = storage
+        self._file_path = storage.get_folder_statistics_file_path()
+        self._create_schema()
+
+    # Returns the storage instance
+    def get_storage(self) -> Storage:
+        return self._storage
+
+    # Returns the path of the SQLite database holding the summaries
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the summaries of every folder, only listing the folders whose modification time changed since they were computed
+    def get_summaries(self) -> List[FolderSummary]:
+        images_path = self._storage.get_images_path()
+        with closing(self._connect()) as connection:
+            known = {row["name"]: FolderSummary.from_row(row) for row in connection.execute("SELECT * FROM folders")}
+
+        summaries: List[FolderSummary] = []
+        changed: List[FolderSummary] = []
+        for entry in scandir(images_path):
+            if not entry.is_dir():
+                continue
+            summary = known.pop(entry.name, None)
+            if summary is None or summary.get_mtime() != entry.stat().st_mtime_ns:
+                try:
+                    summary = FolderSummary.from_listing(entry.name, FolderListing.build(entry.path, self._storage.is_supported_image))
+                except OSError:
+                    continue
+                changed.append(summary)
+            summaries.append(summary)
+
+        if changed or known:
+            with closing(self._connect()) as connection, connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO folders (name, mtime_ns, image_count, total_size, newest_mtime_ns, oldest_mtime_ns, cover, cover_etag)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            summary.get_name(),
+                            summary.get_mtime(),
+                            summary.get_image_count(),
+                            summary.get_total_size(),
+                            summary.get_newest_mtime(),
+                            summary.get_oldest_mtime(),
+                            summary.get_cover(),
+                            summary.get_cover_etag(),
+                        )
+                        for summary in changed
+                    ],
+                )
+                connection.executemany("DELETE FROM folders WHERE name = ?", [(name,) for name in known])
+
+        return sorted(summaries, key=lambda summary: summary.get_name(), reverse=True)
+
+    # Forgets the summary of a folder so it is computed again on the next request
+    def invalidate(self, name: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM folders WHERE name = ?", (name,))
+
+    # Watcher callback, forgets the summary of the folder of a changed image since rewriting a file keeps the folder modification time
+    def on_change(self, event: str, file_path: str) -> None:
+        relative_path = path.relpath(file_path, self._storage.get_images_path())
+        parts = relative_path.split(path.sep)
+        if len(parts) == 2 and parts[0] not in [".", ".."]:
+            self.invalidate(parts[0])
+
+    # Opens a connection to the summaries database
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._file_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    # Creates the summaries table
+    def _create_schema(self) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS folders ("
+                " name TEXT PRIMARY KEY,"
+                " mtime_ns INTEGER NOT NULL,"
+                " image_count INTEGER NOT NULL,"
+                " total_size INTEGER NOT NULL,"
+                " newest_mtime_ns INTEGER,"
+                " oldest_mtime_ns INTEGER,"
+                " cover TEXT,"
+                " cover_etag TEXT)"
+            )
@@ -1,6 +1,133 @@
-from typing import List
+from typing import Dict, List, Optional
 from os import path, makedirs, getcwd, listdir
 from .configuration import Configuration
+from .index import FolderIndex, FolderListing
+
+
+# Class: StorageLayout
+class StorageLayout:
+    # Stable diffusion root directory
+    _stable_diffusion_path: str
+    # Models directory
+    _models_path: str
+    # Embeddings directory
+    _embeddings_path: str
+    # Scripts directory
+    _scripts_path: str
+    # Extensions directory
+    _extensions_path: str
+    # Checkpoints directory
+    _checkpoints_path: str
+    # Loras directory
+    _loras_path: str
+    # Upscalers directory
+    _upscalers_path: str
+    # Outputs directory
+    _outputs_path: str
+    # Images directory
+    _images_path: str
+    # Thumbnails directory
+    _thumbnails_path: str
+    # Trash directory
+    _trash_path: str
+    # Templates directory
+    _templates_path: str
+
+    # Constructor, the layout never changes once built
+    def __init__(self, stable_diffusion_path: str, templates_path: str):
+        self._stable_diffusion_path = stable_diffusion_path
+        self._models_path = path.join(stable_diffusion_path, "models")
+        self._embeddings_path = path.join(stable_diffusion_path, "embeddings")
+        self._scripts_path = path.join(stable_diffusion_path, "scripts")
+        self._extensions_path = path.join(stable_diffusion_path, "extensions")
+        self._checkpoints_path = path.join(self._models_path, "Stable-diffusion")
+        self._loras_path = path.join(self._models_path, "Lora")
+        self._upscalers_path = path.join(self._models_path, "ESRGAN")
+        self._outputs_path = path.join(stable_diffusion_path, "outputs")
+        self._images_path = path.join(self._outputs_path, "txt2img-images")
+        self._thumbnails_path = path.join(self._outputs_path, ".sdm-thumbnails")
+        self._trash_path = path.join(self._outputs_path, ".sdm-trash")
+        self._templates_path = templates_path
+
+    # Returns the stable diffusion root directory
+    def get_stable_diffusion_path(self) -> str:
+        return self._stable_diffusion_path
+
+    # Returns the models directory
+    def get_models_path(self) -> str:
+        return self._models_path
+
+    # Returns the embeddings directory
+    def get_embeddings_path(self) -> str:
+        return self._embeddings_path
+
+    # Returns the scripts directory
+    def get_scripts_path(self) -> str:
+        return self._scripts_path
+
+    # Returns the extensions directory
+    def get_extensions_path(self) -> str:
+        return self._extensions_path
+
+    # Returns the checkpoints directory
+    def get_checkpoints_path(self) -> str:
+        return self._checkpoints_path
+
+    # Returns the loras directory
+    def get_loras_path(self) -> str:
+        return self._loras_path
+
+    # Returns the upscalers directory
+    def get_upscalers_path(self) -> str:
+        return self._upscalers_path
+
+    # Returns the outputs directory
+    def get_outputs_path(self) -> str:
+        return self._outputs_path
+
+    # Returns the images directory
+    def get_images_path(self) -> str:
+        return self._images_path
+
+    # Returns the thumbnails directory
+    def get_thumbnails_path(self) -> str:
+        return self._thumbnails_path
+
+    # Returns the trash directory
+    def get_trash_path(self) -> str:
+        return self._trash_path
+
+    # Returns the templates directory
+    def get_templates_path(self) -> str:
+        return self._templates_path
+
+    # Returns every directory of the layout, parents before their children
+    def get_directories(self) -> List[str]:
+        return [
+            self._models_path,
+            self._embeddings_path,
+            self._scripts_path,
+            self._extensions_path,
+            self._checkpoints_path,
+            self._loras_path,
+            self._upscalers_path,
+            self._outputs_path,
+            self._images_path,
+            self._thumbnails_path,
+            self._trash_path,
+            self._templates_path,
+        ]
+
+    # Returns the directories of the layout that do not exist, one stat per directory
+    def get_missing_directories(self) -> List[str]:
+        return [directory for directory in self.get_directories() if not path.isdir(directory)]
+
+    # Creates the missing directories of the layout, returns the created ones
+    def create_missing_directories(self) -> List[str]:
+        missing = self.get_missing_directories()
+        for directory in missing:
+            makedirs(directory, exist_ok=True)
+        return missing
 
 
 # Class: Storage
@@ -14,10 +141,16 @@ class Storage:
         ".png",
         ".webp",
     ]
+    # Index of the image folders
+    _folder_index: FolderIndex
+    # Directory layout, resolved once on first use
+    _layout: Optional[StorageLayout]
 
     # Constructor
     def __init__(self, configuration: Configuration):
         self._configuration = configuration
+        self._folder_index = FolderIndex(self.is_supported_image, configuration.gallery().get_folder_index_size())
+        self._layout = None
 
     # Returns the configuration instance
     def get_configuration(self) -> Configuration:
@@ -25,17 +158,44 @@ class Storage:
 
     # Returns the stable diffusion root directory
     def get_stable_diffusion_path(self) -> str:
-        return self._configuration.stable_diffusion().get_directory()
+        return self.get_layout().get_stable_diffusion_path()
+
+    # Returns the directory layout, resolving it on first use
+    def get_layout(self) -> StorageLayout:
+        layout = self._layout
+        if layout is None:
+            layout = self.resolve_layout()
+        return layout
+
+    # Builds the directory layout from the configuration and creates its missing directories, done once at startup
+    def resolve_layout(self) -> StorageLayout:
+        layout = StorageLayout(self._configuration.stable_diffusion().get_directory(), path.join(getcwd(), "templates"))
+        layout.create_missing_directories()
+        self._layout = layout
+        return layout
+
+    # Creates the directories of the layout removed since it was resolved, returns the created ones
+    def revalidate_layout(self) -> List[str]:
+        return self.get_layout().create_missing_directories()
 
     # Returns the list of supported image extensions
     def get_supported_image_extensions(self) -> List[str]:
         return self._supported_image_extensions
 
+    # Returns TRUE if the file name has a supported image extension
+    def is_supported_image(self, file_name: str) -> bool:
+        return path.splitext(file_name)[1] in self._supported_image_extensions
+
+    # Returns the index of the image folders
+    def get_folder_index(self) -> FolderIndex:
+        return self._folder_index
+
     # Adds a new supported image extension
     def add_supported_image_extension(self, extension: str) -> "Storage":
         if not extension.startswith("."):
             extension = f".{extension}"
         self._supported_image_extensions.append(extension)
+        self._folder_index.clear()
         return self
 
     # Removes a supported image extension
@@ -43,6 +203,7 @@ class Storage:
         if not extension.startswith("."):
             extension = f".{extension}"
         self._supported_image_extensions.remove(extension)
+        self._folder_index.clear()
         return self
 
     # Sets the list of supported image extensions
@@ -51,43 +212,85 @@ class Storage:
         for extension in extensions:
             if not extension.startswith("."):
                 self._supported_image_extensions.append(f".{extension}")
+        self._folder_index.clear()
         return self
 
     # Returns the models directory
     def get_models_path(self) -> str:
-        return self._get_directory_path(self.get_stable_diffusion_path(), "models")
+        return self.get_layout().get_models_path()
 
     # Returns the embeddings directory
     def get_embeddings_path(self) -> str:
-        return self._get_directory_path(self.get_stable_diffusion_path(), "embeddings")
+        return self.get_layout().get_embeddings_path()
 
     # Returns the scripts directory
     def get_scripts_path(self) -> str:
-        return self._get_directory_path(self.get_stable_diffusion_path(), "scripts")
+        return self.get_layout().get_scripts_path()
 
     # Returns the extensions directory
     def get_extensions_path(self) -> str:
-        return self._get_directory_path(self.get_stable_diffusion_path(), "extensions")
+        return self.get_layout().get_extensions_path()
 
     # Returns the checkpoints directory
     def get_checkpoints_path(self) -> str:
-        return self._get_directory_path(self.get_models_path(), "Stable-diffusion")
+        return self.get_layout().get_checkpoints_path()
 
     # Returns the loras directory
     def get_loras_path(self) -> str:
-        return self._get_directory_path(self.get_models_path(), "Lora")
+        return self.get_layout().get_loras_path()
 
     # Returns the upscalers directory
     def get_upscalers_path(self) -> str:
-        return self._get_directory_path(self.get_models_path(), "ESRGAN")
+        return self.get_layout().get_upscalers_path()
+
+    # Returns the shared model directories keyed by their configuration section
+    def get_model_directories(self) -> Dict[str, str]:
+        return {
+            "checkpoints": self.get_checkpoints_path(),
+            "loras": self.get_loras_path(),
+            "upscalers": self.get_upscalers_path(),
+        }
+
+    # Returns the list of complete model files in the directory, leaving out hidden and partial files
+    def get_model_files(self, directory: str) -> List[str]:
+        files: List[str] = []
+
+        for item in listdir(directory):
+            item_path = path.join(directory, item)
+            if item.startswith(".") or item.endswith((".part", ".part.json", ".tmp")):
+                continue
+            if path.isfile(item_path):
+                files.append(item)
+
+        return sorted(files)
 
     # Returns the outputs directory
     def get_outputs_path(self) -> str:
-        return self._get_directory_path(self.get_stable_diffusion_path(), "outputs")
+        return self.get_layout().get_outputs_path()
 
     # Returns the images directory
     def get_images_path(self) -> str:
-        return self._get_directory_path(self.get_outputs_path(), "txt2img-images")
+        return self.get_layout().get_images_path()
+
+    # Returns the thumbnails directory, kept outside the images directory so it is never listed as a folder
+    def get_thumbnails_path(self) -> str:
+        return self.get_layout().get_thumbnails_path()
+
+    # Returns the trash directory, on the same file system as the images so deleting is a rename
+    def get_trash_path(self) -> str:
+        return self.get_layout().get_trash_path()
+
+    # Returns the image metadata index file path
+    def get_metadata_index_file_path(self) -> str:
+        return path.join(self.get_outputs_path(), ".sdm-metadata.sqlite3")
+
+    # Returns the folder statistics database file path
+    def get_folder_statistics_file_path(self) -> str:
+        return path.join(self.get_outputs_path(), ".sdm-folders.sqlite3")
+
+    # Returns the file locked by the process running the background tasks
+    def get_leader_lock_file_path(self) -> str:
+        return path.join(self.get_outputs_path(), ".sdm-leader.lock")
 
     # Returns the list of folders in the provided directory
     def get_folders(self, directory: str) -> List[str]:
@@ -100,24 +303,17 @@ class Storage:
 
         return folders
 
-    # Returns list of files in the directory
+    # Returns list of files in the directory, newest first
     def get_files(self, directory: str) -> List[str]:
-        files: List[str] = []
-
-        for item in listdir(directory):
-            item_path = path.join(directory, item)
-            if path.isfile(item_path):
-                item_extension = path.splitext(item_path)[1]
-                if item_extension in self.get_supported_image_extensions():
-                    files.append(item)
+        return self.get_folder_listing(directory).get_names()
 
-        files.sort(key=lambda x: path.getmtime(path.join(directory, x)), reverse=True)
-
-        return files
+    # Returns the indexed listing of the images in the directory, newest first
+    def get_folder_listing(self, directory: str) -> FolderListing:
+        return self._folder_index.get_listing(directory)
 
     # Returns the templates directory
     def get_templates_path(self) -> str:
-        return self._get_directory_path(getcwd(), "templates")
+        return self.get_layout().get_templates_path()
 
     # Returns the checkpoint file path
     def get_checkpoint_file_path(self, checkpoint: str) -> str:
@@ -131,6 +327,18 @@ class Storage:
     def get_upscaler_file_path(self, upscaler: str) -> str:
         return path.join(self.get_upscalers_path(), upscaler)
 
+    # Returns the download manifest file path
+    def get_download_manifest_file_path(self) -> str:
+        return path.join(self.get_models_path(), ".sdm-manifest.json")
+
+    # Returns the hash cache file path
+    def get_hash_cache_file_path(self) -> str:
+        return path.join(self.get_models_path(), ".sdm-hashes.json")
+
+    # Returns the download queue database file path
+    def get_download_queue_file_path(self) -> str:
+        return path.join(self.get_models_path(), ".sdm-queue.sqlite3")
+
     # Returns the script file path
     def get_script_file_path(self, script: str) -> str:
         return path.join(self.get_scripts_path(), script)
@@ -155,10 +363,3 @@ class Storage:
     # Returns TRUE if file exists
     def file_exists(self, file_path: str) -> bool:
         return path.isfile(file_path)
-
-    # Returns the directory path and created directory if it does not exist
-    def _get_directory_path(self, main_directory: str, sub_directory: str) -> str:
-        directory_path = path.join(main_directory, sub_directory)
-        if not self.directory_exists(directory_path):
-            self.create_directory(directory_path)
-        return directory_path
@@ -0,0 +1,184 @@
+from hashlib import sha1
+from collections import OrderedDict
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from os import path, makedirs, remove, replace, scandir, stat, getpid
+from threading import Lock
+from typing import Dict, Optional
+from PIL import Image
+from .storage import Storage
+
+# File extension and MIME type of each thumbnail format
+THUMBNAIL_FORMATS = {
+    "webp": ("webp", "image/webp"),
+    "jpeg": ("jpg", "image/jpeg"),
+}
+
+
+# Writes a downscaled copy of the source image and returns its size in bytes, runs in a worker process
+def create_thumbnail(source_path: str, target_path: str, size: int, image_format: str, quality: int) -> int:
+    with Image.open(source_path) as image:
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        has_alpha = image.mode in ["RGBA", "LA"] or (image.mode == "P" and "transparency" in image.info)
+        thumbnail = image.convert("RGBA" if has_alpha and image_format == "webp" else "RGB")
+
+    temporary_path = f"{target_path}.{getpid()}.tmp"
+    thumbnail.save(temporary_path, format=image_format.upper(), quality=quality)
+    replace(temporary_path, target_path)
+    return path.getsize(target_path)
+
+
+# Class: ThumbnailCache
+class ThumbnailCache:
+    # Storage instance
+    _storage: Storage
+    # Directory holding the cached thumbnails
+    _directory: str
+    # Cached thumbnail sizes in bytes keyed by path, least recently used first
+    _entries: "OrderedDict[str, int]"
+    # Total size of the cached thumbnails in bytes
+    _total_size: int
+    # Thumbnails being generated, keyed by path
+    _pending: Dict[str, Future]
+    # Lock guarding the entries and the pending thumbnails
+    _lock: Lock
+    # Process pool generating thumbnails, created with the first thumbnail
+    _executor: Optional[ProcessPoolExecutor]
+    # TRUE once the existing thumbnails have been indexed
+    _loaded: bool
+
+    # Constructor
+    def __init__(self, storage: Storage):
+        self._storage = storage
+        self._directory = storage.get_thumbnails_path()
+        self._entries = OrderedDict()
+        self._total_size = 0
+        self._pending = {}
+        self._lock = Lock()
+        self._executor = None
+        self._loaded = False
+
+    # Returns the storage instance
+    def get_storage(self) -> Storage:
+        return self._storage
+
+    # Returns the directory holding the cached thumbnails
+    def get_directory(self) -> str:
+        return self._directory
+
+    # Returns the total size of the cached thumbnails in bytes
+    def get_total_size(self) -> int:
+        return self._total_size
+
+    # Returns the MIME type of the thumbnails
+    def get_mimetype(self) -> str:
+        return THUMBNAIL_FORMATS[self._storage.get_configuration().gallery().get_thumbnail_format()][1]
+
+    # Returns the cache path of the thumbnail for the source image in its current version
+    def get_thumbnail_path(self, source_path: str) -> str:
+        gallery = self._storage.get_configuration().gallery()
+        source_stat = stat(source_path)
+        key = sha1(
+            f"{path.abspath(source_path)}:{source_stat.st_mtime_ns}:{source_stat.st_size}:"
+            f"{gallery.get_thumbnail_size()}:{gallery.get_thumbnail_format()}:{gallery.get_thumbnail_quality()}".encode()
+        ).hexdigest()
+        extension = THUMBNAIL_FORMATS[gallery.get_thumbnail_format()][0]
+        return path.join(self._directory, key[:2], f"{key}.{extension}")
+
+    # Returns the path of the thumbnail of the source image, generating it if it is not cached
+    def get_thumbnail(self, source_path: str) -> str:
+        thumbnail_path = self.get_thumbnail_path(source_path)
+        with self._lock:
+            self._load()
+            # Other worker processes may have generated or evicted the thumbnail, so the file decides
+            thumbnail_size = self._entries.pop(thumbnail_path, None)
+            if thumbnail_size is not None:
+                self._total_size -= thumbnail_size
+            try:
+                thumbnail_size = stat(thumbnail_path).st_size
+            except FileNotFoundError:
+                thumbnail_size = None
+            if thumbnail_size is not None:
+                self._entries[thumbnail_path] = thumbnail_size
+                self._total_size += thumbnail_size
+                return thumbnail_path
+
+            future = self._pending.get(thumbnail_path)
+            if future is None:
+                makedirs(path.dirname(thumbnail_path), exist_ok=True)
+                gallery = self._storage.get_configuration().gallery()
+                future = self._get_executor().submit(
+                    create_thumbnail,
+                    source_path,
+                    thumbnail_path,
+                    gallery.get_thumbnail_size(),
+                    gallery.get_thumbnail_format(),
+                    gallery.get_thumbnail_quality(),
+                )
+                self._pending[thumbnail_path] = future
+
+        try:
+            thumbnail_size = future.result()
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(thumbnail_path, None)
+
+        with self._lock:
+            if thumbnail_path not in self._entries:
+                self._entries[thumbnail_path] = thumbnail_size
+                self._total_size += thumbnail_size
+                self._evict()
+        return thumbnail_path
+
+    # Stops the process pool
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # Returns the process pool, starting it if needed
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._storage.get_configuration().gallery().get_thumbnail_workers(),
+                mp_context=get_context("forkserver"),
+            )
+        return self._executor
+
+    # Indexes the thumbnails left by previous runs, oldest first
+    def _load(self) -> None:
+        if self._loaded:
+            return
+
+        thumbnails = []
+        for directory in scandir(self._directory):
+            if not directory.is_dir():
+                continue
+            for entry in scandir(directory.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                entry_stat = entry.stat()
+                thumbnails.append((entry_stat.st_mtime, entry.path, entry_stat.st_size))
+
+        for _, thumbnail_path, thumbnail_size in sorted(thumbnails):
+            self._entries[thumbnail_path] = thumbnail_size
+            self._total_size += thumbnail_size
+        self._loaded = True
+        self._evict()
+
+    # Removes the least recently used thumbnails until the cache fits its size limit
+    def _evict(self) -> None:
+        max_size = self._storage.get_configuration().gallery().get_thumbnail_cache_size()
+        while self._total_size > max_size and len(self._entries) > 1:
+            thumbnail_path, thumbnail_size = self._entries.popitem(last=False)
+            self._total_size -= thumbnail_size
+            try:
+                remove(thumbnail_path)
+            except OSError:
+                pass
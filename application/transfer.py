@@ -0,0 +1,205 @@
+from os import path, remove, replace
+from json import dumps, loads
+from threading import Lock
+from typing import Dict, List, Any, Optional
+
+
+# Class: RemoteFile
+class RemoteFile:
+    # URL of the remote file
+    _url: str
+    # Size of the remote file in bytes (0 if unknown)
+    _size: int
+    # TRUE if the server accepts byte range requests
+    _accepts_ranges: bool
+    # ETag validator reported by the server
+    _etag: str
+    # Last-Modified validator reported by the server
+    _last_modified: str
+    # Expected SHA-256 or short AUTOV2 hash of the content (empty if unknown)
+    _sha256: str
+
+    # Constructor
+    def __init__(self, url: str, size: int, accepts_ranges: bool, etag: str = "", last_modified: str = "", sha256: str = ""):
+        self._url = url
+        self._size = size
+        self._accepts_ranges = accepts_ranges
+        self._etag = etag
+        self._last_modified = last_modified
+        self._sha256 = sha256
+
+    # Returns the URL of the remote file
+    def get_url(self) -> str:
+        return self._url
+
+    # Returns the size of the remote file
+    def get_size(self) -> int:
+        return self._size
+
+    # Returns TRUE if the server accepts byte range requests
+    def accepts_ranges(self) -> bool:
+        return self._accepts_ranges
+
+    # Returns the ETag validator
+    def get_etag(self) -> str:
+        return self._etag
+
+    # Returns the Last-Modified validator
+    def get_last_modified(self) -> str:
+        return self._last_modified
+
+    # Returns the expected hash of the content
+    def get_sha256(self) -> str:
+        return self._sha256
+
+    # Returns a copy of the remote file with the expected hash of its content
+    def with_sha256(self, sha256: str) -> "RemoteFile":
+        return RemoteFile(self._url, self._size, self._accepts_ranges, self._etag, self._last_modified, sha256)
+
+    # Returns the remote file as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.get_url(),
+            "size": self.get_size(),
+            "accepts_ranges": self.accepts_ranges(),
+            "etag": self.get_etag(),
+            "last_modified": self.get_last_modified(),
+            "sha256": self.get_sha256(),
+        }
+
+
+# Class: PartialDownload
+class PartialDownload:
+    # Final path of the downloaded file
+    _file_path: str
+    # Remote file being downloaded
+    _remote_file: RemoteFile
+    # Byte ranges as [start, end, downloaded] triples, end inclusive
+    _ranges: List[List[int]]
+    # Lock guarding the ranges and the state file
+    _lock: Lock
+
+    # Constructor
+    def __init__(self, file_path: str, remote_file: RemoteFile, ranges: List[List[int]]):
+        self._file_path = file_path
+        self._remote_file = remote_file
+        self._ranges = ranges
+        self._lock = Lock()
+
+    # Returns the final path of the downloaded file
+    def get_file_path(self) -> str:
+        return self._file_path
+
+    # Returns the path of the partial file
+    def get_part_path(self) -> str:
+        return f"{self._file_path}.part"
+
+    # Returns the path of the sidecar state file
+    def get_state_path(self) -> str:
+        return f"{self._file_path}.part.json"
+
+    # Returns the remote file being downloaded
+    def get_remote_file(self) -> RemoteFile:
+        return self._remote_file
+
+    # Returns the byte ranges of the download
+    def get_ranges(self) -> List[List[int]]:
+        return self._ranges
+
+    # Returns the number of bytes already downloaded
+    def get_downloaded_size(self) -> int:
+        with self._lock:
+            return sum(byte_range[2] for byte_range in self._ranges)
+
+    # Returns TRUE if every byte range is complete
+    def is_complete(self) -> bool:
+        with self._lock:
+            return all(start + downloaded > end for start, end, downloaded in self._ranges)
+
+    # Records downloaded bytes for a byte range
+    def advance(self, index: int, size: int) -> None:
+        with self._lock:
+            self._ranges[index][2] += size
+
+    # Creates the partial file if needed, preallocated to the remote size
+    def prepare(self) -> None:
+        if not path.exists(self.get_part_path()):
+            with open(self.get_part_path(), "wb") as file:
+                file.truncate(self._remote_file.get_size())
+        self.save()
+
+    # Writes the sidecar state atomically
+    def save(self) -> None:
+        with self._lock:
+            state = {
+                "remote_file": self._remote_file.to_dict(),
+                "ranges": [list(byte_range) for byte_range in self._ranges],
+            }
+        temporary_path = f"{self.get_state_path()}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(dumps(state))
+        replace(temporary_path, self.get_state_path())
+
+    # Moves the partial file into place and removes the sidecar state
+    def complete(self) -> None:
+        replace(self.get_part_path(), self._file_path)
+        if path.exists(self.get_state_path()):
+            remove(self.get_state_path())
+
+    # Removes the partial file and the sidecar state
+    def discard(self) -> None:
+        for file_path in [self.get_part_path(), self.get_state_path()]:
+            if path.exists(file_path):
+                remove(file_path)
+
+    # Resumes a previous partial download of the same remote file, or starts a new one
+    @staticmethod
+    def open(file_path: str, remote_file: RemoteFile, ranges: List[List[int]]) -> "PartialDownload":
+        previous = PartialDownload.load(file_path)
+        if previous is not None and PartialDownload._is_resumable(previous, remote_file):
+            return PartialDownload(file_path, remote_file, previous.get_ranges())
+
+        if previous is not None:
+            previous.discard()
+        return PartialDownload(file_path, remote_file, ranges)
+
+    # Loads a partial download from its sidecar state
+    @staticmethod
+    def load(file_path: str) -> Optional["PartialDownload"]:
+        download = PartialDownload(file_path, RemoteFile("", 0, False), [])
+        if not path.exists(download.get_state_path()) or not path.exists(download.get_part_path()):
+            return None
+
+        try:
+            with open(download.get_state_path(), "r") as file:
+                state = loads(file.read())
+            remote_file = state["remote_file"]
+            return PartialDownload(
+                file_path,
+                RemoteFile(
+                    url=remote_file["url"],
+                    size=remote_file["size"],
+                    accepts_ranges=remote_file["accepts_ranges"],
+                    etag=remote_file["etag"],
+                    last_modified=remote_file["last_modified"],
+                    sha256=remote_file.get("sha256", ""),
+                ),
+                [list(byte_range) for byte_range in state["ranges"]],
+            )
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    # Returns TRUE if the previous partial download can be continued for the remote file. Validators are only comparable for the
+    # same URL, a part file from another URL is only known to hold the same content when both carry the same expected hash
+    @staticmethod
+    def _is_resumable(previous: "PartialDownload", remote_file: RemoteFile) -> bool:
+        previous_remote_file = previous.get_remote_file()
+        if not remote_file.accepts_ranges():
+            return False
+        if previous_remote_file.get_size() != remote_file.get_size():
+            return False
+        if previous_remote_file.get_url() != remote_file.get_url():
+            return remote_file.get_sha256() != "" and previous_remote_file.get_sha256().lower() == remote_file.get_sha256().lower()
+        if previous_remote_file.get_etag() != remote_file.get_etag():
+            return False
+        return previous_remote_file.get_last_modified() == remote_file.get_last_modified()
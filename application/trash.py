@@ -0,0 +1,191 @@
+import re
+from os import path, makedirs, rename, rmdir, scandir, link, unlink
+from shutil import rmtree
+from secrets import token_hex
+from time import time_ns, sleep, perf_counter
+from threading import Thread
+from typing import Dict, List, Any, Optional, Tuple
+from .storage import Storage
+from .metrics import IMAGE_TRASH_DURATION, IMAGE_TRASH_OPERATIONS
+
+# Name of a trash batch: deletion time in nanoseconds and a random suffix
+BATCH_PATTERN = re.compile(r"^(\d+)-[0-9a-f]{8}$")
+
+
+# Class: TrashBatch
+class TrashBatch:
+    # Identifier of the batch, also the name of its trash directory
+    _id: str
+    # Deletion time in nanoseconds
+    _deleted_at: int
+    # Number of seconds the batch can be restored for
+    _undo_window: float
+    # Images of the batch as (folder, image) pairs
+    _images: List[Tuple[str, str]]
+    # Images left in the trash because another file took their name, as (folder, image) pairs
+    _skipped: List[Tuple[str, str]]
+
+    # Constructor
+    def __init__(self, batch_id: str, deleted_at: int, undo_window: float, images: List[Tuple[str, str]], skipped: List[Tuple[str, str]] = None):
+        self._id = batch_id
+        self._deleted_at = deleted_at
+        self._undo_window = undo_window
+        self._images = images
+        self._skipped = skipped or []
+
+    # Returns the identifier of the batch
+    def get_id(self) -> str:
+        return self._id
+
+    # Returns the deletion time in nanoseconds
+    def get_deleted_at(self) -> int:
+        return self._deleted_at
+
+    # Returns the time in seconds after which the batch can no longer be restored
+    def get_expires_at(self) -> float:
+        return self._deleted_at / 1e9 + self._undo_window
+
+    # Returns the images of the batch as (folder, image) pairs
+    def get_images(self) -> List[Tuple[str, str]]:
+        return self._images
+
+    # Returns the images left in the trash because another file took their name, as (folder, image) pairs
+    def get_skipped(self) -> List[Tuple[str, str]]:
+        return self._skipped
+
+    # Returns the batch as a dictionary
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.get_id(),
+            "deleted_at": self.get_deleted_at() / 1e9,
+            "expires_at": self.get_expires_at(),
+            "images": [{"folder": folder, "image": image} for folder, image in self.get_images()],
+            "skipped": [{"folder": folder, "image": image} for folder, image in self.get_skipped()],
+        }
+
+
+# Class: Trash
+class Trash:
+    # Storage instance
+    _storage: Storage
+    # Number of seconds deleted images can be restored before they are purged
+    _undo_window: float
+    # Purging thread, started on demand
+    _thread: Optional[Thread]
+
+    # Constructor
+    def __init__(self, storage: Storage, undo_window: float):
+        self._storage = storage
+        self._undo_window = undo_window
+        self._thread = None
+
+    # Returns the storage instance
+    def get_storage(self) -> Storage:
+        return self._storage
+
+    # Returns the number of seconds deleted images can be restored
+    def get_undo_window(self) -> float:
+        return self._undo_window
+
+    # Moves the images to a new trash batch, skipping invalid and missing ones, and forgets the listings of their folders
+    def delete(self, images: List[Tuple[str, str]]) -> TrashBatch:
+        started_at = perf_counter()
+        deleted_at = time_ns()
+        batch_id = f"{deleted_at}-{token_hex(4)}"
+        batch_directory = path.join(self._storage.get_trash_path(), batch_id)
+        images_path = self._storage.get_images_path()
+
+        deleted: List[Tuple[str, str]] = []
+        for folder, image in dict.fromkeys(images):
+            if not self._is_valid_name(folder) or not self._is_valid_name(image) or not self._storage.is_supported_image(image):
+                continue
+            makedirs(path.join(batch_directory, folder), exist_ok=True)
+            try:
+                rename(path.join(images_path, folder, image), path.join(batch_directory, folder, image))
+            except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+                continue
+            deleted.append((folder, image))
+
+        self._invalidate_folders(deleted)
+        if not deleted and path.isdir(batch_directory):
+            rmtree(batch_directory, ignore_errors=True)
+        IMAGE_TRASH_DURATION.observe(perf_counter() - started_at, "delete")
+        IMAGE_TRASH_OPERATIONS.inc("delete", amount=len(deleted))
+        return TrashBatch(batch_id, deleted_at, self._undo_window, deleted)
+
+    # Moves the images of a batch back to their folders, returns None if the batch is unknown or its undo window is over
+    # An image whose name was taken in the meantime is never overwritten, it stays in the trash and is reported as skipped
+    def restore(self, batch_id: str) -> Optional[TrashBatch]:
+        started_at = perf_counter()
+        match = BATCH_PATTERN.match(batch_id)
+        batch_directory = path.join(self._storage.get_trash_path(), batch_id)
+        if match is None or not path.isdir(batch_directory) or self._is_expired(int(match.group(1))):
+            return None
+
+        images_path = self._storage.get_images_path()
+        restored: List[Tuple[str, str]] = []
+        skipped: List[Tuple[str, str]] = []
+        for folder in scandir(batch_directory):
+            makedirs(path.join(images_path, folder.name), exist_ok=True)
+            for entry in scandir(folder.path):
+                try:
+                    link(entry.path, path.join(images_path, folder.name, entry.name))
+                except FileExistsError:
+                    skipped.append((folder.name, entry.name))
+                    continue
+                unlink(entry.path)
+                restored.append((folder.name, entry.name))
+            try:
+                rmdir(folder.path)
+            except OSError:
+                pass
+
+        try:
+            rmdir(batch_directory)
+        except OSError:
+            pass
+        self._invalidate_folders(restored)
+        IMAGE_TRASH_DURATION.observe(perf_counter() - started_at, "restore")
+        IMAGE_TRASH_OPERATIONS.inc("restore", amount=len(restored))
+        return TrashBatch(batch_id, int(match.group(1)), self._undo_window, restored, skipped)
+
+    # Deletes the batches whose undo window is over, returns the number of deleted batches
+    def purge(self) -> int:
+        purged = 0
+        for entry in scandir(self._storage.get_trash_path()):
+            match = BATCH_PATTERN.match(entry.name)
+            if match is not None and self._is_expired(int(match.group(1))):
+                rmtree(entry.path, ignore_errors=True)
+                purged += 1
+        return purged
+
+    # Starts purging expired batches in the background
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # Purging thread
+    def _run(self) -> None:
+        interval = min(60.0, max(1.0, self._undo_window / 2))
+        while True:
+            try:
+                self.purge()
+            except FileNotFoundError:
+                self._storage.revalidate_layout()
+            except OSError as exception:
+                print(f"Unable to purge the trash: {exception}")
+            sleep(interval)
+
+    # Returns TRUE if a batch deleted at the given time can no longer be restored
+    def _is_expired(self, deleted_at: int) -> bool:
+        return time_ns() - deleted_at > self._undo_window * 1e9
+
+    # Returns TRUE if the name is a plain, visible file or folder name
+    def _is_valid_name(self, name: str) -> bool:
+        return isinstance(name, str) and name != "" and not name.startswith(".") and "/" not in name and "\0" not in name
+
+    # Forgets the listings of the folders of the images, once per folder
+    def _invalidate_folders(self, images: List[Tuple[str, str]]) -> None:
+        for folder in set(folder for folder, _ in images):
+            self._storage.get_folder_index().invalidate(path.join(self._storage.get_images_path(), folder))
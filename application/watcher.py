@@ -0,0 +1,203 @@
+import ctypes
+import ctypes.util
+from os import path, read, close, scandir, stat, fsencode, fsdecode
+from struct import unpack_from, calcsize
+from time import sleep, time_ns
+from threading import Thread, Lock
+from typing import Dict, List, Tuple, Callable, Optional
+
+# Event sent when a file or folder appears or is rewritten
+CREATED = "created"
+# Event sent when a file or folder disappears
+DELETED = "deleted"
+
+# inotify flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+# Layout of the fixed part of an inotify event: watch descriptor, mask, cookie, name length
+INOTIFY_EVENT = "iIII"
+INOTIFY_EVENT_SIZE = calcsize(INOTIFY_EVENT)
+
+
+# Class: DirectoryWatcher
+class DirectoryWatcher:
+    # Watched directory, its direct subfolders are watched as well
+    _directory: str
+    # Number of seconds between two scans when inotify is not available
+    _interval: float
+    # Callbacks receiving the event and the path of the changed file or folder
+    _listeners: List[Callable[[str, str], None]]
+    # Lock guarding the listeners
+    _lock: Lock
+    # Watching thread, started on demand
+    _thread: Optional[Thread]
+    # Folder modification times and file versions seen by the last scan
+    _snapshots: Dict[str, Tuple[int, Dict[str, Tuple[int, int]]]]
+
+    # Constructor
+    def __init__(self, directory: str, interval: float = 2.0):
+        self._directory = directory
+        self._interval = interval
+        self._listeners = []
+        self._lock = Lock()
+        self._thread = None
+        self._snapshots = {}
+
+    # Returns the watched directory
+    def get_directory(self) -> str:
+        return self._directory
+
+    # Returns the number of seconds between two scans when inotify is not available
+    def get_interval(self) -> float:
+        return self._interval
+
+    # Registers a callback receiving the event and the path of the changed file or folder
+    def add_listener(self, listener: Callable[[str, str], None]) -> "DirectoryWatcher":
+        with self._lock:
+            self._listeners.append(listener)
+        return self
+
+    # Starts watching in the background
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # Watching thread, uses inotify where available and falls back to scanning
+    def _run(self) -> None:
+        try:
+            self._watch_inotify()
+        except (OSError, AttributeError):
+            self._scan(notify=False)
+            self._watch_polling()
+
+    # Sends an event to every listener
+    def _notify(self, event: str, file_path: str) -> None:
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event, file_path)
+            except Exception as exception:
+                print(f"Unable to handle {event} event for `{file_path}`: {exception}")
+
+    # Waits for inotify events on the directory and its subfolders
+    def _watch_inotify(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        file_descriptor = libc.inotify_init1(IN_CLOEXEC)
+        if file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+        watches: Dict[int, str] = {}
+
+        def add_watch(directory: str) -> None:
+            watch_descriptor = libc.inotify_add_watch(file_descriptor, fsencode(directory), mask)
+            if watch_descriptor < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            watches[watch_descriptor] = directory
+
+        try:
+            add_watch(self._directory)
+            for entry in scandir(self._directory):
+                if entry.is_dir():
+                    add_watch(entry.path)
+            # Seeds the snapshots once the watches are in place, so a queue overflow only reports real differences
+            self._scan(notify=False)
+
+            while True:
+                data = read(file_descriptor, 64 * 1024)
+                offset = 0
+                while offset < len(data):
+                    watch_descriptor, event_mask, _, name_length = unpack_from(INOTIFY_EVENT, data, offset)
+                    name = fsdecode(data[offset + INOTIFY_EVENT_SIZE:offset + INOTIFY_EVENT_SIZE + name_length].rstrip(b"\0"))
+                    offset += INOTIFY_EVENT_SIZE + name_length
+
+                    if event_mask & IN_Q_OVERFLOW:
+                        self._scan(notify=True)
+                        continue
+                    if event_mask & IN_IGNORED:
+                        watches.pop(watch_descriptor, None)
+                        continue
+                    directory = watches.get(watch_descriptor)
+                    if directory is None or name == "":
+                        continue
+
+                    file_path = path.join(directory, name)
+                    if event_mask & IN_ISDIR:
+                        if event_mask & (IN_CREATE | IN_MOVED_TO) and directory == self._directory:
+                            add_watch(file_path)
+                            self._notify(CREATED, file_path)
+                            self._scan_folder(file_path, notify=True)
+                        elif event_mask & (IN_DELETE | IN_MOVED_FROM):
+                            self._notify(DELETED, file_path)
+                    elif event_mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self._notify(CREATED, file_path)
+                    elif event_mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._notify(DELETED, file_path)
+        finally:
+            close(file_descriptor)
+
+    # Scans the directory at a fixed interval
+    def _watch_polling(self) -> None:
+        while True:
+            sleep(self._interval)
+            self._scan(notify=True)
+
+    # Compares the directory with the previous scan, only listing folders whose modification time changed
+    def _scan(self, notify: bool) -> None:
+        folders = []
+        for entry in scandir(self._directory):
+            if entry.is_dir():
+                folders.append(entry.path)
+
+        for folder in set(self._snapshots) - set(folders):
+            del self._snapshots[folder]
+            if notify:
+                self._notify(DELETED, folder)
+
+        for folder in folders:
+            if folder not in self._snapshots and notify:
+                self._notify(CREATED, folder)
+            self._scan_folder(folder, notify)
+
+    # Compares a folder with the previous scan, rescanning it while its modification time keeps changing
+    def _scan_folder(self, folder: str, notify: bool) -> None:
+        try:
+            folder_mtime = stat(folder).st_mtime_ns
+        except OSError:
+            return
+
+        previous_mtime, previous_files = self._snapshots.get(folder, (None, {}))
+        if folder_mtime == previous_mtime and not self._is_recent(folder_mtime):
+            return
+
+        files: Dict[str, Tuple[int, int]] = {}
+        try:
+            for entry in scandir(folder):
+                if entry.is_file():
+                    entry_stat = entry.stat()
+                    files[entry.name] = (entry_stat.st_mtime_ns, entry_stat.st_size)
+        except OSError:
+            return
+        self._snapshots[folder] = (folder_mtime, files)
+
+        if notify:
+            for name, version in files.items():
+                if previous_files.get(name) != version:
+                    self._notify(CREATED, path.join(folder, name))
+            for name in set(previous_files) - set(files):
+                self._notify(DELETED, path.join(folder, name))
+
+    # Returns TRUE if the modification time is recent enough for files in the folder to still be growing
+    def _is_recent(self, mtime_ns: int) -> bool:
+        return time_ns() - mtime_ns < self._interval * 2 * 1_000_000_000
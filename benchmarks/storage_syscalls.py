@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Counts the file system calls made per gallery request with the storage layout resolved once at startup, compared with
+# resolving every directory on each path getter as Storage did before. Run from anywhere: python benchmarks/storage_syscalls.py
+import os
+import sys
+import argparse
+from collections import Counter
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+
+# Counter of the file system calls made while counting is enabled
+calls: Counter = Counter()
+# TRUE while the calls are counted
+counting = False
+
+
+# Wraps an os function so its calls are counted, must run before the application modules import it
+def count(name: str) -> None:
+    function = getattr(os, name)
+
+    def wrapper(*args, **kwargs):
+        if counting:
+            calls[name] += 1
+        return function(*args, **kwargs)
+
+    setattr(os, name, wrapper)
+
+
+# Counts the calls which only show up as audit events
+def audit(event: str, args: tuple) -> None:
+    if counting and event in ["open", "os.scandir", "os.listdir", "os.mkdir"]:
+        calls[event.replace("os.", "")] += 1
+
+
+for function_name in ["stat", "lstat"]:
+    count(function_name)
+sys.addaudithook(audit)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from PIL import Image
+from application import Configuration, Storage, Server
+
+
+# Class: PerCallStorage
+class PerCallStorage(Storage):
+    # Returns the stable diffusion root directory
+    def get_stable_diffusion_path(self) -> str:
+        return self.get_configuration().stable_diffusion().get_directory()
+
+    # Returns the models directory
+    def get_models_path(self) -> str:
+        return self._get_directory_path(self.get_stable_diffusion_path(), "models")
+
+    # Returns the checkpoints directory
+    def get_checkpoints_path(self) -> str:
+        return self._get_directory_path(self.get_models_path(), "Stable-diffusion")
+
+    # Returns the outputs directory
+    def get_outputs_path(self) -> str:
+        return self._get_directory_path(self.get_stable_diffusion_path(), "outputs")
+
+    # Returns the images directory
+    def get_images_path(self) -> str:
+        return self._get_directory_path(self.get_outputs_path(), "txt2img-images")
+
+    # Returns the thumbnails directory
+    def get_thumbnails_path(self) -> str:
+        return self._get_directory_path(self.get_outputs_path(), ".sdm-thumbnails")
+
+    # Returns the trash directory
+    def get_trash_path(self) -> str:
+        return self._get_directory_path(self.get_outputs_path(), ".sdm-trash")
+
+    # Returns the templates directory
+    def get_templates_path(self) -> str:
+        return self._get_directory_path(os.getcwd(), "templates")
+
+    # Returns the directory path and creates the directory if it does not exist, on every call
+    def _get_directory_path(self, main_directory: str, sub_directory: str) -> str:
+        directory_path = os.path.join(main_directory, sub_directory)
+        if not self.directory_exists(directory_path):
+            self.create_directory(directory_path)
+        return directory_path
+
+
+# Creates a stable diffusion tree with a folder of small images
+def create_tree(directory: str, images: int) -> None:
+    folder = os.path.join(directory, "outputs", "txt2img-images", "2026-10-17")
+    os.makedirs(folder)
+    for index in range(images):
+        Image.new("RGB", (64, 64), (index * 5 % 256, 80, 160)).save(os.path.join(folder, f"{index:05d}-1234.png"))
+
+
+# Returns the average number of calls per request of each kind for the given URLs
+def measure(storage: Storage, urls: List[str], requests: int) -> Dict[str, Dict[str, float]]:
+    global counting
+    client = Server(storage.get_configuration(), storage).get_app().test_client()
+    results: Dict[str, Dict[str, float]] = {}
+    for url in urls:
+        client.get(url)
+        calls.clear()
+        counting = True
+        for _ in range(requests):
+            response = client.get(url)
+            response.close()
+        counting = False
+        results[url] = {name: total / requests for name, total in calls.items()}
+        results[url]["status"] = response.status_code
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Counts the file system calls made per gallery request")
+    parser.add_argument("--images", type=int, default=50, help="Number of images in the benchmark folder")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests per URL")
+    args = parser.parse_args()
+
+    urls = [
+        "/2026-10-17",
+        "/2026-10-17/00010-1234.png",
+        "/txt2img-images/2026-10-17/00010-1234.png",
+        "/api/folders/2026-10-17/images?limit=20",
+        "/api/folders/2026-10-17/images/00010-1234.png/window",
+    ]
+    with TemporaryDirectory() as directory:
+        create_tree(directory, args.images)
+        configuration = Configuration.from_dict({"stable_diffusion": {"path": directory}, "gallery": {"watch": False}})
+
+        legacy = measure(PerCallStorage(configuration), urls, args.requests)
+        resolved_storage = Storage(configuration)
+        resolved_storage.resolve_layout()
+        resolved = measure(resolved_storage, urls, args.requests)
+
+    kinds = ["stat", "lstat", "open", "scandir", "listdir", "mkdir"]
+    print(f"{'request':<58}{'status':>7}{'per-call':>10}{'resolved':>10}{'saved':>8}")
+    for url in urls:
+        before = sum(legacy[url].get(kind, 0) for kind in kinds)
+        after = sum(resolved[url].get(kind, 0) for kind in kinds)
+        print(f"{url:<58}{int(resolved[url]['status']):>7}{before:>10.1f}{after:>10.1f}{before - after:>8.1f}")
+        for kind in kinds:
+            if legacy[url].get(kind, 0) or resolved[url].get(kind, 0):
+                print(f"  {kind:<56}{'':>7}{legacy[url].get(kind, 0):>10.1f}{resolved[url].get(kind, 0):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
+import sys
 import argparse
-from application import Configuration, Storage, Downloader, Server
+from application import Configuration, Storage, Downloader, Server, METRICS
 
 configuration = Configuration.from_yaml()
+METRICS.set_enabled(configuration.gallery().is_metrics_enabled())
 storage = Storage(configuration)
+storage.resolve_layout()
 
 
 # Starts the server
@@ -13,18 +16,22 @@ def server_handler() -> None:
     server.start()
 
 
-# Downloads all the missing data
+# Downloads all the missing data, exits with a non-zero status if any download failed
 def downloader_handler() -> None:
     downloader = Downloader(storage)
+    jobs = []
 
     for checkpoint in configuration.stable_diffusion().get_checkpoints().get_entities():
-        downloader.download_checkpoint(checkpoint)
+        jobs.append(downloader.create_checkpoint_job(checkpoint))
 
     for lora in configuration.stable_diffusion().get_loras().get_entities():
-        downloader.download_lora(lora)
+        jobs.append(downloader.create_lora_job(lora))
 
     for upscaler in configuration.stable_diffusion().get_upscalers().get_entities():
-        downloader.download_upscaler(upscaler)
+        jobs.append(downloader.create_upscaler_job(upscaler))
+
+    if downloader.download(jobs):
+        sys.exit(1)
 
 
 def main():